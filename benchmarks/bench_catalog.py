@@ -0,0 +1,73 @@
+""" Multi-threaded stress and throughput benchmark for ConcurrentCatalog
+
+Usage: python -m benchmarks.bench_catalog [records] [readers] [seconds]
+
+Reader threads perform lookups and indexed queries while one writer thread
+applies batches of updates. Reports reads/s, batches/s and the slowest read.
+
+"""
+
+import sys
+import threading
+import time
+
+from pypidinst.catalog import ConcurrentCatalog
+from pypidinst.pidinst import PIDInst, Identifier, Owner, OwnerIdentifier, Manufacturer
+from pypidinst.query import Field
+
+
+def synthetic_record(i, revision=0):
+    record = PIDInst(landing_page=f'https://instruments.example.org/{i}', name=f'Instrument {i} r{revision}')
+    record.identifier = Identifier(identifier_value=f'10.1000/inst{i}', identifier_type='DOI')
+    owner = Owner(owner_name=f'Owner {i % 100}')
+    owner.owner_identifier = OwnerIdentifier(owner_identifier_value=f'0000-0000-0000-{i % 100:04d}', owner_identifier_type='ORCID')
+    record.append_owner(owner)
+    record.append_manufacturer(Manufacturer(manufacturer_name=f'Manufacturer {i % 20}'))
+    return record
+
+
+def main(count, readers, seconds):
+    catalog = ConcurrentCatalog((synthetic_record(i) for i in range(count)), index_paths=['owners.owner_identifier.owner_identifier_value'])
+    stop = threading.Event()
+    reads = [0] * readers
+    slowest = [0.0] * readers
+    batches = [0]
+    term = Field('owners.owner_identifier.owner_identifier_value') == '0000-0000-0000-0007'
+
+    def reader(n):
+        i = n
+        while not stop.is_set():
+            started = time.perf_counter()
+            snapshot = catalog.snapshot()
+            record = snapshot.get(f'10.1000/inst{i % count}')
+            assert record is not None
+            if i % 50 == 0:
+                snapshot.query(term)
+            slowest[n] = max(slowest[n], time.perf_counter() - started)
+            reads[n] += 1
+            i += readers
+
+    def writer():
+        revision = 0
+        while not stop.is_set():
+            revision += 1
+            with catalog.batch() as batch:
+                for i in range(revision * 100, revision * 100 + 100):
+                    batch.put(synthetic_record(i % count, revision))
+            batches[0] += 1
+
+    threads = [threading.Thread(target=reader, args=(n,)) for n in range(readers)] + [threading.Thread(target=writer)]
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    print(f"{sum(reads) / seconds:,.0f} reads/s over {readers} threads, {batches[0] / seconds:,.1f} batches/s of 100 records, "
+          f"slowest read {max(slowest) * 1000:.2f} ms, final generation {catalog.snapshot().generation}")
+
+
+if __name__ == '__main__':
+    args = [int(arg) for arg in sys.argv[1:]]
+    main(*(args + [10000, 4, 5][len(args):]))
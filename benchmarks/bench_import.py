@@ -0,0 +1,59 @@
+""" Import time benchmark
+
+Usage: python -m benchmarks.bench_import [budget_ms]
+
+Runs each statement below in a fresh interpreter with -X importtime and
+reports the cumulative import time of pypidinst modules and the heaviest
+modules pulled in. Exits non-zero if `import pypidinst` itself exceeds
+budget_ms (default 5) or loads any heavy module.
+
+"""
+
+import subprocess
+import sys
+
+STATEMENTS = [
+    'import pypidinst',
+    'from pypidinst import PIDInst',
+    'from pypidinst import from_dict, SchemaValidator',
+    'from pypidinst import ConcurrentCatalog, Field',
+    'from pypidinst import ArchiveReader',
+    'from pypidinst import ShardedCatalog',
+    'from pypidinst.cli import main',
+]
+
+# Modules `import pypidinst` must never load
+HEAVY_MODULES = ('multiprocessing', 'lzma', 'concurrent.futures', 'json', 'threading', 'csv')
+
+
+def import_times(statement):
+    ''' Returns {module: (cumulative microseconds, nesting depth)} for a statement run in a fresh interpreter '''
+
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', statement], capture_output=True, text=True, check=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = (int(cumulative), len(name) - len(name.lstrip()) - 1)
+    return times
+
+
+def main(budget_ms):
+    failed = False
+    for statement in STATEMENTS:
+        times = import_times(statement)
+        # Top level pypidinst imports include everything they import in turn
+        total = sum(us for name, (us, depth) in times.items() if name.split('.')[0] == 'pypidinst' and depth == 0)
+        heaviest = sorted(((us, name) for name, (us, depth) in times.items() if depth == 0 and name.split('.')[0] != 'pypidinst'), reverse=True)[:3]
+        print(f"{statement:50} {total / 1000:7.2f} ms  heaviest: {', '.join(f'{name} {us / 1000:.1f} ms' for us, name in heaviest)}")
+        if statement == 'import pypidinst':
+            loaded = [name for name in HEAVY_MODULES if name in times]
+            if total > budget_ms * 1000 or loaded:
+                print(f"  regression: {total / 1000:.2f} ms, heavy modules loaded: {loaded}")
+                failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(float(sys.argv[1]) if len(sys.argv) > 1 else 5.0))
@@ -0,0 +1,47 @@
+""" No-op incremental re-index benchmark
+
+Usage: python -m benchmarks.bench_manifest [files]
+
+Writes one record file per instrument into a temporary tree, indexes it once,
+then times a second run over the unchanged tree (the target is about one
+second for 100k files).
+
+"""
+
+import json
+import os
+import sys
+import tempfile
+import time
+
+from pypidinst.catalog import ConcurrentCatalog
+from pypidinst.manifest import IncrementalIndexer
+from pypidinst.pidinst import PIDInst, Identifier
+from pypidinst.serialization import to_dict
+
+
+def main(count):
+    with tempfile.TemporaryDirectory() as tmp:
+        root = os.path.join(tmp, 'records')
+        for i in range(count):
+            directory = os.path.join(root, f'{i % 256:02x}')
+            os.makedirs(directory, exist_ok=True)
+            record = PIDInst(landing_page=f'https://instruments.example.org/{i}', name=f'Instrument {i}')
+            record.identifier = Identifier(identifier_value=f'10.1000/inst{i}', identifier_type='DOI')
+            with open(os.path.join(directory, f'{i}.json'), 'w') as fh:
+                json.dump(to_dict(record), fh)
+
+        indexer = IncrementalIndexer(root, ConcurrentCatalog(), os.path.join(tmp, 'manifest.json'))
+        started = time.perf_counter()
+        changes = indexer.run()
+        print(f"initial run: {len(changes.added)} files in {time.perf_counter() - started:.2f}s")
+
+        # A fresh indexer loads the manifest from disk, as a new process would
+        indexer = IncrementalIndexer(root, indexer.catalog, os.path.join(tmp, 'manifest.json'))
+        started = time.perf_counter()
+        changes = indexer.run()
+        print(f"no-op run: {changes.unchanged} unchanged files in {time.perf_counter() - started:.2f}s")
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
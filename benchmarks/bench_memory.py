@@ -0,0 +1,34 @@
+""" Allocation budget benchmark
+
+Usage: python -m benchmarks.bench_memory [records]
+
+Measures the bytes retained and the peak bytes allocated per record by each
+operation in pypidinst.allocations over a synthetic catalog of records
+(default 20000). Exits non-zero if any operation exceeds its budget.
+
+"""
+
+import sys
+
+from pypidinst.allocations import AllocationBudgetError, BUDGETS, OPERATIONS, check_budgets, measure
+
+
+def main(count):
+    reports = []
+    print(f"{'operation':20} {'retained/record':>16} {'peak/record':>12}   budget")
+    for operation in OPERATIONS:
+        report = measure(operation, count)
+        reports.append(report)
+        budget = BUDGETS.get(operation, {})
+        print(f"{operation:20} {report.retained_per_record:14.0f} B {report.peak_per_record:10.0f} B   {budget.get('retained', '-')} / {budget.get('peak', '-')} B")
+    try:
+        check_budgets(reports)
+    except AllocationBudgetError as exc:
+        for failure in exc.failures:
+            print(f"  regression: {failure}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000))
@@ -0,0 +1,57 @@
+""" Throughput benchmark for the streaming schema migration pipeline
+
+Usage: python -m benchmarks.bench_migrations [records]
+
+Writes a synthetic JSON lines archive, registers a trivial 1.0 -> 1.1 -> 1.2
+chain and times migrate_file() over it.
+
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+from pypidinst.migrations import MigrationRegistry, migrate_file
+from pypidinst.serialization import dump_records
+from pypidinst.pidinst import PIDInst, Identifier, Owner, Manufacturer
+
+
+def synthetic_records(count):
+    for i in range(count):
+        record = PIDInst(landing_page=f'https://instruments.example.org/{i}', name=f'Instrument {i}')
+        record.identifier = Identifier(identifier_value=f'10.1000/inst{i}', identifier_type='DOI')
+        record.append_owner(Owner(owner_name=f'Owner {i % 100}'))
+        record.append_manufacturer(Manufacturer(manufacturer_name=f'Manufacturer {i % 20}'))
+        yield record
+
+
+def main(count):
+    registry = MigrationRegistry()
+
+    @registry.register('1.0', '1.1')
+    def add_dates(doc):
+        doc['dates'] = []
+        return doc
+
+    @registry.register('1.1', '1.2')
+    def rename_description(doc):
+        doc['descriptions'] = [doc.pop('description')] if doc.get('description') else []
+        return doc
+
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, 'source.jsonl')
+        with open(source, 'w') as fh:
+            dump_records(synthetic_records(count), fh)
+
+        started = time.perf_counter()
+        counts = migrate_file(source, os.path.join(tmp, 'migrated.jsonl'), '1.2', registry,
+                              report_path=os.path.join(tmp, 'report.jsonl'),
+                              checkpoint_path=os.path.join(tmp, 'checkpoint.json'))
+        elapsed = time.perf_counter() - started
+
+    print(f"migrated {counts['migrated']} records in {elapsed:.2f}s ({counts['migrated'] / elapsed:,.0f} records/s)")
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
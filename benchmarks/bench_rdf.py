@@ -0,0 +1,55 @@
+""" RDF output throughput benchmark
+
+Usage: python -m benchmarks.bench_rdf [records]
+
+Streams generated records through write_ntriples() and write_jsonld() into
+temporary files and reports records and triples per second, with the peak
+resident set size to show memory stays flat as the record count grows.
+
+"""
+
+import os
+import resource
+import sys
+import tempfile
+import time
+
+from pypidinst.frozen import FrozenPIDInst, FrozenIdentifier, FrozenOwner, FrozenOwnerIdentifier, FrozenManufacturer, FrozenRelatedIdentifier
+from pypidinst.rdf import write_ntriples, write_jsonld
+
+
+def generate(count):
+    ''' Yields records lazily so that the benchmark itself holds none of them '''
+
+    manufacturers = [(FrozenManufacturer(manufacturer_name=f'Maker {i}'),) for i in range(20)]
+    for i in range(count):
+        yield FrozenPIDInst(
+            name=f'Instrument {i}',
+            identifier=FrozenIdentifier(identifier_value=f'10.1000/inst{i}', identifier_type='DOI'),
+            landing_page=f'https://instruments.example.org/{i}',
+            description='Benchmark instrument',
+            owners=(FrozenOwner(owner_name=f'Lab {i % 50}', owner_identifier=FrozenOwnerIdentifier(owner_identifier_value=f'0000-0000-0000-{i % 50:04d}', owner_identifier_type='ORCID')),),
+            manufacturers=manufacturers[i % 20],
+            related_identifiers=(FrozenRelatedIdentifier(related_identifier_value=f'10.1000/paper{i}', related_identifier_type='DOI', related_identifier_relation_type='IsDescribedBy'),),
+        )
+
+
+def main(count):
+    with tempfile.TemporaryDirectory() as tmp:
+        with open(os.path.join(tmp, 'records.nt'), 'w', encoding='utf-8') as fh:
+            started = time.perf_counter()
+            triples = write_ntriples(generate(count), fh)
+            elapsed = time.perf_counter() - started
+        print(f"n-triples: {count / elapsed:,.0f} records/s, {triples / elapsed:,.0f} triples/s ({triples} triples in {elapsed:.2f}s)")
+
+        with open(os.path.join(tmp, 'records.jsonld'), 'w', encoding='utf-8') as fh:
+            started = time.perf_counter()
+            chunks = write_jsonld(generate(count), fh)
+            elapsed = time.perf_counter() - started
+        print(f"json-ld: {count / elapsed:,.0f} records/s ({chunks} chunks in {elapsed:.2f}s)")
+
+    print(f"peak rss: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MB")
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000000)
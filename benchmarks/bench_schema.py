@@ -0,0 +1,47 @@
+""" Raw document validation benchmark
+
+Usage: python -m benchmarks.bench_schema [documents]
+
+Times screening serialized documents with the compiled SchemaValidator
+against building PIDInst records from them with from_dict().
+
+"""
+
+import sys
+import time
+
+from pypidinst.pidinst import PIDInst, Identifier, Owner, Manufacturer, RelatedIdentifier
+from pypidinst.schema import SchemaValidator
+from pypidinst.serialization import to_dict, from_dict
+
+
+def build_documents(count):
+    documents = []
+    for i in range(count):
+        record = PIDInst(landing_page=f'https://instruments.example.org/{i}', name=f'Instrument {i}', description='Benchmark instrument')
+        record.identifier = Identifier(identifier_value=f'10.1000/inst{i}', identifier_type='DOI')
+        record.append_owner(Owner(owner_name=f'Lab {i % 50}', owner_contact='lab@example.org'))
+        record.append_manufacturer(Manufacturer(manufacturer_name=f'Maker {i % 20}'))
+        record.append_related_identifier(RelatedIdentifier(related_identifier_value=f'10.1000/paper{i}', related_identifier_type='DOI', related_identifier_relation_type='IsDescribedBy'))
+        documents.append(to_dict(record))
+    return documents
+
+
+def main(count):
+    documents = build_documents(count)
+    validator = SchemaValidator()
+
+    started = time.perf_counter()
+    valid, errors = validator.validate_many(documents)
+    validated = time.perf_counter() - started
+    print(f"validate_many: {len(valid)} valid, {len(errors)} errors in {validated:.2f}s")
+
+    started = time.perf_counter()
+    for doc in documents:
+        from_dict(doc)
+    constructed = time.perf_counter() - started
+    print(f"from_dict: {count} records in {constructed:.2f}s ({constructed / validated:.1f}x slower)")
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,52 @@
+""" Scaling benchmark for ShardedCatalog on a single multi-core machine
+
+Usage: python -m benchmarks.bench_sharding [records] [max_workers]
+
+Loads the same synthetic records into catalogs with 1, 2, 4 ... max_workers
+shards and times routed lookups, scatter-gather scans and merged statistics.
+
+"""
+
+import multiprocessing
+import sys
+import time
+
+from pypidinst.pidinst import PIDInst, Identifier, Owner, Manufacturer
+from pypidinst.query import Field
+from pypidinst.sharding import ShardedCatalog
+
+
+def synthetic_records(count):
+    for i in range(count):
+        record = PIDInst(landing_page=f'https://instruments.example.org/{i}', name=f'Instrument {i}',
+                         description='Spectrometer' if i % 7 == 0 else 'Microscope')
+        record.identifier = Identifier(identifier_value=f'10.1000/inst{i}', identifier_type='DOI')
+        record.append_owner(Owner(owner_name=f'Owner {i % 100}'))
+        record.append_manufacturer(Manufacturer(manufacturer_name=f'Manufacturer {i % 20}'))
+        yield record
+
+
+def timed(func, repeat=1):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        result = func()
+    return (time.perf_counter() - started) / repeat, result
+
+
+def main(count, max_workers):
+    term = Field('description').contains('Spectro') & Field('manufacturers.manufacturer_name').startswith('Manufacturer 1')
+    workers = 1
+    while workers <= max_workers:
+        with ShardedCatalog(workers) as catalog:
+            load, _ = timed(lambda: catalog.put_many(synthetic_records(count)))
+            lookup, _ = timed(lambda: catalog.get('10.1000/inst42'), repeat=1000)
+            scan, matches = timed(lambda: catalog.count(term), repeat=5)
+            stats, _ = timed(catalog.stats, repeat=5)
+            print(f"{workers:>3} workers: load {load:.2f}s, lookup {lookup * 1e6:.0f}us, "
+                  f"scan {scan * 1000:.1f}ms ({matches} matches), stats {stats * 1000:.1f}ms")
+        workers *= 2
+
+
+if __name__ == '__main__':
+    args = [int(arg) for arg in sys.argv[1:]]
+    main(*(args + [100000, multiprocessing.cpu_count()][len(args):]))
@@ -0,0 +1,89 @@
+""" PyPIDInst
+Python wrapper for the PIDInst 1.0 Schema for documentation of Research Instruments.
+
+The public API is loaded lazily (PEP 562): `import pypidinst` imports no
+submodule, and each name below imports its module on first access. Short
+lived tools therefore only pay for the subsystems they use; the sharded
+catalog (multiprocessing), archives (zlib/lzma), site generator and RDF
+writers stay unloaded otherwise.
+
+"""
+
+import sys
+
+# Public name -> submodule defining it
+_EXPORTS = {
+    'PIDInst': 'pidinst',
+    'Identifier': 'pidinst',
+    'OwnerIdentifier': 'pidinst',
+    'Owner': 'pidinst',
+    'ManufacturerIdentifier': 'pidinst',
+    'Manufacturer': 'pidinst',
+    'ModelIdentifier': 'pidinst',
+    'Model': 'pidinst',
+    'RelatedIdentifier': 'pidinst',
+    'FrozenPIDInst': 'frozen',
+    'freeze': 'frozen',
+    'thaw': 'frozen',
+    'to_dict': 'serialization',
+    'from_dict': 'serialization',
+    'load_records': 'serialization',
+    'dump_records': 'serialization',
+    'RecordHistory': 'history',
+    'VersionStore': 'history',
+    'MigrationRegistry': 'migrations',
+    'MigrationError': 'migrations',
+    'migrate_stream': 'migrations',
+    'migrate_file': 'migrations',
+    'MAPPERS': 'crosswalk',
+    'ColumnMapping': 'importer',
+    'import_csv': 'importer',
+    'Field': 'query',
+    'Any': 'query',
+    'Query': 'query',
+    'HashIndex': 'query',
+    'ConcurrentCatalog': 'catalog',
+    'CatalogStats': 'stats',
+    'ShardedCatalog': 'sharding',
+    'ArchiveReader': 'archive',
+    'ArchiveWriter': 'archive',
+    'write_archive': 'archive',
+    'BuildManifest': 'manifest',
+    'IncrementalIndexer': 'manifest',
+    'BloomFilter': 'bloom',
+    'SiteGenerator': 'site',
+    'json_schema': 'schema',
+    'SchemaValidator': 'schema',
+    'validate_documents': 'schema',
+    'write_ntriples': 'rdf',
+    'write_jsonld': 'rdf',
+    'EventBus': 'events',
+    'EventLog': 'events',
+}
+
+_SUBMODULES = frozenset(_EXPORTS.values()) | {'allocations', 'cli', 'vocabs'}
+
+__all__ = list(_EXPORTS)
+
+
+def _import(module):
+    # __import__ avoids loading importlib (and warnings) just to resolve a name
+    __import__(f'{__name__}.{module}')
+    return sys.modules[f'{__name__}.{module}']
+
+
+def __getattr__(name):
+    module = _EXPORTS.get(name)
+    if module is not None:
+        value = getattr(_import(module), name)
+    elif name in _SUBMODULES:
+        value = _import(name)
+    else:
+        raise AttributeError(f"module '{__name__}' has no attribute '{name}'")
+    # Cache on the package so later lookups skip __getattr__
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_EXPORTS) | _SUBMODULES)
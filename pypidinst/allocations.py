@@ -0,0 +1,194 @@
+""" PIDINST Allocation Budgets
+Per-record memory budgets for the main record operations, measured with tracemalloc.
+
+Each operation is run over a synthetic catalog. Its inputs (field values,
+records, documents) are prepared before tracing starts, so only the memory
+the operation itself allocates is counted: bytes still held afterwards
+(retained, e.g. the records a catalog keeps) and the high-water mark while it
+ran (peak), both divided by the number of records.
+
+check_budgets() compares the measurements with per-record byte budgets and
+raises AllocationBudgetError when any is exceeded, so that memory growth
+fails the test suite (and benchmarks/bench_memory.py) instead of surfacing
+when large catalogs are held in production.
+
+"""
+
+import gc
+import json
+import tracemalloc
+
+from .catalog import ConcurrentCatalog, record_key
+from .frozen import freeze
+from .pidinst import PIDInst, Identifier, Owner, OwnerIdentifier, Manufacturer, ManufacturerIdentifier, \
+    Model, RelatedIdentifier
+from .query import HashIndex
+from .serialization import to_dict, from_dict
+
+INDEX_PATH = 'owners.owner_identifier.owner_identifier_value'
+
+# Retained and peak bytes per record allowed for each operation, with headroom
+# over the figures measured on 64-bit CPython 3.11
+BUDGETS = {
+    'construct_minimal': {'retained': 350, 'peak': 400},
+    'construct': {'retained': 750, 'peak': 800},
+    'append': {'retained': 150, 'peak': 200},
+    'from_dict': {'retained': 750, 'peak': 800},
+    'to_dict': {'retained': 2000, 'peak': 2100},
+    'to_json': {'retained': 900, 'peak': 1000},
+    'freeze': {'retained': 750, 'peak': 800},
+    'index': {'retained': 200, 'peak': 250},
+    'catalog': {'retained': 950, 'peak': 1100},
+}
+
+
+def synthetic_values(count:int, start:int = 0):
+    ''' Returns the field values of count synthetic records, one tuple of strings per record '''
+
+    return [(
+        f'Instrument {i}',
+        f'https://instruments.example.org/{i}',
+        f'10.1000/inst{i}',
+        f'Owner {i % 100}',
+        f'0000-0000-0000-{i % 100:04d}',
+        f'Manufacturer {i % 20}',
+        f'Model {i % 50}',
+    ) for i in range(start, start + count)]
+
+
+def synthetic_record(values):
+    ''' Builds a typical record (identifier, owner, manufacturer, model) from synthetic_values() '''
+
+    name, landing_page, identifier, owner_name, orcid, manufacturer_name, model_name = values
+    record = PIDInst(landing_page=landing_page, name=name, model=Model(model_name=model_name))
+    record.identifier = Identifier(identifier_value=identifier, identifier_type='DOI')
+    record.append_owner(Owner(owner_name=owner_name, owner_identifier=OwnerIdentifier(owner_identifier_value=orcid, owner_identifier_type='ORCID')))
+    record.append_manufacturer(Manufacturer(manufacturer_name=manufacturer_name, manufacturer_identifier=ManufacturerIdentifier(manufacturer_identifier_value=manufacturer_name, manufacturer_identifier_type='URL')))
+    return record
+
+
+def synthetic_catalog(count:int, start:int = 0):
+    ''' Returns a list of count typical synthetic records '''
+
+    return [synthetic_record(values) for values in synthetic_values(count, start)]
+
+
+def _construct_minimal(values):
+    return [PIDInst(name=entry[0]) for entry in values]
+
+
+def _append_setup(count):
+    records = [PIDInst(name=entry[0]) for entry in synthetic_values(count)]
+    children = [(
+        Owner(owner_name=record.name),
+        Manufacturer(manufacturer_name=record.name),
+        RelatedIdentifier(related_identifier_value=record.name, related_identifier_type='URL', related_identifier_relation_type='IsDescribedBy'),
+    ) for record in records]
+    return records, children
+
+
+def _append(state):
+    records, children = state
+    for record, (owner, manufacturer, related) in zip(records, children):
+        record.append_owner(owner)
+        record.append_manufacturer(manufacturer)
+        record.append_related_identifier(related)
+    return records
+
+
+def _index(records):
+    return HashIndex(INDEX_PATH).build({record_key(record): record for record in records})
+
+
+# operation -> (setup(count) run untraced, run(setup result) measured)
+OPERATIONS = {
+    'construct_minimal': (synthetic_values, _construct_minimal),
+    'construct': (synthetic_values, lambda values: [synthetic_record(entry) for entry in values]),
+    'append': (_append_setup, _append),
+    'from_dict': (lambda count: [to_dict(record) for record in synthetic_catalog(count)], lambda docs: [from_dict(doc) for doc in docs]),
+    'to_dict': (synthetic_catalog, lambda records: [to_dict(record) for record in records]),
+    'to_json': (synthetic_catalog, lambda records: [json.dumps(to_dict(record), separators=(',', ':')) for record in records]),
+    'freeze': (synthetic_catalog, lambda records: [freeze(record) for record in records]),
+    'index': (lambda count: [freeze(record) for record in synthetic_catalog(count)], _index),
+    'catalog': (synthetic_catalog, lambda records: ConcurrentCatalog(records, index_paths=[INDEX_PATH])),
+}
+
+
+class AllocationReport():
+    """ Memory allocated by one operation over a synthetic catalog """
+
+    __slots__ = ('operation', 'records', 'retained', 'peak')
+
+    def __init__(self, operation, records, retained, peak):
+        self.operation = operation
+        self.records = records
+        self.retained = retained
+        self.peak = peak
+
+    def __repr__(self):
+        return f"AllocationReport ('{self.operation}', {self.retained_per_record:.0f} B/record retained, {self.peak_per_record:.0f} B/record peak)"
+
+    @property
+    def retained_per_record(self):
+        return self.retained / self.records
+
+    @property
+    def peak_per_record(self):
+        return self.peak / self.records
+
+    def to_dict(self):
+        return {'operation': self.operation, 'records': self.records, 'retained_per_record': round(self.retained_per_record, 1), 'peak_per_record': round(self.peak_per_record, 1)}
+
+
+class AllocationBudgetError(AssertionError):
+    """ Raised when operations allocate more per record than their budgets allow """
+
+    def __init__(self, failures):
+        self.failures = failures
+        super().__init__('; '.join(failures))
+
+
+def measure(operation:str, count:int = 2000):
+    ''' Runs an operation (a key of OPERATIONS) over count synthetic records and returns an AllocationReport '''
+
+    setup, run = OPERATIONS[operation]
+    state = setup(count)
+    gc.collect()
+    tracing = tracemalloc.is_tracing()
+    if not tracing:
+        tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        result = run(state)
+        gc.collect()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        if not tracing:
+            tracemalloc.stop()
+    del result
+    return AllocationReport(operation, count, current - before, peak - before)
+
+
+def check_budgets(reports, budgets:dict = None):
+    ''' Raises AllocationBudgetError if any report exceeds its operation's per-record budgets (BUDGETS by default) '''
+
+    budgets = BUDGETS if budgets is None else budgets
+    failures = []
+    for report in reports:
+        budget = budgets.get(report.operation, {})
+        for kind in ('retained', 'peak'):
+            limit = budget.get(kind)
+            used = getattr(report, f'{kind}_per_record')
+            if limit is not None and used > limit:
+                failures.append(f"{report.operation}: {used:.0f} bytes {kind} per record exceeds the budget of {limit}")
+    if failures:
+        raise AllocationBudgetError(failures)
+
+
+def run_budgets(count:int = 2000, operations=None, budgets:dict = None):
+    ''' Measures operations (every one of OPERATIONS by default), checks their budgets and returns the reports '''
+
+    reports = [measure(operation, count) for operation in (operations or OPERATIONS)]
+    check_budgets(reports, budgets)
+    return reports
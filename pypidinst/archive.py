@@ -0,0 +1,301 @@
+""" PIDINST Archives
+Compressed, seekable archive files of PIDInst records.
+
+Records are grouped into blocks. Within a block every string (field names
+included) is stored once in a block string dictionary and referenced by
+position, so repeated manufacturer names, owner contacts, identifier and
+relation types cost one entry per block before compression. Only whole
+strings are shared: identifiers with a common prefix (e.g. DOIs) are stored
+in full and left to the compressor. Each block is then compressed on its own
+with zlib or lzma.
+
+File layout:
+    MAGIC, codec name line
+    block 0 .. block n-1 (compressed JSON: {"strings": [...], "records": [...]})
+    index (JSON list of [offset, length, record count] per block)
+    8 byte big-endian index offset, MAGIC
+
+The block index at the end lets readers seek straight to any block, stream
+the archive block by block, or decompress several blocks in parallel.
+
+"""
+
+import json
+import os
+import struct
+import threading
+import zlib
+from bisect import bisect_right
+from collections import deque
+
+from .serialization import to_dict, from_dict
+
+MAGIC = b'PIDINSTA1\n'
+
+
+class ArchiveError(ValueError):
+    """ Raised when an archive file is malformed """
+
+
+def _zlib_decompress(data):
+    try:
+        return zlib.decompress(data)
+    except zlib.error as exc:
+        raise ArchiveError(f"zlib: {exc}") from exc
+
+
+def _lzma_compress(data, level):
+    # lzma is only imported by archives that use it
+    import lzma
+    return lzma.compress(data, preset=6 if level is None else level)
+
+
+def _lzma_decompress(data):
+    import lzma
+    try:
+        return lzma.decompress(data)
+    except lzma.LZMAError as exc:
+        raise ArchiveError(f"lzma: {exc}") from exc
+
+
+CODECS = {
+    'zlib': (lambda data, level: zlib.compress(data, 6 if level is None else level), _zlib_decompress),
+    'lzma': (_lzma_compress, _lzma_decompress),
+}
+
+
+def _encode(value, strings, refs):
+    '''
+    Replaces every string in a document with its position in the block string table
+
+    String values become integers and dict keys become the decimal text of their position.
+    Integer values would be read back as string references, so documents may not hold any.
+
+    '''
+
+    if isinstance(value, str):
+        ref = refs.get(value)
+        if ref is None:
+            ref = refs[value] = len(strings)
+            strings.append(value)
+        return ref
+    if isinstance(value, int) and not isinstance(value, bool):
+        raise TypeError("archive documents cannot hold integer values")
+    if isinstance(value, dict):
+        return {str(_encode(key, strings, refs)): _encode(item, strings, refs) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_encode(item, strings, refs) for item in value]
+    return value
+
+
+def _decode(value, strings):
+    if isinstance(value, int) and not isinstance(value, bool):
+        return strings[value]
+    if isinstance(value, dict):
+        return {strings[int(key)]: _decode(item, strings) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_decode(item, strings) for item in value]
+    return value
+
+
+class ArchiveWriter():
+    """
+    Writes PIDInst records to a compressed block archive
+
+    Args:
+        path: Archive file to create
+        codec: 'zlib' or 'lzma'
+        block_size: Records per block
+        level: Compression level (codec default when None)
+
+    """
+
+    def __init__(self, path:str, codec:str = 'zlib', block_size:int = 1000, level:int = None):
+        if codec not in CODECS:
+            raise ValueError(f"codec must be one of {', '.join(CODECS)}")
+        if block_size < 1:
+            raise ValueError("block_size must be at least 1")
+        self.codec = codec
+        self.block_size = block_size
+        self._compress = CODECS[codec][0]
+        self._level = level
+        self._fh = open(path, 'wb')
+        self._fh.write(MAGIC + codec.encode('ascii') + b'\n')
+        self._index = []
+        # Encoded documents of the current block and its string table
+        self._pending = []
+        self._strings, self._refs = [], {}
+        self.count = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def write(self, record):
+        ''' Adds a PIDInst (or frozen PIDInst) record '''
+        self.write_document(to_dict(record))
+
+    def write_document(self, doc:dict):
+        ''' Adds an already serialized record document '''
+
+        # Encoded on arrival so that unsupported values are reported by the call adding them
+        self._pending.append(_encode(doc, self._strings, self._refs))
+        self.count += 1
+        if len(self._pending) >= self.block_size:
+            self._flush_block()
+
+    def write_many(self, records):
+        for record in records:
+            self.write(record)
+
+    def _flush_block(self):
+        if not self._pending:
+            return
+        payload = json.dumps({'strings': self._strings, 'records': self._pending}, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+        data = self._compress(payload, self._level)
+        self._index.append([self._fh.tell(), len(data), len(self._pending)])
+        self._fh.write(data)
+        self._pending = []
+        self._strings, self._refs = [], {}
+
+    def close(self):
+        if self._fh.closed:
+            return
+        self._flush_block()
+        index_offset = self._fh.tell()
+        self._fh.write(json.dumps(self._index, separators=(',', ':')).encode('ascii'))
+        self._fh.write(struct.pack('>Q', index_offset) + MAGIC)
+        self._fh.close()
+
+
+class ArchiveReader():
+    """
+    Reads PIDInst records from a compressed block archive
+
+    Iterating yields PIDInst records, decompressing one block at a time.
+
+    Args:
+        path: Archive file to open
+
+    """
+
+    def __init__(self, path:str):
+        self._fh = open(path, 'rb')
+        self._lock = threading.Lock()
+        try:
+            self._read_index()
+        except BaseException:
+            self._fh.close()
+            raise
+
+    def _read_index(self):
+        header = self._fh.read(len(MAGIC))
+        if header != MAGIC:
+            raise ArchiveError("Not a PIDInst archive")
+        self.codec = self._fh.readline().decode('ascii', 'replace').strip()
+        if self.codec not in CODECS:
+            raise ArchiveError(f"Unknown archive codec '{self.codec}'")
+        self._decompress = CODECS[self.codec][1]
+
+        trailer_size = 8 + len(MAGIC)
+        size = os.fstat(self._fh.fileno()).st_size
+        if size - self._fh.tell() < trailer_size:
+            raise ArchiveError("Archive is truncated (missing block index)")
+        self._fh.seek(-trailer_size, os.SEEK_END)
+        trailer = self._fh.read(trailer_size)
+        if trailer[8:] != MAGIC:
+            raise ArchiveError("Archive is truncated (missing block index)")
+        index_offset = struct.unpack('>Q', trailer[:8])[0]
+        try:
+            self._fh.seek(index_offset)
+            self.blocks = [tuple(entry) for entry in json.loads(self._fh.read(size - trailer_size - index_offset))]
+        except (OSError, ValueError) as exc:
+            raise ArchiveError(f"Archive block index is corrupt: {exc}") from exc
+        # Ordinal of the first record in each block
+        self._starts = []
+        total = 0
+        for _, _, count in self.blocks:
+            self._starts.append(total)
+            total += count
+        self._count = total
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        for doc in self.iter_documents():
+            yield from_dict(doc)
+
+    def close(self):
+        self._fh.close()
+
+    def _read(self, block:int):
+        offset, length, _ = self.blocks[block]
+        with self._lock:
+            self._fh.seek(offset)
+            return self._fh.read(length)
+
+    def read_block(self, block:int):
+        ''' Returns the record documents stored in one block '''
+
+        try:
+            payload = json.loads(self._decompress(self._read(block)))
+            strings = payload['strings']
+            return [_decode(doc, strings) for doc in payload['records']]
+        except (ValueError, KeyError, IndexError, TypeError) as exc:
+            # Codec errors (as ArchiveError), bad JSON or dangling string references
+            raise ArchiveError(f"Block {block} is corrupt: {exc}") from exc
+
+    def iter_documents(self, start_block:int = 0):
+        ''' Yields record documents block by block '''
+
+        for block in range(start_block, len(self.blocks)):
+            yield from self.read_block(block)
+
+    def get(self, ordinal:int):
+        ''' Returns the record at a position in the archive, decompressing only its block '''
+
+        if not 0 <= ordinal < self._count:
+            raise IndexError("record ordinal out of range")
+        block = bisect_right(self._starts, ordinal) - 1
+        return from_dict(self.read_block(block)[ordinal - self._starts[block]])
+
+    def iter_parallel(self, workers:int = 4, prefetch:int = None):
+        '''
+        Yields PIDInst records in archive order, decompressing blocks on a thread pool
+
+        zlib and lzma release the GIL while decompressing, so up to `prefetch`
+        blocks (2 * workers by default) are decompressed ahead of the consumer.
+
+        '''
+
+        from concurrent.futures import ThreadPoolExecutor
+
+        prefetch = prefetch or 2 * workers
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            pending = deque()
+            next_block = 0
+            while next_block < len(self.blocks) or pending:
+                while next_block < len(self.blocks) and len(pending) < prefetch:
+                    pending.append(pool.submit(self.read_block, next_block))
+                    next_block += 1
+                for doc in pending.popleft().result():
+                    yield from_dict(doc)
+
+
+def write_archive(path:str, records, codec:str = 'zlib', block_size:int = 1000):
+    ''' Writes records to a new archive and returns the number written '''
+
+    with ArchiveWriter(path, codec, block_size) as writer:
+        writer.write_many(records)
+    return writer.count
@@ -0,0 +1,192 @@
+""" PIDINST Identifier Filters
+Compact probabilistic membership index for identifier existence checks.
+
+A BloomFilter answers "has this identifier possibly been seen?" for tens of
+millions of PIDs in a fraction of the memory a Python set would need. A
+negative answer is always correct; a positive answer is wrong with at most
+the configured false positive rate (once the filter holds its capacity).
+
+Values are normalized before hashing (see normalize_identifier) so that the
+same PID written with or without a resolver prefix, or in a different case,
+maps to the same entry. Filters are saved as a small header followed by the
+raw bit array, which load() can memory-map instead of reading into memory.
+
+"""
+
+import hashlib
+import math
+import mmap
+import struct
+
+MAGIC = b'PIDBLOOM1'
+_HEADER = struct.Struct('>9sQIQQd')
+
+# Resolver prefixes stripped by normalize_identifier, lowercase
+RESOLVER_PREFIXES = (
+    'https://doi.org/', 'http://doi.org/', 'https://dx.doi.org/', 'http://dx.doi.org/', 'doi:',
+    'https://hdl.handle.net/', 'http://hdl.handle.net/', 'hdl:',
+    'https://orcid.org/', 'http://orcid.org/',
+)
+
+
+def normalize_identifier(value:str):
+    ''' Returns the canonical form of an identifier value: trimmed, lowercased, without resolver prefix '''
+
+    if not isinstance(value, str):
+        raise TypeError("identifier value must be a string")
+    value = value.strip().lower()
+    for prefix in RESOLVER_PREFIXES:
+        if value.startswith(prefix):
+            return value[len(prefix):]
+    return value
+
+
+def record_identifier_values(record):
+    ''' Yields the Identifier, OwnerIdentifier and RelatedIdentifier values of a record '''
+
+    if record.identifier is not None:
+        yield record.identifier.identifier_value
+    for owner in record.owners:
+        if owner.owner_identifier is not None:
+            yield owner.owner_identifier.owner_identifier_value
+    for related in record.related_identifiers:
+        yield related.related_identifier_value
+
+
+class BloomFilter():
+    """
+    Bloom filter over normalized identifier values
+
+    Args:
+        capacity: Number of values the filter is sized for
+        error_rate: False positive rate at capacity
+
+    """
+
+    def __init__(self, capacity:int, error_rate:float = 0.001):
+        if not isinstance(capacity, int) or capacity < 1:
+            raise ValueError("capacity must be a positive integer")
+        if not 0 < error_rate < 1:
+            raise ValueError("error_rate must be between 0 and 1")
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.num_bits = max(8, math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.count = 0
+        self._bits = bytearray((self.num_bits + 7) // 8)
+        self._mmap = None
+        self._fh = None
+        self._writable = True
+
+    def __repr__(self):
+        return f"BloomFilter ({self.count}/{self.capacity} values, {self.num_bits} bits, {self.num_hashes} hashes)"
+
+    def __len__(self):
+        ''' Number of values added (duplicates included) '''
+        return self.count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def _positions(self, value):
+        digest = hashlib.blake2b(normalize_identifier(value).encode('utf-8'), digest_size=16).digest()
+        h1, h2 = struct.unpack('>QQ', digest)
+        h2 |= 1
+        m = self.num_bits
+        return [(h1 + i * h2) % m for i in range(self.num_hashes)]
+
+    def add(self, value:str):
+        bits = self._bits
+        for position in self._positions(value):
+            bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, value:str):
+        bits = self._bits
+        for position in self._positions(value):
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    def add_many(self, values):
+        ''' Adds every value of an iterable; returns the number added '''
+
+        added = 0
+        for value in values:
+            self.add(value)
+            added += 1
+        return added
+
+    def contains_many(self, values):
+        ''' Returns a list of membership results, one per value '''
+        return [value in self for value in values]
+
+    def add_records(self, records):
+        ''' Adds the identifier, owner identifier and related identifier values of records '''
+
+        return sum(self.add_many(record_identifier_values(record)) for record in records)
+
+    def save(self, path:str):
+        with open(path, 'wb') as fh:
+            fh.write(_HEADER.pack(MAGIC, self.num_bits, self.num_hashes, self.count, self.capacity, self.error_rate))
+            fh.write(self._bits)
+
+    @classmethod
+    def load(cls, path:str, use_mmap:bool = True, writable:bool = False):
+        '''
+        Loads a saved filter
+
+        With use_mmap the bit array is memory-mapped rather than read, and with
+        writable additions are written straight back to the file (the header
+        count is only updated by flush()).
+
+        '''
+
+        fh = open(path, 'r+b' if writable else 'rb')
+        try:
+            magic, num_bits, num_hashes, count, capacity, error_rate = _HEADER.unpack(fh.read(_HEADER.size))
+            if magic != MAGIC:
+                raise ValueError("Not a saved BloomFilter")
+            bloom = object.__new__(cls)
+            bloom.capacity, bloom.error_rate = capacity, error_rate
+            bloom.num_bits, bloom.num_hashes, bloom.count = num_bits, num_hashes, count
+            bloom._mmap = bloom._fh = None
+            bloom._writable = writable
+            size = (num_bits + 7) // 8
+            if use_mmap:
+                mapped = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ)
+                bloom._mmap = mapped
+                bloom._bits = memoryview(mapped)[_HEADER.size:_HEADER.size + size]
+                if not writable:
+                    bloom._bits = bloom._bits.toreadonly()
+                bloom._fh = fh
+            else:
+                bloom._bits = bytearray(fh.read(size))
+                fh.close()
+            if len(bloom._bits) != size:
+                raise ValueError("Saved BloomFilter is truncated")
+        except Exception:
+            fh.close()
+            raise
+        return bloom
+
+    def flush(self):
+        ''' Writes pending changes of a writable memory-mapped filter to its file '''
+
+        if self._mmap is None:
+            return
+        if self._writable:
+            self._mmap[:_HEADER.size] = _HEADER.pack(MAGIC, self.num_bits, self.num_hashes, self.count, self.capacity, self.error_rate)
+            self._mmap.flush()
+
+    def close(self):
+        if self._mmap is not None:
+            self.flush()
+            self._bits.release()
+            self._mmap.close()
+            self._fh.close()
+            self._mmap = self._fh = None
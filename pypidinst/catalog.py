@@ -0,0 +1,201 @@
+""" PIDINST Catalog
+Thread-safe catalog of instrument records for multi-threaded services.
+
+Readers work against an immutable CatalogSnapshot (a generation of frozen
+records and their hash indexes). Writers are serialized and apply whole
+batches to a copy of the current generation, which is then published with a
+single reference swap. Readers therefore never take a lock and never see a
+partially applied batch; a reader holding a snapshot keeps seeing it
+unchanged for as long as it holds it.
+
+Publishing a batch copies the record and index tables (not the records), so
+updates should be grouped into batches rather than written one at a time.
+
+"""
+
+import threading
+from types import MappingProxyType
+
+from .frozen import freeze
+from .query import HashIndex, Query, Term
+
+
+def record_key(record):
+    ''' Returns the catalog key of a record, its identifier value '''
+
+    if record.identifier is None:
+        raise ValueError("record must have an identifier to be stored in a catalog")
+    return record.identifier.identifier_value
+
+
+class CatalogSnapshot():
+    """ Immutable generation of a catalog """
+
+    __slots__ = ('generation', 'records', 'indexes')
+
+    def __init__(self, generation:int, records:dict, indexes:dict):
+        self.generation = generation
+        self.records = MappingProxyType(records)
+        self.indexes = MappingProxyType(indexes)
+
+    def __repr__(self):
+        return f"CatalogSnapshot (generation {self.generation}, {len(self.records)} records)"
+
+    def __len__(self):
+        return len(self.records)
+
+    def __contains__(self, key):
+        return key in self.records
+
+    def __iter__(self):
+        return iter(self.records.values())
+
+    def get(self, key, default=None):
+        return self.records.get(key, default)
+
+    def query(self, query):
+        ''' Returns the records matching a Query or Term, using this generation's indexes '''
+
+        if isinstance(query, Term):
+            query = Query(query)
+        return [self.records[key] for key in query.run(self.records, self.indexes)]
+
+    def explain(self, query):
+        if isinstance(query, Term):
+            query = Query(query)
+        return query.explain(self.indexes)
+
+
+class Batch():
+    """ Pending catalog changes, applied atomically when the batch is committed """
+
+    def __init__(self, catalog):
+        self._catalog = catalog
+        self._changes = {}
+
+    def __len__(self):
+        return len(self._changes)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.commit()
+        return False
+
+    def put(self, record):
+        ''' Adds or replaces a record (stored frozen, keyed by identifier value) '''
+
+        record = freeze(record)
+        self._changes[record_key(record)] = record
+
+    def delete(self, key:str):
+        self._changes[key] = None
+
+    def commit(self):
+        ''' Applies the batch and returns the new snapshot '''
+
+        changes, self._changes = self._changes, {}
+        return self._catalog._apply(changes)
+
+
+class ConcurrentCatalog():
+    """
+    Catalog with snapshot-isolated, lock-free reads and serialized batched writes
+
+    Args:
+        records: Initial records
+        index_paths: Field paths to keep hash indexes on
+        bus: EventBus to publish the changes of each committed batch to, after the listeners (see events.py)
+
+    """
+
+    def __init__(self, records:list = None, index_paths:list = (), bus = None):
+        self._write_lock = threading.Lock()
+        self._listeners = []
+        self.bus = bus
+        indexes = {path: HashIndex(path) for path in index_paths}
+        self._snapshot = CatalogSnapshot(0, {}, indexes)
+        if records:
+            with self.batch() as batch:
+                for record in records:
+                    batch.put(record)
+
+    def __repr__(self):
+        return f"ConcurrentCatalog ({len(self._snapshot)} records)"
+
+    def __len__(self):
+        return len(self._snapshot)
+
+    def __contains__(self, key):
+        return key in self._snapshot
+
+    def snapshot(self):
+        ''' Returns the current generation; it never changes once returned '''
+        return self._snapshot
+
+    def get(self, key, default=None):
+        return self._snapshot.get(key, default)
+
+    def query(self, query):
+        return self._snapshot.query(query)
+
+    def batch(self):
+        ''' Returns a Batch of changes, committed on leaving a with block '''
+        return Batch(self)
+
+    def put(self, record):
+        with self.batch() as batch:
+            batch.put(record)
+
+    def delete(self, key:str):
+        with self.batch() as batch:
+            batch.delete(key)
+
+    def add_listener(self, listener):
+        '''
+        Registers a callable run under the write lock after each batch is published
+
+        It is called with (key, old record or None, new record or None) for each change.
+
+        '''
+        self._listeners.append(listener)
+
+    def _apply(self, changes):
+        if not changes:
+            return self._snapshot
+        with self._write_lock:
+            current = self._snapshot
+            records = dict(current.records)
+            indexes = {path: index.copy() for path, index in current.indexes.items()}
+            applied = []
+            for key, record in changes.items():
+                old = records.get(key)
+                if old is None and record is None:
+                    continue
+                if old is not None:
+                    if record is not None and old == record:
+                        continue
+                    for index in indexes.values():
+                        index.discard(key, old)
+                if record is None:
+                    del records[key]
+                else:
+                    records[key] = record
+                    for index in indexes.values():
+                        index.add(key, record)
+                applied.append((key, old, record))
+            if not applied:
+                return current
+
+            snapshot = CatalogSnapshot(current.generation + 1, records, indexes)
+            self._snapshot = snapshot
+            for listener in self._listeners:
+                for key, old, record in applied:
+                    listener(key, old, record)
+            # Published last: an exception from a bus subscriber reaches the caller
+            # but cannot keep listeners such as CatalogStats from seeing the batch
+            if self.bus is not None:
+                self.bus.catalog_changed(applied)
+            return snapshot
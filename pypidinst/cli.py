@@ -0,0 +1,458 @@
+""" PIDINST Command Line Tool
+The `pypidinst` command: validate, convert, index and summarise record files.
+
+    pypidinst validate records/*.jsonl
+    pypidinst convert --to datacite -o datacite.jsonl instruments.csv
+    pypidinst index -o identifiers.bloom 'dumps/**/*.jsonl'
+    cat records.jsonl | pypidinst stats --jobs 4
+
+Inputs are file paths or glob patterns ('-' or no input reads JSON lines from
+stdin). Their format is taken from the extension: .jsonl/.ndjson (one
+document per line), .json (one document or a list of them), .csv/.tsv
+(spreadsheet rows, see importer.DEFAULT_MAPPING) or .pida (record archive).
+
+Documents are processed in chunks, on --jobs worker processes when more than
+one. Problems with individual records never stop a run: each is written as a
+JSON line to --errors (stderr by default) and the run exits with status 1.
+Progress is reported on stderr when it is a terminal, or with --progress.
+
+"""
+
+import argparse
+import csv
+import glob
+import json
+import os
+import sys
+import time
+from collections import deque
+
+from .crosswalk import MAPPERS
+from .importer import DEFAULT_MAPPING, import_rows
+from .serialization import to_dict, from_dict
+
+INPUT_FORMATS = {
+    '.jsonl': 'jsonl',
+    '.ndjson': 'jsonl',
+    '.json': 'json',
+    '.csv': 'csv',
+    '.tsv': 'tsv',
+    '.tab': 'tsv',
+    '.pida': 'archive',
+}
+
+OUTPUT_FORMATS = ('jsonl', *MAPPERS, 'ntriples', 'jsonld', 'archive')
+
+
+class _Item():
+    """ One input document and where it came from """
+
+    __slots__ = ('source', 'line', 'ordinal', 'payload')
+
+    def __init__(self, source, line, ordinal, payload):
+        self.source = source
+        self.line = line
+        self.ordinal = ordinal
+        # Raw JSON text (jsonl input, parsed in the worker) or an already decoded document
+        self.payload = payload
+
+
+def _error(source, line, kind, message, path=None):
+    error = {'source': source, 'line': line, 'error': kind, 'message': message}
+    if path is not None:
+        error['path'] = path
+    return error
+
+
+def expand_inputs(inputs):
+    ''' Returns (paths, errors) for input arguments, expanding glob patterns; '-' stands for stdin '''
+
+    paths, errors = [], []
+    for argument in inputs or ['-']:
+        if argument != '-' and any(char in argument for char in '*?['):
+            matches = sorted(glob.glob(argument, recursive=True))
+            if not matches:
+                errors.append(_error(argument, None, 'NoMatch', "pattern matched no files"))
+            paths.extend(matches)
+        else:
+            paths.append(argument)
+    return paths, errors
+
+
+def input_format(path:str, default:str = 'jsonl'):
+    if path == '-':
+        return default
+    for extension, name in INPUT_FORMATS.items():
+        if path.lower().endswith(extension):
+            return name
+    return default
+
+
+def read_items(paths, fmt:str, errors):
+    '''
+    Yields an _Item per input document across paths
+
+    Inputs that cannot be read at all (or CSV rows that cannot be imported)
+    are appended to errors (a list or deque) rather than raised.
+
+    '''
+
+    ordinal = 0
+    for path in paths:
+        name = fmt or input_format(path)
+        source = '<stdin>' if path == '-' else path
+        try:
+            if name == 'jsonl':
+                fh = sys.stdin if path == '-' else open(path, encoding='utf-8')
+                try:
+                    for line, text in enumerate(fh, 1):
+                        if text.strip():
+                            yield _Item(source, line, ordinal, text)
+                            ordinal += 1
+                finally:
+                    if fh is not sys.stdin:
+                        fh.close()
+            elif name == 'json':
+                if path == '-':
+                    documents = json.load(sys.stdin)
+                else:
+                    with open(path, encoding='utf-8') as fh:
+                        documents = json.load(fh)
+                for position, doc in enumerate(documents if isinstance(documents, list) else [documents], 1):
+                    yield _Item(source, position, ordinal, doc)
+                    ordinal += 1
+            elif name in ('csv', 'tsv'):
+                fh = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8-sig')
+                try:
+                    reader = csv.DictReader(fh, delimiter='\t' if name == 'tsv' else ',')
+
+                    # Rows are read one at a time, so line_num is that of the row being imported
+                    def reject(row_error):
+                        errors.append(_error(source, reader.line_num, 'RowError', str(row_error)))
+
+                    try:
+                        for record in import_rows(reader, reader.fieldnames or [], DEFAULT_MAPPING, reject):
+                            yield _Item(source, reader.line_num, ordinal, to_dict(record))
+                            ordinal += 1
+                    except csv.Error as exc:
+                        errors.append(_error(source, reader.line_num, 'CSVError', str(exc)))
+                finally:
+                    if fh is not sys.stdin:
+                        fh.close()
+            elif name == 'archive':
+                from .archive import ArchiveReader
+                with ArchiveReader(path) as reader:
+                    for position, doc in enumerate(reader.iter_documents(), 1):
+                        yield _Item(source, position, ordinal, doc)
+                        ordinal += 1
+            else:
+                raise ValueError(f"Unknown input format '{name}'")
+        except (OSError, ValueError) as exc:
+            errors.append(_error(source, None, type(exc).__name__, str(exc)))
+
+
+def _chunks(items, size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+# Per-process state of the chunk workers, set up on first use
+_validator = None
+_mappers = {}
+
+
+def _document(item):
+    if isinstance(item.payload, str):
+        return json.loads(item.payload)
+    return item.payload
+
+
+def _process_chunk(task):
+    '''
+    Runs a command over one chunk of items; returns (items processed, results, errors)
+
+    Executed in worker processes with --jobs, so everything it receives and
+    returns is picklable.
+
+    '''
+
+    global _validator
+    command, options, chunk = task
+    results, errors = [], []
+    records = []
+    for item in chunk:
+        try:
+            doc = _document(item)
+            if command == 'validate':
+                if _validator is None:
+                    from .schema import SchemaValidator
+                    _validator = SchemaValidator()
+                problems = _validator.errors(doc)
+                if problems:
+                    errors.extend(_error(item.source, item.line, 'ValidationError', problem.message, problem.path) for problem in problems)
+                    continue
+                if options.get('strict'):
+                    from .stats import invalid_reasons
+                    reasons = invalid_reasons(from_dict(doc))
+                    if reasons:
+                        errors.append(_error(item.source, item.line, 'IncompleteRecord', '; '.join(reasons)))
+                        continue
+                results.append(None)
+                continue
+            record = from_dict(doc)
+        except (TypeError, ValueError) as exc:
+            errors.append(_error(item.source, item.line, type(exc).__name__, str(exc)))
+            continue
+
+        if command == 'convert':
+            target = options['to']
+            if target == 'jsonl':
+                results.append(json.dumps(to_dict(record), ensure_ascii=False, separators=(',', ':')) + '\n')
+            elif target in MAPPERS:
+                mapper = _mappers.get(target)
+                if mapper is None:
+                    mapper = _mappers[target] = MAPPERS[target]()
+                results.append(mapper.serialize(mapper.map(to_dict(record))))
+            elif target == 'ntriples':
+                from .rdf import iter_ntriples
+                results.append(''.join(iter_ntriples([record], item.ordinal)))
+            elif target == 'archive':
+                results.append(to_dict(record))
+            else:
+                records.append((item.ordinal, record))
+        elif command == 'index':
+            from .bloom import record_identifier_values
+            results.extend(record_identifier_values(record))
+        elif command == 'stats':
+            from .frozen import freeze
+            results.append((item.ordinal, freeze(record)))
+
+    if records:
+        # JSON-LD: one document per chunk
+        from .rdf import iter_jsonld_chunks
+        for document in iter_jsonld_chunks([record for _, record in records], len(records), records[0][0]):
+            results.append(json.dumps(document, ensure_ascii=False, separators=(',', ':')) + '\n')
+    return len(chunk), results, errors
+
+
+class Progress():
+    """ Throttled progress line on a terminal stream """
+
+    def __init__(self, label, stream=None, enabled=None, interval:float = 0.5):
+        self.label = label
+        self.stream = stream or sys.stderr
+        self.enabled = self.stream.isatty() if enabled is None else enabled
+        self.interval = interval
+        self.started = self._last = time.monotonic()
+        self._shown = False
+
+    def update(self, records, errors, force=False):
+        if not self.enabled:
+            return
+        now = time.monotonic()
+        if not force and now - self._last < self.interval:
+            return
+        self._last = now
+        rate = records / (now - self.started) if now > self.started else 0.0
+        self.stream.write(f"\r{self.label}: {records} records, {errors} errors, {rate:,.0f} records/s")
+        self.stream.flush()
+        self._shown = True
+
+    def clear(self):
+        ''' Ends the progress line so other output can be written to the stream '''
+
+        if self._shown:
+            self.stream.write('\n')
+            self.stream.flush()
+            self._shown = False
+
+
+class _ErrorSink():
+    """ Writes error dicts as JSON lines, keeping the progress line readable """
+
+    def __init__(self, path, progress):
+        self.fh = open(path, 'w', encoding='utf-8') if path else sys.stderr
+        self.progress = progress
+        self.count = 0
+
+    def write(self, errors):
+        if not errors:
+            return
+        if self.fh is self.progress.stream:
+            self.progress.clear()
+        for error in errors:
+            self.fh.write(json.dumps(error, ensure_ascii=False) + '\n')
+        self.fh.flush()
+        self.count += len(errors)
+
+    def close(self):
+        if self.fh is not sys.stderr:
+            self.fh.close()
+
+
+def run_command(command, options, args):
+    '''
+    Streams the inputs of args through a command, handing each result to options['consume']
+
+    Returns (records processed, errors written).
+
+    '''
+
+    progress = Progress(command, enabled=args.progress)
+    sink = _ErrorSink(args.errors, progress)
+    consume = options.pop('consume')
+    pool = None
+    try:
+        paths, errors = expand_inputs(args.inputs)
+        sink.write(errors)
+        # With --jobs the pool's feeder thread runs read_items, so its errors go through a deque
+        read_errors = deque()
+        tasks = ((command, options, chunk) for chunk in _chunks(read_items(paths, args.format, read_errors), args.chunk_size))
+        if args.jobs > 1:
+            import multiprocessing
+            pool = multiprocessing.Pool(args.jobs)
+            # imap keeps input order and only runs a bounded number of chunks ahead
+            outcomes = pool.imap(_process_chunk, tasks)
+        else:
+            outcomes = map(_process_chunk, tasks)
+
+        processed = 0
+        for count, results, errors in outcomes:
+            sink.write([read_errors.popleft() for _ in range(len(read_errors))])
+            sink.write(errors)
+            for result in results:
+                consume(result)
+            processed += count
+            progress.update(processed, sink.count)
+        sink.write(list(read_errors))
+        progress.update(processed, sink.count, force=True)
+        progress.clear()
+        return processed, sink.count
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        sink.close()
+
+
+def _open_output(path):
+    if not path or path == '-':
+        return sys.stdout
+    return open(path, 'w', encoding='utf-8')
+
+
+def cmd_validate(args):
+    valid = 0
+    def consume(_):
+        nonlocal valid
+        valid += 1
+    processed, errors = run_command('validate', {'strict': args.strict, 'consume': consume}, args)
+    print(json.dumps({'checked': processed, 'valid': valid, 'errors': errors}))
+    return 1 if errors else 0
+
+
+def cmd_convert(args):
+    if args.to == 'archive':
+        if not args.output or args.output == '-':
+            raise SystemExit("pypidinst convert: --to archive requires --output")
+        from .archive import ArchiveWriter
+        writer = ArchiveWriter(args.output)
+        try:
+            processed, errors = run_command('convert', {'to': 'archive', 'consume': writer.write_document}, args)
+        finally:
+            writer.close()
+    else:
+        fh = _open_output(args.output)
+        try:
+            processed, errors = run_command('convert', {'to': args.to, 'consume': fh.write}, args)
+        finally:
+            if fh is not sys.stdout:
+                fh.close()
+    return 1 if errors else 0
+
+
+def cmd_index(args):
+    from .bloom import BloomFilter
+    bloom = BloomFilter(args.capacity, args.error_rate)
+    processed, errors = run_command('index', {'consume': bloom.add}, args)
+    bloom.save(args.output)
+    print(json.dumps({'records': processed, 'identifiers': len(bloom), 'errors': errors, 'output': args.output}))
+    return 1 if errors else 0
+
+
+def cmd_stats(args):
+    from .catalog import record_key
+    from .stats import CatalogStats
+    stats = CatalogStats()
+    def consume(result):
+        ordinal, record = result
+        # Records sharing an identifier are counted once (the last one wins, as in a catalog)
+        stats.add(record_key(record) if record.identifier is not None else f'#{ordinal}', record)
+    processed, errors = run_command('stats', {'consume': consume}, args)
+    snapshot = stats.snapshot()
+    print(json.dumps({
+        'total': snapshot['total'],
+        'valid': snapshot['valid'],
+        'invalid': snapshot['invalid'],
+        'invalid_reasons': dict(snapshot['invalid_reasons']),
+        'completeness': dict(snapshot['completeness']),
+        'histograms': {name: dict(counts) for name, counts in snapshot['histograms'].items()},
+        'errors': errors,
+    }, indent=None if args.compact else 2))
+    return 1 if errors else 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='pypidinst', description="Validate, convert, index and summarise PIDInst records.")
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('inputs', nargs='*', help="input files or glob patterns ('-' or none for stdin)")
+    common.add_argument('--format', choices=sorted(set(INPUT_FORMATS.values())), help="input format (default: from each file's extension, jsonl for stdin)")
+    common.add_argument('-j', '--jobs', type=int, default=1, help="worker processes (default: 1)")
+    common.add_argument('--chunk-size', type=int, default=500, help="documents per unit of work (default: 500)")
+    common.add_argument('--errors', metavar='PATH', help="write JSON error lines here instead of stderr")
+    common.add_argument('--progress', action='store_true', default=None, help="report progress on stderr (default: when it is a terminal)")
+    common.add_argument('--no-progress', dest='progress', action='store_false')
+
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    validate = commands.add_parser('validate', parents=[common], help="check records against the PIDInst JSON Schema")
+    validate.add_argument('--strict', action='store_true', help="also require every mandatory PIDInst field")
+    validate.set_defaults(handler=cmd_validate)
+
+    convert = commands.add_parser('convert', parents=[common], help="convert records to another format")
+    convert.add_argument('--to', required=True, choices=OUTPUT_FORMATS, help="output format")
+    convert.add_argument('-o', '--output', help="output file (default: stdout)")
+    convert.set_defaults(handler=cmd_convert)
+
+    index = commands.add_parser('index', parents=[common], help="build a Bloom filter index of identifier values")
+    index.add_argument('-o', '--output', required=True, help="index file to write")
+    index.add_argument('--capacity', type=int, default=1000000, help="identifier values the index is sized for (default: 1000000)")
+    index.add_argument('--error-rate', type=float, default=0.001, help="false positive rate at capacity (default: 0.001)")
+    index.set_defaults(handler=cmd_index)
+
+    stats = commands.add_parser('stats', parents=[common], help="print validity and completeness statistics as JSON")
+    stats.add_argument('--compact', action='store_true', help="print the statistics on one line")
+    stats.set_defaults(handler=cmd_stats)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.jobs < 1 or args.chunk_size < 1:
+        raise SystemExit("pypidinst: --jobs and --chunk-size must be at least 1")
+    try:
+        return args.handler(args)
+    except BrokenPipeError:
+        # The reader of stdout went away (e.g. `| head`): stop quietly
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,236 @@
+""" PIDINST Crosswalks
+Export of PIDInst records to downstream metadata formats.
+
+The crosswalk engine walks each record once (into its serialized dict
+document) and hands that document to every registered output mapper, each of
+which streams its own JSON lines output. Exporting to N formats therefore
+costs one traversal of owners, manufacturers, model and related identifiers
+per record rather than N.
+
+Mappers provided:
+    DataCiteMapper: DataCite metadata (JSON) following the PIDINST to DataCite mapping
+    SchemaOrgMapper: schema.org JSON-LD
+    EpicMapper: ePIC Handle record values following the PIDINST Handle profile
+
+"""
+
+import json
+
+from .serialization import to_dict
+
+
+def identifier_url(value:str, identifier_type:str):
+    ''' Returns a resolvable URL for an identifier value, or None if it has no known resolver '''
+
+    if value is None:
+        return None
+    if value.startswith('http://') or value.startswith('https://'):
+        return value
+    if identifier_type == 'DOI':
+        return f'https://doi.org/{value}'
+    if identifier_type == 'Handle':
+        return f'https://hdl.handle.net/{value}'
+    if identifier_type == 'ARK':
+        return f'https://n2t.net/{value}'
+    if identifier_type == 'ORCID':
+        return f'https://orcid.org/{value}'
+    return None
+
+
+class Mapper():
+    """
+    Base class for crosswalk output mappers
+
+    Subclasses implement map(), which receives the serialized dict document of
+    a record and returns the target representation (any JSON serializable value).
+
+    """
+
+    # Short format name, used by MAPPERS and the command line tool
+    name = None
+
+    def map(self, doc:dict):
+        raise NotImplementedError
+
+    def serialize(self, mapped):
+        ''' Returns the output line for a mapped record '''
+        return json.dumps(mapped, separators=(',', ':'), ensure_ascii=False) + '\n'
+
+
+class DataCiteMapper(Mapper):
+    """ DataCite metadata following the PIDINST to DataCite mapping """
+
+    name = 'datacite'
+
+    def map(self, doc:dict):
+        identifier = doc['identifier'] or {}
+        attributes = {
+            'types': {'resourceTypeGeneral': 'Instrument'},
+            'titles': [{'title': doc['name']}],
+            'url': doc['landing_page'],
+            'creators': [self._manufacturer(m) for m in doc['manufacturers']],
+            'contributors': [self._owner(o) for o in doc['owners']],
+            'descriptions': [{'description': doc['description'], 'descriptionType': 'Abstract'}] if doc['description'] else [],
+            'subjects': self._model(doc['model']),
+            'relatedIdentifiers': [self._related(r) for r in doc['related_identifiers']],
+            'schemaVersion': 'http://datacite.org/schema/kernel-4',
+        }
+        if identifier.get('identifier_type') == 'DOI':
+            attributes['doi'] = identifier['identifier_value']
+        elif identifier:
+            attributes['alternateIdentifiers'] = [{'alternateIdentifier': identifier['identifier_value'], 'alternateIdentifierType': identifier['identifier_type']}]
+        return {'data': {'type': 'dois', 'attributes': attributes}}
+
+    @staticmethod
+    def _manufacturer(manufacturer):
+        creator = {'name': manufacturer['manufacturer_name'], 'nameType': 'Organizational'}
+        identifier = manufacturer['manufacturer_identifier']
+        if identifier:
+            creator['nameIdentifiers'] = [{'nameIdentifier': identifier['manufacturer_identifier_value'], 'nameIdentifierScheme': identifier['manufacturer_identifier_type']}]
+        return creator
+
+    @staticmethod
+    def _owner(owner):
+        contributor = {'name': owner['owner_name'], 'contributorType': 'HostingInstitution'}
+        identifier = owner['owner_identifier']
+        if identifier:
+            contributor['nameIdentifiers'] = [{'nameIdentifier': identifier['owner_identifier_value'], 'nameIdentifierScheme': identifier['owner_identifier_type']}]
+        return contributor
+
+    @staticmethod
+    def _model(model):
+        if model is None:
+            return []
+        subject = {'subject': model['model_name'], 'subjectScheme': 'Model Name'}
+        identifier = model['model_identifier']
+        if identifier:
+            subject['valueURI'] = identifier_url(identifier['model_identifier_value'], identifier['model_identifier_type']) or identifier['model_identifier_value']
+        return [subject]
+
+    @staticmethod
+    def _related(related):
+        mapped = {
+            'relatedIdentifier': related['related_identifier_value'],
+            'relatedIdentifierType': related['related_identifier_type'],
+            'relationType': related['related_identifier_relation_type'],
+        }
+        return mapped
+
+
+class SchemaOrgMapper(Mapper):
+    """ schema.org JSON-LD, describing the instrument as a Product """
+
+    name = 'schemaorg'
+
+    # How PIDINST relation types are expressed on a schema.org Product
+    RELATION_PROPERTIES = {
+        'IsDescribedBy': 'subjectOf',
+        'HasMetadata': 'subjectOf',
+        'IsIdenticalTo': 'sameAs',
+    }
+
+    def map(self, doc:dict):
+        mapped = {'@context': 'https://schema.org', '@type': 'Product', 'name': doc['name']}
+        identifier = doc['identifier']
+        if identifier:
+            url = identifier_url(identifier['identifier_value'], identifier['identifier_type'])
+            if url:
+                mapped['@id'] = url
+            mapped['identifier'] = {'@type': 'PropertyValue', 'propertyID': identifier['identifier_type'], 'value': identifier['identifier_value']}
+        if doc['landing_page']:
+            mapped['url'] = doc['landing_page']
+        if doc['description']:
+            mapped['description'] = doc['description']
+        if doc['manufacturers']:
+            mapped['manufacturer'] = [self._organization(m['manufacturer_name'], m['manufacturer_identifier'], 'manufacturer') for m in doc['manufacturers']]
+        if doc['model']:
+            mapped['model'] = {'@type': 'ProductModel', 'name': doc['model']['model_name']}
+        for related in doc['related_identifiers']:
+            prop = self.RELATION_PROPERTIES.get(related['related_identifier_relation_type'], 'isRelatedTo')
+            url = identifier_url(related['related_identifier_value'], related['related_identifier_type']) or related['related_identifier_value']
+            if prop == 'sameAs':
+                value = url
+            else:
+                value = {'@type': 'CreativeWork' if prop == 'subjectOf' else 'Thing', '@id': url}
+                if related['related_identifier_name']:
+                    value['name'] = related['related_identifier_name']
+            mapped.setdefault(prop, []).append(value)
+        return mapped
+
+    @staticmethod
+    def _organization(name, identifier, prefix):
+        organization = {'@type': 'Organization', 'name': name}
+        if identifier:
+            organization['@id'] = identifier_url(identifier[f'{prefix}_identifier_value'], identifier[f'{prefix}_identifier_type']) or identifier[f'{prefix}_identifier_value']
+        return organization
+
+
+class EpicMapper(Mapper):
+    """ ePIC Handle record values following the PIDINST Handle profile """
+
+    name = 'epic'
+
+    def map(self, doc:dict):
+        identifier = doc['identifier'] or {}
+        values = []
+
+        def add(value_type, data):
+            values.append({'index': len(values) + 1, 'type': value_type, 'parsed_data': data})
+
+        if doc['landing_page']:
+            add('URL', doc['landing_page'])
+        add('Name', doc['name'])
+        for owner in doc['owners']:
+            add('Owner', owner)
+        for manufacturer in doc['manufacturers']:
+            add('Manufacturer', manufacturer)
+        if doc['model']:
+            add('Model', doc['model'])
+        if doc['description']:
+            add('Description', doc['description'])
+        for related in doc['related_identifiers']:
+            add('RelatedIdentifier', related)
+        add('SchemaVersion', doc['schema_version'])
+        return {'handle': identifier.get('identifier_value'), 'values': values}
+
+
+# Mappers available by format name
+MAPPERS = {mapper.name: mapper for mapper in (DataCiteMapper, SchemaOrgMapper, EpicMapper)}
+
+
+def crosswalk(records, outputs:dict):
+    '''
+    Writes every record to each output in one pass over the records
+
+    Args:
+        records: Iterable of PIDInst (or frozen PIDInst) records
+        outputs: Dict of Mapper instance -> file path or writable text file object.
+            Paths are opened and closed here, file objects are left open.
+
+    Returns the number of records exported.
+
+    '''
+
+    for mapper in outputs:
+        if not isinstance(mapper, Mapper):
+            raise TypeError("outputs must be keyed by Mapper instances")
+
+    sinks = []
+    opened = []
+    try:
+        for mapper, destination in outputs.items():
+            if isinstance(destination, str):
+                destination = open(destination, 'w', encoding='utf-8')
+                opened.append(destination)
+            sinks.append((mapper.map, mapper.serialize, destination.write))
+
+        count = 0
+        for record in records:
+            doc = to_dict(record)
+            for map_record, serialize, write in sinks:
+                write(serialize(map_record(doc)))
+            count += 1
+        return count
+    finally:
+        for fh in opened:
+            fh.close()
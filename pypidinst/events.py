@@ -0,0 +1,548 @@
+""" PIDINST Change Events
+Typed change events for records and catalogs, an event bus and a durable event log.
+
+Records registered with EventBus.watch() report every change made through
+their property setters, append_* and remove_related_identifier() methods; a
+ConcurrentCatalog created with bus=... reports the records each committed
+batch added, replaced or removed. Consumers (indexers, caches, exporters)
+subscribe to the bus and update themselves from the events instead of
+rescanning the catalog.
+
+Events are delivered in batches: everything a catalog commit changes, or
+everything changed inside a `with bus.batch():` block, arrives as one list.
+Batches are coalesced first, so that a field set several times appears once
+(with its first old and last new value), changes that cancel out are dropped
+and a record added and then replaced is reported as added.
+
+Event values are frozen records (or tuples of them, or strings), so that they
+can be shared with other threads and asyncio tasks. An EventLog attached to
+the bus appends every batch to a JSON lines file before delivery, numbering
+the events, and replays them later with the same values.
+
+"""
+
+import contextlib
+import json
+import os
+import threading
+
+from .frozen import FrozenPIDInst, _Frozen, freeze
+from .serialization import to_dict, from_dict
+
+
+class Event():
+    """
+    Base class of change events
+
+    Args:
+        key: Catalog key (identifier value) of the record changed, if it has one
+        field: Record field changed, for field level events
+        old: Value before the change (None for additions)
+        new: Value after the change (None for removals)
+        record: Mutable record changed, for events reported by watched records
+
+    """
+
+    __slots__ = ('sequence', 'key', 'field', 'old', 'new', 'record')
+
+    # Event type name, as written to event logs
+    kind = None
+
+    def __init__(self, key=None, field=None, old=None, new=None, record=None):
+        # Position in the bus's event stream, set on publication
+        self.sequence = None
+        self.key = key
+        self.field = field
+        self.old = old
+        self.new = new
+        self.record = record
+
+    def __repr__(self):
+        field = f", '{self.field}'" if self.field else ''
+        return f"{type(self).__name__} ({self.sequence}, '{self.key}'{field})"
+
+    def to_dict(self):
+        return {
+            'sequence': self.sequence,
+            'kind': self.kind,
+            'key': self.key,
+            'field': self.field,
+            'old': _encode(self.old),
+            'new': _encode(self.new),
+        }
+
+
+class RecordAdded(Event):
+    """ A record was added to a catalog (new is the record) """
+    __slots__ = ()
+    kind = 'record_added'
+
+
+class RecordReplaced(Event):
+    """ A catalog record was replaced by a changed version """
+    __slots__ = ()
+    kind = 'record_replaced'
+
+
+class RecordRemoved(Event):
+    """ A record was removed from a catalog (old is the record) """
+    __slots__ = ()
+    kind = 'record_removed'
+
+
+class FieldChanged(Event):
+    """ A record field was set to a different value """
+    __slots__ = ()
+    kind = 'field_changed'
+
+
+class OwnerAppended(Event):
+    """ An owner was appended to a record (new is the owner) """
+    __slots__ = ()
+    kind = 'owner_appended'
+
+
+class ManufacturerAppended(Event):
+    """ A manufacturer was appended to a record (new is the manufacturer) """
+    __slots__ = ()
+    kind = 'manufacturer_appended'
+
+
+class RelatedIdentifierAppended(Event):
+    """ A related identifier was appended to a record (new is the related identifier) """
+    __slots__ = ()
+    kind = 'related_identifier_appended'
+
+
+class RelatedIdentifierRemoved(Event):
+    """ A related identifier was removed from a record (old is the related identifier) """
+    __slots__ = ()
+    kind = 'related_identifier_removed'
+
+
+EVENT_TYPES = {cls.kind: cls for cls in (RecordAdded, RecordReplaced, RecordRemoved, FieldChanged, OwnerAppended,
+    ManufacturerAppended, RelatedIdentifierAppended, RelatedIdentifierRemoved)}
+
+_APPENDED = {'owners': OwnerAppended, 'manufacturers': ManufacturerAppended, 'related_identifiers': RelatedIdentifierAppended}
+_REMOVED = {'related_identifiers': RelatedIdentifierRemoved}
+
+
+def _frozen_value(field, value):
+    ''' Returns the frozen form of a PIDInst field value (lists become tuples, None lists empty tuples) '''
+
+    if field in FrozenPIDInst._sequences:
+        return () if value is None else tuple(freeze(entry) for entry in value)
+    if value is None or isinstance(value, str):
+        return value
+    return freeze(value)
+
+
+def _encode(value):
+    if isinstance(value, FrozenPIDInst):
+        return to_dict(value)
+    if isinstance(value, _Frozen):
+        return {field: _encode(getattr(value, field)) for field in value._fields}
+    if isinstance(value, tuple):
+        return [_encode(entry) for entry in value]
+    return value
+
+
+def _decode(cls, doc):
+    ''' Builds a frozen record of class cls from an encoded document '''
+
+    if doc is None:
+        return None
+    values = {}
+    for field in cls._fields:
+        value = doc.get(field)
+        if field in cls._children:
+            value = _decode(cls._children[field], value)
+        elif field in cls._sequences:
+            value = tuple(_decode(cls._sequences[field], entry) for entry in value or ())
+        values[field] = value
+    return cls(**values)
+
+
+def event_from_dict(doc:dict):
+    ''' Returns the Event for a document written by Event.to_dict() (values are frozen again) '''
+
+    cls = EVENT_TYPES[doc['kind']]
+    field = doc.get('field')
+    if field is None:
+        decode = lambda value: None if value is None else freeze(from_dict(value))
+    elif field in FrozenPIDInst._children:
+        decode = lambda value: _decode(FrozenPIDInst._children[field], value)
+    elif field in FrozenPIDInst._sequences:
+        child = FrozenPIDInst._sequences[field]
+        if cls is FieldChanged:
+            decode = lambda value: tuple(_decode(child, entry) for entry in value or ())
+        else:
+            decode = lambda value: _decode(child, value)
+    else:
+        decode = lambda value: value
+    event = cls(doc.get('key'), field, decode(doc.get('old')), decode(doc.get('new')))
+    event.sequence = doc.get('sequence')
+    return event
+
+
+def _identity(event):
+    ''' Returns what identifies the record an event is about within a batch '''
+    return ('record', id(event.record)) if event.record is not None else ('key', event.key)
+
+
+def coalesce(events):
+    '''
+    Returns a batch of events with redundant events merged
+
+    Repeated changes to a field keep the first old and last new value, and
+    are dropped if the field ends up unchanged; an append followed by the
+    removal of the same value cancel out; successive catalog events for one
+    key are merged (added then replaced is added, added then removed is
+    nothing, removed then added is replaced). Merged events keep the position
+    of the first.
+
+    '''
+
+    merged = []
+    positions = {}
+    for event in events:
+        if isinstance(event, FieldChanged):
+            slot = ('field', _identity(event), event.field)
+            position = positions.get(slot)
+            if position is None:
+                positions[slot] = len(merged)
+                merged.append(event)
+                continue
+            first = merged[position]
+            if first.old == event.new:
+                merged[position] = None
+                del positions[slot]
+            else:
+                merged[position] = FieldChanged(first.key, first.field, first.old, event.new, first.record)
+        elif type(event) in _REMOVED.values():
+            slot = ('appended', _identity(event), event.field, event.old)
+            position = positions.pop(slot, None)
+            if position is not None:
+                merged[position] = None
+            else:
+                merged.append(event)
+        elif type(event) in _APPENDED.values():
+            positions[('appended', _identity(event), event.field, event.new)] = len(merged)
+            merged.append(event)
+        elif isinstance(event, (RecordAdded, RecordReplaced, RecordRemoved)):
+            slot = ('catalog', event.key)
+            position = positions.get(slot)
+            first = merged[position] if position is not None else None
+            if first is None:
+                positions[slot] = len(merged)
+                merged.append(event)
+                continue
+            if isinstance(first, RecordAdded):
+                cls = None if isinstance(event, RecordRemoved) else RecordAdded
+            elif isinstance(event, RecordRemoved):
+                cls = RecordRemoved
+            else:
+                cls = RecordReplaced
+            old = None if cls is RecordAdded else first.old
+            if cls is None or (cls is RecordReplaced and old == event.new):
+                merged[position] = None
+                del positions[slot]
+            else:
+                merged[position] = cls(first.key, None, old, event.new)
+        else:
+            merged.append(event)
+    return [event for event in merged if event is not None]
+
+
+class EventBus():
+    """
+    Delivers batches of change events to subscribers
+
+    Subscribers are called with a list of events, in publication order, on
+    the thread that made the changes; asyncio subscribers receive the same
+    batches through a queue on their event loop. Exceptions raised by a
+    subscriber propagate to the code making the change.
+
+    Args:
+        log: EventLog to append every batch to before delivery
+
+    """
+
+    def __init__(self, log=None):
+        self.log = log
+        self._lock = threading.RLock()
+        self._subscribers = []
+        # Events of batches opened with batch() on each thread
+        self._local = threading.local()
+        self._sequence = log.last_sequence if log is not None else 0
+
+    def __repr__(self):
+        return f"EventBus ({len(self._subscribers)} subscribers, {self._sequence} events)"
+
+    @property
+    def sequence(self):
+        ''' Sequence number of the last event published '''
+        return self._sequence
+
+    def subscribe(self, callback, kinds=None):
+        '''
+        Registers callback(events) to be called with each batch of events
+
+        kinds restricts the batches to events of the given Event classes;
+        batches left empty are not delivered. Returns callback.
+
+        '''
+
+        kinds = tuple(kinds) if kinds is not None else None
+        with self._lock:
+            self._subscribers.append((callback, kinds))
+        return callback
+
+    def unsubscribe(self, callback):
+        with self._lock:
+            self._subscribers = [entry for entry in self._subscribers if entry[0] != callback]
+
+    def subscribe_async(self, loop=None, kinds=None):
+        ''' Returns an AsyncSubscription delivering batches to an asyncio event loop (the running loop by default) '''
+        return AsyncSubscription(self, loop, kinds)
+
+    def watch(self, record):
+        ''' Reports the changes made to a mutable PIDInst record from now on to this bus; returns the record '''
+
+        record._bus = self
+        return record
+
+    def unwatch(self, record):
+        if getattr(record, '_bus', None) is self:
+            record._bus = None
+
+    @contextlib.contextmanager
+    def batch(self):
+        '''
+        Collects the events of changes made by this thread inside a with block and publishes them as one batch
+
+        Batches nest: only the outermost one publishes. Changes already made
+        are published even if the block raises.
+
+        '''
+
+        pending = getattr(self._local, 'pending', None)
+        if pending is not None:
+            yield self
+            return
+        self._local.pending = pending = []
+        try:
+            yield self
+        finally:
+            self._local.pending = None
+            self.publish(pending)
+
+    def emit(self, event):
+        ''' Publishes one event, or adds it to this thread's open batch '''
+
+        pending = getattr(self._local, 'pending', None)
+        if pending is not None:
+            pending.append(event)
+        else:
+            self.publish([event])
+
+    def publish(self, events):
+        ''' Coalesces a batch of events, numbers it, appends it to the log and delivers it; returns the published events '''
+
+        pending = getattr(self._local, 'pending', None)
+        if pending is not None:
+            pending.extend(events)
+            return []
+        events = coalesce(events)
+        if not events:
+            return events
+        with self._lock:
+            for event in events:
+                self._sequence += 1
+                event.sequence = self._sequence
+            if self.log is not None:
+                self.log.append(events)
+            for callback, kinds in self._subscribers:
+                selected = events if kinds is None else [event for event in events if isinstance(event, kinds)]
+                if selected:
+                    callback(selected)
+        return events
+
+    # Called by watched PIDInst records
+
+    def set_field(self, record, field, value):
+        ''' Stores a validated value in a watched record's field and reports the change '''
+
+        old = getattr(record, '_' + field, None)
+        setattr(record, '_' + field, value)
+        old, new = _frozen_value(field, old), _frozen_value(field, value)
+        if old != new:
+            self.emit(FieldChanged(_record_key(record), field, old, new, record))
+
+    def appended(self, record, field, value):
+        self.emit(_APPENDED[field](_record_key(record), field, None, freeze(value), record))
+
+    def removed(self, record, field, value):
+        self.emit(_REMOVED[field](_record_key(record), field, freeze(value), None, record))
+
+    # Called by catalogs
+
+    def catalog_changed(self, changes):
+        ''' Publishes (key, old record or None, new record or None) changes committed together as one batch '''
+
+        events = []
+        for key, old, record in changes:
+            if old is None:
+                events.append(RecordAdded(key, None, None, record))
+            elif record is None:
+                events.append(RecordRemoved(key, None, old, None))
+            else:
+                events.append(RecordReplaced(key, None, old, record))
+        self.publish(events)
+
+
+def _record_key(record):
+    identifier = getattr(record, '_identifier', None)
+    return identifier.identifier_value if identifier is not None else None
+
+
+class AsyncSubscription():
+    """
+    Queue of event batches for an asyncio event loop
+
+    Batches are handed to the loop thread-safely, so changes may be made from
+    any thread. Use `await subscription.get()` or `async for events in
+    subscription`; iteration ends once the subscription is closed.
+
+    """
+
+    def __init__(self, bus, loop=None, kinds=None):
+        import asyncio
+        self._bus = bus
+        self._loop = loop or asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        self._closed = False
+        bus.subscribe(self._deliver, kinds)
+
+    def _deliver(self, events):
+        try:
+            self._loop.call_soon_threadsafe(self._queue.put_nowait, events)
+        except RuntimeError:
+            # The event loop has been closed
+            self._bus.unsubscribe(self._deliver)
+
+    async def get(self):
+        ''' Returns the next batch of events, or None once the subscription is closed and drained '''
+
+        if self._closed and self._queue.empty():
+            return None
+        return await self._queue.get()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        events = await self.get()
+        if events is None:
+            raise StopAsyncIteration
+        return events
+
+    def close(self):
+        ''' Stops delivery; batches already queued are still returned '''
+
+        if not self._closed:
+            self._closed = True
+            self._bus.unsubscribe(self._deliver)
+            self._loop.call_soon_threadsafe(self._queue.put_nowait, None)
+
+
+class EventLog():
+    """
+    Durable append-only log of published events in a JSON lines file
+
+    Each batch is written and flushed (and by default fsynced) before it is
+    delivered to subscribers, so subscribers that record the sequence number
+    of the last event they processed can catch up after a restart with
+    replay(). A last line left incomplete by a crash is dropped on opening.
+
+    Args:
+        path: Log file, created if missing
+        fsync: Whether to fsync the file after each batch
+
+    """
+
+    def __init__(self, path:str, fsync:bool = True):
+        self.path = path
+        self.fsync = fsync
+        self.last_sequence = self._recover()
+        self._fh = open(path, 'a', encoding='utf-8')
+
+    def __repr__(self):
+        return f"EventLog ('{self.path}', {self.last_sequence} events)"
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def _recover(self):
+        ''' Truncates an incomplete last line and returns the sequence number of the last event in the log '''
+
+        try:
+            fh = open(self.path, 'rb+')
+        except FileNotFoundError:
+            return 0
+        with fh:
+            end = position = fh.seek(0, os.SEEK_END)
+            tail = b''
+            # Read back until the last complete line is entirely in tail
+            while position > 0 and tail.count(b'\n') < 2:
+                step = min(position, 1 << 16)
+                position -= step
+                fh.seek(position)
+                tail = fh.read(step) + tail
+            complete = tail.rfind(b'\n') + 1
+            if position + complete < end:
+                fh.truncate(position + complete)
+            lines = tail[:complete].splitlines()
+        return json.loads(lines[-1])['sequence'] if lines else 0
+
+    def append(self, events):
+        ''' Appends a batch of numbered events '''
+
+        self._fh.write(''.join(json.dumps(event.to_dict(), ensure_ascii=False, separators=(',', ':')) + '\n' for event in events))
+        self._fh.flush()
+        if self.fsync:
+            os.fsync(self._fh.fileno())
+        self.last_sequence = events[-1].sequence
+
+    def events(self, after:int = 0):
+        ''' Yields the logged events with sequence numbers greater than after '''
+
+        with open(self.path, encoding='utf-8') as fh:
+            for line in fh:
+                if not line.endswith('\n'):
+                    break
+                doc = json.loads(line)
+                if doc['sequence'] > after:
+                    yield event_from_dict(doc)
+
+    def replay(self, callback, after:int = 0, batch_size:int = 1000):
+        ''' Calls callback(events) with the logged events after a sequence number, in batches; returns the last sequence number delivered '''
+
+        last = after
+        batch = []
+        for event in self.events(after):
+            batch.append(event)
+            if len(batch) >= batch_size:
+                callback(batch)
+                last, batch = batch[-1].sequence, []
+        if batch:
+            callback(batch)
+            last = batch[-1].sequence
+        return last
+
+    def close(self):
+        self._fh.close()
@@ -0,0 +1,288 @@
+""" Frozen PIDINST records
+Immutable, hashable counterparts of the PIDInst classes.
+
+Frozen records store repeated children in tuples, cache their hash and can be
+shared freely between threads or used as dict keys and set members. Updates
+are made with evolve(), which returns a new record sharing every unchanged
+subtree with the original.
+
+"""
+
+from .pidinst import PIDInst, Identifier, OwnerIdentifier, Owner, ManufacturerIdentifier, \
+    Manufacturer, ModelIdentifier, Model, RelatedIdentifier
+
+
+def _restore(cls, values):
+    ''' Rebuild a frozen record from already validated field values (used by pickle) '''
+    return cls._build(values)
+
+
+class _Frozen():
+    """ Base class for frozen records """
+
+    __slots__ = ('_hash',)
+
+    # Mutable class mirrored by this frozen class
+    _mutable_class = None
+    # Field names; the first is shown by repr, and the order is the layout of _values() and _build()
+    _fields = ()
+    # Fields holding a single nested record: field -> frozen class
+    _children = {}
+    # Fields holding a tuple of nested records: field -> frozen class
+    _sequences = {}
+
+    def __init__(self, **kwargs):
+        unknown = set(kwargs) - set(self._fields)
+        if unknown:
+            raise TypeError(f"{type(self).__name__} got unexpected fields: {', '.join(sorted(unknown))}")
+        for field in self._fields:
+            object.__setattr__(self, field, self._coerce(field, kwargs.get(field)))
+        object.__setattr__(self, '_hash', None)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is immutable, use evolve() instead")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __eq__(self, other):
+        if self is other:
+            return True
+        if type(self) is not type(other):
+            return NotImplemented
+        return hash(self) == hash(other) and self._values() == other._values()
+
+    def __hash__(self):
+        if self._hash is None:
+            object.__setattr__(self, '_hash', hash((type(self).__name__, self._values())))
+        return self._hash
+
+    def __reduce__(self):
+        return (_restore, (type(self), self._values()))
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __repr__(self):
+        return f"{type(self).__name__} ('{getattr(self, self._fields[0])}')"
+
+    def _values(self):
+        return tuple(getattr(self, field) for field in self._fields)
+
+    @classmethod
+    def _build(cls, values):
+        record = object.__new__(cls)
+        for field, value in zip(cls._fields, values):
+            object.__setattr__(record, field, value)
+        object.__setattr__(record, '_hash', None)
+        return record
+
+    def _coerce(self, field, value):
+        ''' Validate a field value, freezing any mutable children it contains '''
+
+        if field in self._children:
+            child_class = self._children[field]
+            if value is None or isinstance(value, child_class):
+                return value
+            if isinstance(value, child_class._mutable_class):
+                return child_class.from_mutable(value)
+            raise TypeError(f"{field} must be instance of {child_class._mutable_class.__name__} class")
+
+        if field in self._sequences:
+            child_class = self._sequences[field]
+            if value is None:
+                return ()
+            if not isinstance(value, (list, tuple)):
+                raise TypeError(f"{field} must be a list of {child_class._mutable_class.__name__} objects")
+            entries = []
+            for entry in value:
+                if isinstance(entry, child_class):
+                    entries.append(entry)
+                elif isinstance(entry, child_class._mutable_class):
+                    entries.append(child_class.from_mutable(entry))
+                else:
+                    raise TypeError(f"{field} must be a list of {child_class._mutable_class.__name__} objects")
+            if isinstance(value, tuple) and all(a is b for a, b in zip(entries, value)):
+                return value
+            return tuple(entries)
+
+        # Scalar fields are checked by the mutable class's own property setter
+        scratch = object.__new__(self._mutable_class)
+        getattr(self._mutable_class, field).fset(scratch, value)
+        return value
+
+    def evolve(self, **changes):
+        ''' Returns a new record with the given fields replaced, sharing all unchanged values '''
+
+        unknown = set(changes) - set(self._fields)
+        if unknown:
+            raise TypeError(f"{type(self).__name__} got unexpected fields: {', '.join(sorted(unknown))}")
+        if not changes:
+            return self
+        record = object.__new__(type(self))
+        for field in self._fields:
+            if field in changes:
+                value = record._coerce(field, changes[field])
+            else:
+                value = getattr(self, field)
+            object.__setattr__(record, field, value)
+        object.__setattr__(record, '_hash', None)
+        return record
+
+    @classmethod
+    def from_mutable(cls, obj):
+        ''' Returns a frozen copy of a (validated) mutable record '''
+
+        if not isinstance(obj, cls._mutable_class):
+            raise TypeError(f"obj must be instance of {cls._mutable_class.__name__} class")
+        values = []
+        for field in cls._fields:
+            value = getattr(obj, field)
+            if field in cls._children and value is not None:
+                value = cls._children[field].from_mutable(value)
+            elif field in cls._sequences:
+                child_class = cls._sequences[field]
+                value = () if value is None else tuple(child_class.from_mutable(entry) for entry in value)
+            values.append(value)
+        return cls._build(values)
+
+    def to_mutable(self):
+        ''' Returns a new mutable copy of this record '''
+
+        obj = object.__new__(self._mutable_class)
+        for field in self._fields:
+            value = getattr(self, field)
+            if field in self._children and value is not None:
+                value = value.to_mutable()
+            elif field in self._sequences:
+                value = [entry.to_mutable() for entry in value]
+            setattr(obj, '_' + field, value)
+        return obj
+
+
+class FrozenIdentifier(_Frozen):
+    """ Frozen Persistent Identifier """
+
+    _mutable_class = Identifier
+    _fields = ('identifier_value', 'identifier_type')
+    __slots__ = _fields
+
+
+class FrozenOwnerIdentifier(_Frozen):
+    """ Frozen PIDInst Owner Identifier """
+
+    _mutable_class = OwnerIdentifier
+    _fields = ('owner_identifier_value', 'owner_identifier_type')
+    __slots__ = _fields
+
+
+class FrozenOwner(_Frozen):
+    """ Frozen Owner Class """
+
+    _mutable_class = Owner
+    _fields = ('owner_name', 'owner_identifier', 'owner_contact')
+    _children = {'owner_identifier': FrozenOwnerIdentifier}
+    __slots__ = _fields
+
+
+class FrozenManufacturerIdentifier(_Frozen):
+    """ Frozen PIDInst Manufacturer Identifier """
+
+    _mutable_class = ManufacturerIdentifier
+    _fields = ('manufacturer_identifier_value', 'manufacturer_identifier_type')
+    __slots__ = _fields
+
+
+class FrozenManufacturer(_Frozen):
+    """ Frozen Manufacturer Class """
+
+    _mutable_class = Manufacturer
+    _fields = ('manufacturer_name', 'manufacturer_identifier')
+    _children = {'manufacturer_identifier': FrozenManufacturerIdentifier}
+    __slots__ = _fields
+
+
+class FrozenModelIdentifier(_Frozen):
+    """ Frozen Instrument Model Identifier """
+
+    _mutable_class = ModelIdentifier
+    _fields = ('model_identifier_value', 'model_identifier_type')
+    __slots__ = _fields
+
+
+class FrozenModel(_Frozen):
+    """ Frozen Instrument Model Class """
+
+    _mutable_class = Model
+    _fields = ('model_name', 'model_identifier')
+    _children = {'model_identifier': FrozenModelIdentifier}
+    __slots__ = _fields
+
+
+class FrozenRelatedIdentifier(_Frozen):
+    """ Frozen Related Identifier Class """
+
+    _mutable_class = RelatedIdentifier
+    _fields = ('related_identifier_value', 'related_identifier_type', 'related_identifier_relation_type', 'related_identifier_name')
+    __slots__ = _fields
+
+
+class FrozenPIDInst(_Frozen):
+    """
+    Frozen Research Instrument record following the PIDInst Schema (Version 1.0).
+
+    owners, manufacturers and related_identifiers are stored as tuples. Mutable
+    children passed in are frozen on the way in.
+
+    """
+
+    _schema_version = PIDInst._schema_version
+
+    _mutable_class = PIDInst
+    _fields = ('name', 'identifier', 'landing_page', 'description', 'model', 'owners', 'manufacturers', 'related_identifiers')
+    _children = {'identifier': FrozenIdentifier, 'model': FrozenModel}
+    _sequences = {'owners': FrozenOwner, 'manufacturers': FrozenManufacturer, 'related_identifiers': FrozenRelatedIdentifier}
+    __slots__ = _fields
+
+    is_valid_pidinst = PIDInst.is_valid_pidinst
+
+    def __str__(self):
+        return self.name
+
+    def evolve(self, **changes):
+        ''' Returns a new record with the given fields replaced, sharing all unchanged values '''
+
+        if changes.get('identifier') is not None and self.identifier is not None and changes['identifier'] != self.identifier:
+            raise ValueError("This Instrument record already has an identifier allocated")
+        return super().evolve(**changes)
+
+
+_FROZEN_CLASSES = {
+    cls._mutable_class: cls for cls in (FrozenIdentifier, FrozenOwnerIdentifier, FrozenOwner, FrozenManufacturerIdentifier,
+        FrozenManufacturer, FrozenModelIdentifier, FrozenModel, FrozenRelatedIdentifier, FrozenPIDInst)
+}
+
+
+def freeze(obj):
+    ''' Returns the frozen counterpart of a mutable PIDInst record (frozen records are returned as-is) '''
+
+    if isinstance(obj, _Frozen):
+        return obj
+    try:
+        frozen_class = _FROZEN_CLASSES[type(obj)]
+    except KeyError:
+        raise TypeError(f"Cannot freeze object of type {type(obj).__name__}") from None
+    return frozen_class.from_mutable(obj)
+
+
+def thaw(obj):
+    ''' Returns a new mutable copy of a frozen record (mutable records are returned as-is) '''
+
+    if isinstance(obj, _Frozen):
+        return obj.to_mutable()
+    if type(obj) in _FROZEN_CLASSES:
+        return obj
+    raise TypeError(f"Cannot thaw object of type {type(obj).__name__}")
@@ -0,0 +1,176 @@
+""" PIDINST Record History
+Versioned storage of instrument record revisions.
+
+Each revision is kept as a delta (the top level fields that changed) against
+the previous revision, with a full snapshot every `snapshot_interval`
+revisions so that rebuilding any revision applies a bounded number of deltas.
+Revisions are frozen records and unchanged Owner, Manufacturer and Model
+objects are shared between them rather than copied.
+
+"""
+
+import time
+from bisect import bisect_right
+
+from .frozen import freeze
+
+
+class RecordHistory():
+    """
+    Revision history of a single instrument record
+
+    Args:
+        snapshot_interval: Number of revisions between full snapshots
+
+    """
+
+    def __init__(self, snapshot_interval:int = 16):
+        if not isinstance(snapshot_interval, int) or isinstance(snapshot_interval, bool):
+            raise TypeError("snapshot_interval must be an integer")
+        if snapshot_interval < 1:
+            raise ValueError("snapshot_interval must be at least 1")
+        self.snapshot_interval = snapshot_interval
+        # One entry per revision: a full record for snapshots, a dict of changed fields otherwise
+        self._entries = []
+        self._timestamps = []
+        self._latest = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __repr__(self):
+        return f"RecordHistory ({len(self)} revisions)"
+
+    @property
+    def latest(self):
+        return self._latest
+
+    @property
+    def timestamps(self):
+        return tuple(self._timestamps)
+
+    def commit(self, record, timestamp:float = None):
+        ''' Stores a new revision of the record and returns its revision number '''
+
+        record = freeze(record)
+        if timestamp is None:
+            timestamp = time.time()
+        if self._timestamps and timestamp < self._timestamps[-1]:
+            raise ValueError("timestamp must not be earlier than the previous revision")
+
+        revision = len(self._entries)
+        if self._latest is not None:
+            record = self._share(self._latest, record)
+        if revision % self.snapshot_interval == 0:
+            entry = record
+        else:
+            entry = {field: getattr(record, field) for field in record._fields
+                     if getattr(record, field) is not getattr(self._latest, field)}
+
+        self._entries.append(entry)
+        self._timestamps.append(timestamp)
+        self._latest = record
+        return revision
+
+    def get(self, revision:int):
+        ''' Returns the record as it was at the given revision number '''
+
+        if not isinstance(revision, int) or isinstance(revision, bool):
+            raise TypeError("revision must be an integer")
+        if revision < 0:
+            revision += len(self._entries)
+        if not 0 <= revision < len(self._entries):
+            raise IndexError("revision out of range")
+        if revision == len(self._entries) - 1:
+            return self._latest
+
+        start = revision - revision % self.snapshot_interval
+        record = self._entries[start]
+        for delta in self._entries[start + 1:revision + 1]:
+            # Delta values were validated on commit, so rebuild without re-checking them
+            record = record._build([delta.get(field, getattr(record, field)) for field in record._fields])
+        return record
+
+    def revision_at(self, timestamp:float):
+        ''' Returns the number of the latest revision committed at or before timestamp '''
+
+        revision = bisect_right(self._timestamps, timestamp) - 1
+        if revision < 0:
+            raise LookupError("No revision exists at or before the given timestamp")
+        return revision
+
+    def at(self, timestamp:float):
+        ''' Returns the record as it was at the given timestamp '''
+        return self.get(self.revision_at(timestamp))
+
+    @staticmethod
+    def _share(previous, record):
+        ''' Returns record with every value equal to one in previous replaced by the previous object '''
+
+        changes = {}
+        for field in record._fields:
+            old, new = getattr(previous, field), getattr(record, field)
+            if old is new:
+                continue
+            if old == new:
+                changes[field] = old
+            elif isinstance(new, tuple) and old:
+                existing = {entry: entry for entry in old}
+                shared = tuple(existing.get(entry, entry) for entry in new)
+                if any(a is not b for a, b in zip(shared, new)):
+                    changes[field] = shared
+        return record.evolve(**changes) if changes else record
+
+
+class VersionStore():
+    """
+    Revision histories for a collection of instrument records, keyed by identifier value
+
+    Args:
+        snapshot_interval: Number of revisions between full snapshots
+
+    """
+
+    def __init__(self, snapshot_interval:int = 16):
+        self.snapshot_interval = snapshot_interval
+        self._histories = {}
+
+    def __len__(self):
+        return len(self._histories)
+
+    def __contains__(self, identifier_value):
+        return identifier_value in self._histories
+
+    def __iter__(self):
+        return iter(self._histories)
+
+    def commit(self, record, timestamp:float = None):
+        ''' Stores a new revision of the record and returns its revision number '''
+
+        if record.identifier is None:
+            raise ValueError("record must have an identifier to be versioned")
+        key = record.identifier.identifier_value
+        history = self._histories.get(key)
+        if history is None:
+            history = self._histories[key] = RecordHistory(self.snapshot_interval)
+        return history.commit(record, timestamp)
+
+    def history(self, identifier_value:str):
+        ''' Returns the RecordHistory for the given identifier value '''
+
+        try:
+            return self._histories[identifier_value]
+        except KeyError:
+            raise KeyError(f"No history for identifier {identifier_value}") from None
+
+    def get(self, identifier_value:str, revision:int = None, timestamp:float = None):
+        ''' Returns a revision of a record by revision number or timestamp (latest by default) '''
+
+        if revision is not None and timestamp is not None:
+            raise ValueError("Only one of revision or timestamp may be given")
+        history = self.history(identifier_value)
+        if timestamp is not None:
+            return history.at(timestamp)
+        if revision is not None:
+            return history.get(revision)
+        return history.latest
@@ -0,0 +1,312 @@
+""" PIDINST Bulk Importer
+Streaming import of CSV/TSV spreadsheets into PIDInst records.
+
+Each row is one instrument. A ColumnMapping declares which column feeds which
+field, using dotted paths for nested objects. Repeated owners, manufacturers
+and related identifiers are mapped with column templates containing `{n}`,
+e.g. 'owner_{n}_name', which match owner_1_name, owner_2_name and so on.
+
+Rows are read and converted one at a time so memory use does not grow with
+the file. Invalid rows are not imported; they are written, together with
+every validation error found in them, to a reject sink.
+
+"""
+
+import csv
+import re
+
+from .pidinst import PIDInst, Identifier, OwnerIdentifier, Owner, ManufacturerIdentifier, \
+    Manufacturer, ModelIdentifier, Model, RelatedIdentifier
+
+# Fields of each class, and which of them hold nested objects
+_FIELDS = {
+    PIDInst: ('name', 'identifier', 'landing_page', 'description', 'model'),
+    Identifier: ('identifier_value', 'identifier_type'),
+    Model: ('model_name', 'model_identifier'),
+    ModelIdentifier: ('model_identifier_value', 'model_identifier_type'),
+    Owner: ('owner_name', 'owner_identifier', 'owner_contact'),
+    OwnerIdentifier: ('owner_identifier_value', 'owner_identifier_type'),
+    Manufacturer: ('manufacturer_name', 'manufacturer_identifier'),
+    ManufacturerIdentifier: ('manufacturer_identifier_value', 'manufacturer_identifier_type'),
+    RelatedIdentifier: ('related_identifier_value', 'related_identifier_type', 'related_identifier_relation_type', 'related_identifier_name'),
+}
+_CHILDREN = {
+    PIDInst: {'identifier': Identifier, 'model': Model},
+    Model: {'model_identifier': ModelIdentifier},
+    Owner: {'owner_identifier': OwnerIdentifier},
+    Manufacturer: {'manufacturer_identifier': ManufacturerIdentifier},
+}
+_GROUPS = {
+    'owners': Owner,
+    'manufacturers': Manufacturer,
+    'related_identifiers': RelatedIdentifier,
+}
+
+
+def _check_path(cls, path):
+    parts = path.split('.')
+    for i, part in enumerate(parts):
+        if part not in _FIELDS[cls]:
+            raise ValueError(f"Unknown field '{path}' for {cls.__name__}")
+        child = _CHILDREN.get(cls, {}).get(part)
+        if i < len(parts) - 1:
+            if child is None:
+                raise ValueError(f"Field '{path}' does not refer to a nested object")
+            cls = child
+        elif child is not None:
+            raise ValueError(f"Field '{path}' refers to an object, map its fields instead")
+
+
+class ColumnMapping():
+    """
+    Declarative mapping of spreadsheet columns to PIDInst fields
+
+    Args:
+        fields: Dict of dotted PIDInst field path -> column name,
+            e.g. {'name': 'name', 'identifier.identifier_value': 'doi'}
+        owners, manufacturers, related_identifiers: Dicts of dotted field path
+            (relative to the repeated object) -> column template containing {n}
+        constants: Dict of dotted field path -> fixed value, applied whenever the
+            object holding that field is present in a row. Paths into repeated
+            objects are prefixed with the group name,
+            e.g. {'owners.owner_identifier.owner_identifier_type': 'ORCID'}
+
+    """
+
+    def __init__(self, fields:dict = None, owners:dict = None, manufacturers:dict = None, related_identifiers:dict = None, constants:dict = None):
+        self.fields = dict(fields or {})
+        self.groups = {'owners': dict(owners or {}), 'manufacturers': dict(manufacturers or {}), 'related_identifiers': dict(related_identifiers or {})}
+        self.constants = dict(constants or {})
+
+        for path in self.fields:
+            _check_path(PIDInst, path)
+        for group, templates in self.groups.items():
+            for path, template in templates.items():
+                _check_path(_GROUPS[group], path)
+                if '{n}' not in template:
+                    raise ValueError(f"Column template '{template}' must contain {{n}}")
+        for path in self.constants:
+            group = path.split('.', 1)[0]
+            if group in _GROUPS:
+                _check_path(_GROUPS[group], path.split('.', 1)[1])
+            else:
+                _check_path(PIDInst, path)
+
+    def columns(self, header):
+        ''' Resolves the mapping against a header row into (top level columns, {group: [(n, {path: column})]}) '''
+
+        header = set(header)
+        fields = {path: column for path, column in self.fields.items() if column in header}
+        groups = {}
+        for group, templates in self.groups.items():
+            entries = {}
+            for path, template in templates.items():
+                prefix, suffix = template.split('{n}', 1)
+                pattern = re.compile(re.escape(prefix) + r'(\d+)' + re.escape(suffix) + '$')
+                for column in header:
+                    match = pattern.match(column)
+                    if match:
+                        entries.setdefault(int(match.group(1)), {})[path] = column
+            groups[group] = sorted(entries.items())
+        return fields, groups
+
+
+# Mapping for spreadsheets whose columns are named after the PIDInst fields
+DEFAULT_MAPPING = ColumnMapping(
+    fields={
+        'identifier.identifier_value': 'identifier',
+        'identifier.identifier_type': 'identifier_type',
+        'landing_page': 'landing_page',
+        'name': 'name',
+        'description': 'description',
+        'model.model_name': 'model_name',
+        'model.model_identifier.model_identifier_value': 'model_identifier',
+        'model.model_identifier.model_identifier_type': 'model_identifier_type',
+    },
+    owners={
+        'owner_name': 'owner_{n}_name',
+        'owner_contact': 'owner_{n}_contact',
+        'owner_identifier.owner_identifier_value': 'owner_{n}_orcid',
+    },
+    manufacturers={
+        'manufacturer_name': 'manufacturer_{n}_name',
+        'manufacturer_identifier.manufacturer_identifier_value': 'manufacturer_{n}_url',
+    },
+    related_identifiers={
+        'related_identifier_value': 'related_{n}_value',
+        'related_identifier_type': 'related_{n}_type',
+        'related_identifier_relation_type': 'related_{n}_relation_type',
+        'related_identifier_name': 'related_{n}_name',
+    },
+    constants={
+        'owners.owner_identifier.owner_identifier_type': 'ORCID',
+        'manufacturers.manufacturer_identifier.manufacturer_identifier_type': 'URL',
+    },
+)
+
+
+def _nest(values, path, column, value):
+    parts = path.split('.')
+    for part in parts[:-1]:
+        values = values.setdefault(part, {})
+    values[parts[-1]] = (column, value)
+
+
+def _apply_constants(values, constants):
+    ''' Adds constant values to nested objects that are present (or to the top level) '''
+
+    for path, constant in constants.items():
+        parts = path.split('.')
+        target = values
+        for part in parts[:-1]:
+            target = target.get(part)
+            if target is None:
+                break
+        else:
+            target.setdefault(parts[-1], (None, constant))
+
+
+def _construct(cls, values, errors, where):
+    ''' Builds cls from nested {field: (column, value)} values, recording every error instead of raising '''
+
+    obj = object.__new__(cls)
+    ok = True
+    for field in _FIELDS[cls]:
+        entry = values.get(field)
+        child = _CHILDREN.get(cls, {}).get(field)
+        if child is not None:
+            value = _construct(child, entry, errors, f"{where}{field}.") if entry else None
+            if entry and value is None:
+                ok = False
+                value = None
+            column = None
+        else:
+            column, value = entry if entry else (None, None)
+        try:
+            setattr(obj, field, value)
+        except (TypeError, ValueError) as exc:
+            errors.append({'field': f"{where}{field}", 'column': column, 'error': str(exc)})
+            ok = False
+    return obj if ok else None
+
+
+class RowError(ValueError):
+    """ Raised for rows that cannot be imported, carrying every validation error found """
+
+    def __init__(self, line:int, row:dict, errors:list):
+        super().__init__(f"Row {line} is invalid: " + '; '.join(f"{e['field']}: {e['error']}" for e in errors))
+        self.line = line
+        self.row = row
+        self.errors = errors
+
+
+class RejectWriter():
+    """
+    Reject sink writing invalid rows to a CSV/TSV file
+
+    Each rejected row is written with its original columns plus `_line` (the
+    line number in the source) and `_errors` (every validation error found).
+
+    """
+
+    def __init__(self, fh, fieldnames:list, delimiter:str = ','):
+        self._writer = csv.DictWriter(fh, fieldnames=list(fieldnames) + ['_line', '_errors'], delimiter=delimiter, extrasaction='ignore')
+        self._writer.writeheader()
+        self.count = 0
+
+    def __call__(self, error:RowError):
+        row = dict(error.row)
+        row['_line'] = error.line
+        row['_errors'] = ' | '.join(f"{e['column'] or e['field']}: {e['error']}" for e in error.errors)
+        self._writer.writerow(row)
+        self.count += 1
+
+
+def import_rows(rows, header:list, mapping:ColumnMapping = DEFAULT_MAPPING, reject=None, first_line:int = 2):
+    '''
+    Generator converting dict rows into PIDInst records
+
+    Args:
+        rows: Iterable of dicts keyed by column name (e.g. a csv.DictReader)
+        header: Column names of the rows
+        mapping: ColumnMapping to apply
+        reject: Callable receiving a RowError for each invalid row. When None,
+            the RowError is raised instead.
+        first_line: Line number of the first row, used in error reports. Rows
+            from a csv.DictReader are reported at the reader's line_num
+            instead, which stays right when quoted cells span several lines.
+
+    '''
+
+    fields, groups = mapping.columns(header)
+    top_constants = {p: v for p, v in mapping.constants.items() if p.split('.', 1)[0] not in _GROUPS}
+    group_constants = {group: {p.split('.', 1)[1]: v for p, v in mapping.constants.items() if p.split('.', 1)[0] == group} for group in _GROUPS}
+
+    for line, row in enumerate(rows, first_line):
+        if isinstance(rows, csv.DictReader):
+            # Counting rows drifts from the source lines once a quoted cell holds a newline
+            line = rows.line_num
+        errors = []
+        values = {}
+        for path, column in fields.items():
+            cell = row.get(column)
+            if cell is not None and cell.strip() != '':
+                _nest(values, path, column, cell.strip())
+        _apply_constants(values, top_constants)
+        record = _construct(PIDInst, values, errors, '')
+
+        for group, entries in groups.items():
+            children = []
+            for n, columns in entries:
+                child_values = {}
+                for path, column in columns.items():
+                    cell = row.get(column)
+                    if cell is not None and cell.strip() != '':
+                        _nest(child_values, path, column, cell.strip())
+                if not child_values:
+                    continue
+                _apply_constants(child_values, group_constants[group])
+                child = _construct(_GROUPS[group], child_values, errors, f"{group}[{n}].")
+                if child is not None:
+                    children.append(child)
+            if record is not None:
+                setattr(record, group, children)
+
+        if errors:
+            error = RowError(line, row, errors)
+            if reject is None:
+                raise error
+            reject(error)
+            continue
+        yield record
+
+
+def import_csv(source, mapping:ColumnMapping = DEFAULT_MAPPING, reject_path:str = None, delimiter:str = None):
+    '''
+    Generator reading PIDInst records from a CSV or TSV file
+
+    Args:
+        source: File path or readable text file object
+        mapping: ColumnMapping to apply
+        reject_path: Where to write invalid rows. When None, invalid rows raise RowError.
+        delimiter: Column delimiter; defaults to a tab for .tsv/.tab paths and a comma otherwise
+
+    '''
+
+    if delimiter is None:
+        delimiter = '\t' if isinstance(source, str) and source.lower().endswith(('.tsv', '.tab')) else ','
+    fh = open(source, newline='', encoding='utf-8-sig') if isinstance(source, str) else source
+    reject_fh = None
+    try:
+        reader = csv.DictReader(fh, delimiter=delimiter)
+        header = reader.fieldnames or []
+        reject = None
+        if reject_path:
+            reject_fh = open(reject_path, 'w', newline='', encoding='utf-8')
+            reject = RejectWriter(reject_fh, header, delimiter)
+        yield from import_rows(reader, header, mapping, reject)
+    finally:
+        if reject_fh:
+            reject_fh.close()
+        if fh is not source:
+            fh.close()
@@ -0,0 +1,206 @@
+""" PIDINST Build Manifests
+Incremental re-indexing of a directory tree of record files.
+
+A BuildManifest remembers the path, mtime, size, content hash and record key
+of every record file seen on the previous run. Files whose mtime and size are
+unchanged are skipped without being read; files that were touched but whose
+content hash is unchanged are not re-parsed. Only new and changed files are
+parsed into PIDInst records, and records of deleted files are removed.
+
+IncrementalIndexer applies those changes to a ConcurrentCatalog in a single
+batch, which keeps the catalog's hash indexes (and any listeners such as
+CatalogStats) up to date in place.
+
+"""
+
+import fnmatch
+import hashlib
+import json
+import os
+import re
+
+from .catalog import record_key
+from .serialization import from_dict
+
+
+def load_record_file(path:str):
+    ''' Returns the PIDInst record stored as a JSON document in path '''
+
+    with open(path, encoding='utf-8') as fh:
+        return from_dict(json.load(fh))
+
+
+def file_hash(path:str):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fh:
+        for chunk in iter(lambda: fh.read(1 << 16), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ManifestChanges():
+    """ Outcome of comparing a directory tree against a manifest """
+
+    def __init__(self):
+        self.added = []
+        self.changed = []
+        self.removed = []
+        self.touched = []
+        self.unchanged = 0
+        self.errors = {}
+
+    def __repr__(self):
+        return (f"ManifestChanges (added {len(self.added)}, changed {len(self.changed)}, removed {len(self.removed)}, "
+                f"touched {len(self.touched)}, unchanged {self.unchanged}, errors {len(self.errors)})")
+
+    def __bool__(self):
+        return bool(self.added or self.changed or self.removed)
+
+
+class BuildManifest():
+    """
+    Persistent record of the source files indexed on the previous run
+
+    Args:
+        path: Manifest file (JSON); created on first save
+
+    """
+
+    def __init__(self, path:str = None):
+        self.path = path
+        # relative path -> [mtime_ns, size, sha256, record key]
+        self.entries = {}
+        if path and os.path.exists(path):
+            with open(path, encoding='utf-8') as fh:
+                self.entries = json.load(fh)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, path):
+        return path in self.entries
+
+    def save(self):
+        if not self.path:
+            return
+        tmp = f"{self.path}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as fh:
+            json.dump(self.entries, fh, separators=(',', ':'))
+        os.replace(tmp, self.path)
+
+    def key_for(self, path:str):
+        entry = self.entries.get(path)
+        return entry[3] if entry else None
+
+    @staticmethod
+    def walk(root:str, pattern:str = '*.json'):
+        ''' Yields (relative path, os.stat_result) for files under root matching pattern '''
+
+        match = re.compile(fnmatch.translate(pattern)).match
+        prefix = len(os.path.join(root, ''))
+        stack = [root]
+        while stack:
+            directory = stack.pop()
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        if not entry.name.startswith('.'):
+                            stack.append(entry.path)
+                    elif match(entry.name):
+                        yield entry.path[prefix:], entry.stat()
+
+    def compare(self, root:str, pattern:str = '*.json'):
+        '''
+        Returns ManifestChanges for root against this manifest, without modifying it
+
+        added/changed hold (relative path, mtime_ns, size, sha256) tuples and
+        removed holds relative paths.
+
+        '''
+
+        changes = ManifestChanges()
+        seen = set()
+        for path, stat in self.walk(root, pattern):
+            seen.add(path)
+            entry = self.entries.get(path)
+            if entry is not None and entry[0] == stat.st_mtime_ns and entry[1] == stat.st_size:
+                changes.unchanged += 1
+                continue
+            digest = file_hash(os.path.join(root, path))
+            if entry is None:
+                changes.added.append((path, stat.st_mtime_ns, stat.st_size, digest))
+            elif entry[2] == digest:
+                changes.touched.append((path, stat.st_mtime_ns, stat.st_size, digest))
+            else:
+                changes.changed.append((path, stat.st_mtime_ns, stat.st_size, digest))
+        changes.removed = [path for path in self.entries if path not in seen]
+        return changes
+
+
+class IncrementalIndexer():
+    """
+    Keeps a catalog in step with a directory of record files
+
+    Args:
+        root: Directory holding one record file per instrument
+        catalog: ConcurrentCatalog to update
+        manifest: BuildManifest, or path of the manifest file to use
+        pattern: Filename pattern of record files
+        loader: Function returning the PIDInst record stored in a file path
+
+    """
+
+    def __init__(self, root:str, catalog, manifest=None, pattern:str = '*.json', loader=load_record_file):
+        self.root = root
+        self.catalog = catalog
+        self.manifest = manifest if isinstance(manifest, BuildManifest) else BuildManifest(manifest)
+        self.pattern = pattern
+        self.loader = loader
+
+    def rebuild(self):
+        ''' Forgets the manifest and re-indexes every file (e.g. when the catalog was not persisted) '''
+
+        self.manifest.entries = {}
+        return self.run()
+
+    def run(self):
+        ''' Parses new and changed files, updates the catalog and saves the manifest; returns ManifestChanges '''
+
+        changes = self.manifest.compare(self.root, self.pattern)
+        entries = self.manifest.entries
+
+        for path, mtime, size, digest in changes.touched:
+            entries[path][:3] = [mtime, size, digest]
+
+        # Keys whose file was removed, failed to load or now holds another key
+        stale = set()
+        records = []
+        for path in changes.removed:
+            stale.add(entries.pop(path)[3])
+        for path, mtime, size, digest in changes.added + changes.changed:
+            old_key = self.manifest.key_for(path)
+            try:
+                record = self.loader(os.path.join(self.root, path))
+                key = record_key(record)
+            except Exception as exc:
+                changes.errors[path] = f"{type(exc).__name__}: {exc}"
+                # Leave the file out of the manifest so it is retried on the next run
+                entries.pop(path, None)
+                stale.add(old_key)
+                continue
+            if old_key != key:
+                stale.add(old_key)
+            records.append(record)
+            entries[path] = [mtime, size, digest, key]
+
+        # A key moved away from one file may have been taken by another in the same run
+        held = {entry[3] for entry in entries.values()}
+        with self.catalog.batch() as batch:
+            for key in stale - held - {None}:
+                batch.delete(key)
+            for record in records:
+                batch.put(record)
+
+        if changes or changes.touched or changes.errors:
+            self.manifest.save()
+        return changes
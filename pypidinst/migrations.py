@@ -0,0 +1,257 @@
+""" PIDINST Schema Migrations
+Registered per-version transforms for serialized PIDInst documents.
+
+A migration is a function taking a dict document at one schema version and
+returning the document at the next. Migrations are registered against a
+MigrationRegistry and chained automatically to reach a target version:
+
+    @register_migration('1.0', '1.1')
+    def add_dates(doc):
+        doc['dates'] = []
+        return doc
+
+migrate_stream() applies migrations lazily over an iterable of documents and
+migrate_file() does the same between JSON lines files, with checkpoints so an
+interrupted run over a large archive can be resumed.
+
+"""
+
+import json
+import os
+from collections import deque
+
+from .serialization import SCHEMA_VERSION
+
+
+class MigrationError(ValueError):
+    """ Raised when a document cannot be migrated to the requested schema version """
+
+
+class MigrationRegistry():
+    """ Registry of schema version migrations """
+
+    def __init__(self):
+        self._migrations = {}
+        self._paths = {}
+
+    def register(self, from_version:str, to_version:str):
+        ''' Decorator registering a migration function from one schema version to another '''
+
+        if not isinstance(from_version, str) or not isinstance(to_version, str):
+            raise TypeError("schema versions must be strings")
+        if from_version == to_version:
+            raise ValueError("from_version and to_version must differ")
+
+        def decorator(func):
+            if (from_version, to_version) in self._migrations:
+                raise ValueError(f"A migration from {from_version} to {to_version} is already registered")
+            self._migrations[(from_version, to_version)] = func
+            self._paths.clear()
+            return func
+        return decorator
+
+    def path(self, from_version:str, to_version:str):
+        ''' Returns the shortest chain of (from_version, to_version, func) steps between two versions '''
+
+        key = (from_version, to_version)
+        if key not in self._paths:
+            self._paths[key] = self._find_path(from_version, to_version)
+        return self._paths[key]
+
+    def _find_path(self, from_version, to_version):
+        previous = {from_version: None}
+        queue = deque([from_version])
+        while queue:
+            version = queue.popleft()
+            if version == to_version:
+                break
+            for (source, target) in self._migrations:
+                if source == version and target not in previous:
+                    previous[target] = source
+                    queue.append(target)
+        if to_version not in previous:
+            raise MigrationError(f"No migration path from schema version {from_version} to {to_version}")
+        steps = []
+        version = to_version
+        while previous[version] is not None:
+            source = previous[version]
+            steps.append((source, version, self._migrations[(source, version)]))
+            version = source
+        return tuple(reversed(steps))
+
+    def migrate(self, doc:dict, to_version:str = SCHEMA_VERSION):
+        ''' Returns the document migrated to to_version, along with the versions it passed through '''
+
+        if not isinstance(doc, dict):
+            raise TypeError("document must be a dict")
+        from_version = doc.get('schema_version', SCHEMA_VERSION)
+        versions = [from_version]
+        for source, target, func in self.path(from_version, to_version):
+            doc = func(doc)
+            if not isinstance(doc, dict):
+                raise MigrationError(f"Migration from {source} to {target} did not return a dict")
+            doc['schema_version'] = target
+            versions.append(target)
+        return doc, versions
+
+
+# Registry used when none is given explicitly
+default_registry = MigrationRegistry()
+register_migration = default_registry.register
+
+
+class MigrationReport():
+    """ Outcome of migrating a single document """
+
+    __slots__ = ('index', 'identifier', 'from_version', 'to_version', 'versions', 'error')
+
+    def __init__(self, index:int, identifier:str = None, from_version:str = None, to_version:str = None, versions:list = None, error:str = None):
+        self.index = index
+        self.identifier = identifier
+        self.from_version = from_version
+        self.to_version = to_version
+        self.versions = versions or []
+        self.error = error
+
+    def __repr__(self):
+        return f"MigrationReport ({self.index}, '{self.identifier}', {'failed' if self.error else 'ok'})"
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def to_dict(self):
+        return {slot: getattr(self, slot) for slot in self.__slots__}
+
+
+def _identifier_of(doc):
+    identifier = doc.get('identifier') if isinstance(doc, dict) else None
+    if isinstance(identifier, dict):
+        return identifier.get('identifier_value')
+    return None
+
+
+def migrate_stream(documents, to_version:str = SCHEMA_VERSION, registry:MigrationRegistry = None, start:int = 0):
+    '''
+    Generator migrating documents one at a time, yielding (document, MigrationReport) pairs
+
+    Documents may be dicts or JSON strings. The document is None when
+    migration failed; the report carries the error.
+    Documents before index `start` are skipped, which allows resuming a run.
+
+    '''
+
+    registry = default_registry if registry is None else registry
+    for index, doc in enumerate(documents):
+        if index < start:
+            continue
+        report = MigrationReport(index, to_version=to_version)
+        try:
+            if isinstance(doc, str):
+                doc = json.loads(doc)
+            report.identifier = _identifier_of(doc)
+            report.from_version = doc.get('schema_version', SCHEMA_VERSION)
+            doc, report.versions = registry.migrate(doc, to_version)
+        except Exception as exc:
+            report.error = f"{type(exc).__name__}: {exc}"
+            doc = None
+        yield doc, report
+
+
+def _read_checkpoint(path):
+    try:
+        with open(path) as fh:
+            return json.load(fh)
+    except FileNotFoundError:
+        return None
+
+
+def _write_checkpoint(path, checkpoint):
+    tmp = f"{path}.tmp"
+    with open(tmp, 'w') as fh:
+        json.dump(checkpoint, fh)
+    os.replace(tmp, path)
+
+
+def _reopen(path, offset):
+    ''' Opens an output of an interrupted run, discarding what was written after the checkpoint '''
+
+    try:
+        size = os.path.getsize(path)
+    except FileNotFoundError:
+        raise MigrationError(f"Cannot resume from the checkpoint: {path} is missing (remove the checkpoint to start again)") from None
+    if size < offset:
+        raise MigrationError(f"Cannot resume from the checkpoint: {path} is shorter than when it was written (remove the checkpoint to start again)")
+    fh = open(path, 'r+')
+    fh.seek(offset)
+    fh.truncate()
+    return fh
+
+
+def migrate_file(source:str, destination:str, to_version:str = SCHEMA_VERSION, registry:MigrationRegistry = None, report_path:str = None, checkpoint_path:str = None, checkpoint_every:int = 10000):
+    '''
+    Migrates a JSON lines file of documents into destination, streaming record by record
+
+    Failed records are left out of destination and recorded in the report file
+    (JSON lines of MigrationReport dicts) if report_path is given. With a
+    checkpoint_path the run can be interrupted and resumed: output written after
+    the last checkpoint is discarded and processing restarts from there. The
+    checkpoint file is removed once the run completes. Resuming raises
+    MigrationError if destination or the report file no longer holds the
+    output the checkpoint describes.
+
+    Returns a dict of counts: migrated, failed and skipped (already done on a previous run).
+
+    '''
+
+    checkpoint = _read_checkpoint(checkpoint_path) if checkpoint_path else None
+    if checkpoint is not None and checkpoint.get('to_version') != to_version:
+        raise MigrationError("Checkpoint was written for a different target version")
+    start = checkpoint['records'] if checkpoint else 0
+    counts = {'migrated': checkpoint['migrated'] if checkpoint else 0, 'failed': checkpoint['failed'] if checkpoint else 0, 'skipped': start}
+
+    if checkpoint:
+        out = _reopen(destination, checkpoint['output_offset'])
+        try:
+            reports = _reopen(report_path, checkpoint['report_offset']) if report_path else None
+        except BaseException:
+            out.close()
+            raise
+    else:
+        out = open(destination, 'w')
+        reports = open(report_path, 'w') if report_path else None
+    try:
+        with open(source) as src:
+            processed = start
+            lines = (line for line in src if line.strip())
+            for doc, report in migrate_stream(lines, to_version, registry, start):
+                if report.ok:
+                    out.write(json.dumps(doc, separators=(',', ':')))
+                    out.write('\n')
+                    counts['migrated'] += 1
+                else:
+                    counts['failed'] += 1
+                if reports:
+                    reports.write(json.dumps(report.to_dict()))
+                    reports.write('\n')
+                processed += 1
+                if checkpoint_path and processed % checkpoint_every == 0:
+                    out.flush()
+                    if reports:
+                        reports.flush()
+                    _write_checkpoint(checkpoint_path, {
+                        'to_version': to_version,
+                        'records': processed,
+                        'migrated': counts['migrated'],
+                        'failed': counts['failed'],
+                        'output_offset': out.tell(),
+                        'report_offset': reports.tell() if reports else 0,
+                    })
+    finally:
+        out.close()
+        if reports:
+            reports.close()
+
+    if checkpoint_path and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    return counts
@@ -21,7 +21,11 @@ class PIDInst():
     # Current PIDInst schema version
     _schema_version = 1.0
 
+    __slots__ = ('_identifier', '_landing_page', '_name', '_description', '_model', '_owners', '_manufacturers', '_related_identifiers', '_bus', '__weakref__')
+
     def __init__(self, identifier:object = None, landing_page:str = None, name:str = None, description:str = None, model:object = None, owners:list = None, manufacturers:list = None, related_identifiers:list = None):
+        # EventBus reporting changes to this record (see EventBus.watch)
+        self._bus = None
         self.identifier = identifier
         self.landing_page = landing_page
         self.name = name
@@ -36,6 +40,22 @@ class PIDInst():
 
     def __repr__(self):
         return self.name
+
+    def __getstate__(self):
+        # The event bus watching a record is not part of its state (and cannot be pickled)
+        state = {slot: getattr(self, slot) for slot in self.__slots__ if slot != '__weakref__' and hasattr(self, slot)}
+        state['_bus'] = None
+        return None, state
+
+    def _store(self, field, value):
+        ''' Stores a validated field value, through the watching EventBus if there is one '''
+
+        # Instances made with object.__new__ (e.g. scratch records validating a value) have no _bus
+        bus = getattr(self, '_bus', None)
+        if bus is None:
+            setattr(self, '_' + field, value)
+        else:
+            bus.set_field(self, field, value)
     
     @property
     def identifier(self):
@@ -44,11 +64,11 @@ class PIDInst():
     @identifier.setter
     def identifier(self, value):
         if value is not None:
-            if self.identifier:
+            if getattr(self, '_identifier', None):
                 raise ValueError("This Instrument record already has an identifier allocated")
             if not isinstance(value, Identifier):
                 raise TypeError("identifier must be instance of Identifier class")
-        self._identifier = value
+        self._store('identifier', value)
 
     @property
     def landing_page(self):
@@ -61,7 +81,7 @@ class PIDInst():
                 raise TypeError("landing_page must be a string")
             if not value.startswith('http'):
                 raise ValueError("landing_page must start with either http or https")
-        self._landing_page = value
+        self._store('landing_page', value)
 
     @property
     def name(self):
@@ -77,7 +97,7 @@ class PIDInst():
             raise ValueError("name cannot be an empty string")
         if len(value) >= 200:
             raise ValueError("name must be less than 200 chars")
-        self._name = value
+        self._store('name', value)
 
     @property
     def description(self):
@@ -88,7 +108,7 @@ class PIDInst():
         if value is not None:
             if not isinstance(value, str):
                 raise TypeError("description must be a string")
-        self._description = value
+        self._store('description', value)
 
     @property
     def model(self):
@@ -99,7 +119,7 @@ class PIDInst():
         if value is not None:
             if not isinstance(value, Model):
                 raise TypeError("model must be instance of Model class")
-        self._model = value
+        self._store('model', value)
 
     @property
     def owners(self):
@@ -112,7 +132,7 @@ class PIDInst():
                 raise TypeError("owners must be a list of Owner objects")
             if not all(isinstance(entry, Owner) for entry in value):
                 raise TypeError("owners must be a list of Owner objects")
-        self._owners = value
+        self._store('owners', value)
 
     @property
     def manufacturers(self):
@@ -125,7 +145,7 @@ class PIDInst():
                 raise TypeError("manufacturers must be a list of Manufacturer objects")
             if not all(isinstance(entry, Manufacturer) for entry in value):
                 raise TypeError("manufacturers must be a list of Manufacturer objects")
-        self._manufacturers = value
+        self._store('manufacturers', value)
 
     @property
     def related_identifiers(self):
@@ -138,22 +158,38 @@ class PIDInst():
                 raise TypeError("related_identifiers must be a list of Related Identifier objects")
             if not all(isinstance(entry, RelatedIdentifier) for entry in value):
                 raise TypeError("related_identifiers must be a list of RelatedIdentifier objects")
-        self._related_identifiers = value
+        self._store('related_identifiers', value)
 
     def append_owner(self, owner):          
         if not isinstance(owner, Owner):
             raise TypeError("owner must be instance of Owner class")
         self.owners.append(owner)
+        if getattr(self, '_bus', None) is not None:
+            self._bus.appended(self, 'owners', owner)
 
     def append_manufacturer(self, manufacturer):          
         if not isinstance(manufacturer, Manufacturer):
             raise TypeError("manufacturer must be instance of Manufacturer class")
         self.manufacturers.append(manufacturer)
+        if getattr(self, '_bus', None) is not None:
+            self._bus.appended(self, 'manufacturers', manufacturer)
 
     def append_related_identifier(self, related_identifier):          
         if not isinstance(related_identifier, RelatedIdentifier):
             raise TypeError("related_identifier must be instance of RelatedIdentifier class")
         self.related_identifiers.append(related_identifier)
+        if getattr(self, '_bus', None) is not None:
+            self._bus.appended(self, 'related_identifiers', related_identifier)
+
+    def remove_related_identifier(self, related_identifier):
+        if not isinstance(related_identifier, RelatedIdentifier):
+            raise TypeError("related_identifier must be instance of RelatedIdentifier class")
+        try:
+            self.related_identifiers.remove(related_identifier)
+        except ValueError:
+            raise ValueError("related_identifier is not one of this record's related identifiers") from None
+        if getattr(self, '_bus', None) is not None:
+            self._bus.removed(self, 'related_identifiers', related_identifier)
 
     def is_valid_pidinst(self):
         ''' Returns whether or not record is valid PIDInst (all mandatory fields present) '''
@@ -167,6 +203,8 @@ class PIDInst():
 class Identifier():
     """ Persistent Identifier """
 
+    __slots__ = ('_identifier_value', '_identifier_type', '__weakref__')
+
     def __init__(self, identifier_value:str = None, identifier_type:str = None):
         self.identifier_value = identifier_value
         self.identifier_type = identifier_type
@@ -211,6 +249,8 @@ class Identifier():
 class OwnerIdentifier():
     """ PIDInst Owner Identifier """
 
+    __slots__ = ('_owner_identifier_value', '_owner_identifier_type', '__weakref__')
+
     def __init__(self, owner_identifier_value:str = None, owner_identifier_type:str = None):
         self.owner_identifier_value = owner_identifier_value
         self.owner_identifier_type = owner_identifier_type
@@ -251,6 +291,8 @@ class OwnerIdentifier():
 class Owner():
     """ Owner Class """
 
+    __slots__ = ('_owner_identifier', '_owner_name', '_owner_contact', '__weakref__')
+
     def __init__(self, owner_identifier:object = None, owner_name:str = None, owner_contact:str = None):
         self.owner_identifier = owner_identifier
         self.owner_name = owner_name
@@ -304,6 +346,8 @@ class Owner():
 class ManufacturerIdentifier():
     """ PIDInst Manufacturer Identifier """
 
+    __slots__ = ('_manufacturer_identifier_value', '_manufacturer_identifier_type', '__weakref__')
+
     def __init__(self, manufacturer_identifier_value:str = None, manufacturer_identifier_type:str = None):
         self.manufacturer_identifier_value = manufacturer_identifier_value
         self.manufacturer_identifier_type = manufacturer_identifier_type
@@ -344,6 +388,8 @@ class ManufacturerIdentifier():
 class Manufacturer():
     """ Manufacturer Class """
 
+    __slots__ = ('_manufacturer_identifier', '_manufacturer_name', '__weakref__')
+
     def __init__(self, manufacturer_identifier:object = None, manufacturer_name:str = None):
         self.manufacturer_identifier = manufacturer_identifier
         self.manufacturer_name = manufacturer_name
@@ -363,7 +409,7 @@ class Manufacturer():
         if value is not None:
             if not isinstance(value, ManufacturerIdentifier):
                 raise TypeError("manufacturer_identifier must be instance of ManufacturerIdentifier class")
-        self._owner_identifier = value
+        self._manufacturer_identifier = value
     
     @property
     def manufacturer_name(self):
@@ -385,6 +431,8 @@ class Manufacturer():
 class ModelIdentifier():
     """ Instrument Model Identifier """
 
+    __slots__ = ('_model_identifier_value', '_model_identifier_type', '__weakref__')
+
     def __init__(self, model_identifier_value:str = None, model_identifier_type:str = None):
         self.model_identifier_value = model_identifier_value
         self.model_identifier_type = model_identifier_type
@@ -417,12 +465,14 @@ class ModelIdentifier():
             raise ValueError("Model Identifier Type cannot be None")
         if not isinstance(value, str):
             raise TypeError("Model Identifier Type must be a string")
-        self._manufacturer_identifier_type = value
+        self._model_identifier_type = value
 
 
 class Model():
     """ Instrument Model Class """
 
+    __slots__ = ('_model_identifier', '_model_name', '__weakref__')
+
     def __init__(self, model_identifier:object = None, model_name:str = None):
         self.model_identifier = model_identifier
         self.model_name = model_name
@@ -465,6 +515,8 @@ class Model():
 class RelatedIdentifier():
     """ Related Identifier Class """
 
+    __slots__ = ('_related_identifier_value', '_related_identifier_type', '_related_identifier_relation_type', '_related_identifier_name', '__weakref__')
+
     def __init__(self, related_identifier_value:str = None, related_identifier_type:str = None, related_identifier_relation_type:str = None, related_identifier_name:str = None):
         self.related_identifier_value = related_identifier_value
         self.related_identifier_type = related_identifier_type
@@ -0,0 +1,481 @@
+""" PIDINST Queries
+Composable filters over collections of PIDInst records.
+
+Filters are built from terms on dotted field paths and combined with & | ~:
+
+    query = (Field('owners.owner_identifier.owner_identifier_value').isin(orcids)
+             & Any('related_identifiers', related_identifier_relation_type='IsComponentOf', related_identifier_value=target)
+             & Field('model').is_none())
+
+A path running through owners, manufacturers or related_identifiers matches
+when any entry matches; Any() requires several conditions to hold for the
+same entry. Terms are plain data (and can be pickled); compile() turns them
+into a predicate function and run() evaluates them over a collection, using
+HashIndex lookups for equality terms on indexed paths before scanning the
+remaining candidates once with the compiled predicate. explain() describes
+the plan run() would use.
+
+"""
+
+from operator import attrgetter
+
+from .frozen import FrozenPIDInst
+
+
+def _check_path(path, cls=FrozenPIDInst):
+    ''' Raises ValueError unless path names a field reachable from cls '''
+
+    for part in path.split('.'):
+        if cls is None or part not in cls._fields:
+            raise ValueError(f"Unknown field path '{path}'")
+        cls = cls._children.get(part) or cls._sequences.get(part)
+    return path
+
+
+def _getter(path):
+    ''' Returns a function giving the list of values at path (flattening repeated fields) '''
+
+    parts = path.split('.')
+    if len(parts) == 1:
+        get = attrgetter(path)
+
+        def get_one(record):
+            value = get(record)
+            return list(value) if isinstance(value, (list, tuple)) else [value]
+        return get_one
+
+    def get_many(record):
+        values = [record]
+        for part in parts:
+            found = []
+            for value in values:
+                if value is None:
+                    continue
+                attr = getattr(value, part)
+                if isinstance(attr, (list, tuple)):
+                    found.extend(attr)
+                else:
+                    found.append(attr)
+            values = found
+        return values
+    return get_many
+
+
+class Term():
+    """ Base class for query terms """
+
+    def __and__(self, other):
+        return And(self, other)
+
+    def __or__(self, other):
+        return Or(self, other)
+
+    def __invert__(self):
+        return Not(self)
+
+    def compile(self):
+        ''' Returns a predicate function taking a record and returning a bool '''
+        raise NotImplementedError
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self._key() == other._key()
+
+    def __hash__(self):
+        return hash((type(self).__name__, self._key()))
+
+    def _key(self):
+        raise NotImplementedError
+
+
+class Compare(Term):
+    """ Comparison of the values at a field path """
+
+    OPERATORS = ('eq', 'ne', 'isin', 'contains', 'startswith', 'is_none', 'exists')
+
+    def __init__(self, path:str, op:str, value=None, root=FrozenPIDInst):
+        if op not in self.OPERATORS:
+            raise ValueError(f"Unknown operator '{op}'")
+        self.path = _check_path(path, root)
+        self.root = root
+        self.op = op
+        if op == 'isin':
+            value = frozenset(value)
+        self.value = value
+
+    def __str__(self):
+        if self.op == 'isin':
+            return f"{self.path} IN ({len(self.value)} values)"
+        if self.op in ('is_none', 'exists'):
+            return f"{self.path} {'IS NONE' if self.op == 'is_none' else 'EXISTS'}"
+        return f"{self.path} {self.op.upper()} {self.value!r}"
+
+    def __repr__(self):
+        return f"Compare ('{self}')"
+
+    def _key(self):
+        return (self.root, self.path, self.op, self.value)
+
+    def compile(self):
+        get, op, target = _getter(self.path), self.op, self.value
+        if op == 'eq':
+            return lambda record: target in get(record)
+        if op == 'ne':
+            return lambda record: target not in get(record)
+        if op == 'isin':
+            return lambda record: not target.isdisjoint(get(record))
+        if op == 'contains':
+            return lambda record: any(v is not None and target in v for v in get(record))
+        if op == 'startswith':
+            return lambda record: any(v is not None and v.startswith(target) for v in get(record))
+        if op == 'is_none':
+            return lambda record: all(v is None for v in get(record))
+        return lambda record: any(v is not None for v in get(record))
+
+    def index_values(self):
+        ''' Returns the values to look up in a hash index on path, or None if the term cannot use one '''
+
+        # Indexes leave out None values, so terms matching None must scan
+        if self.op == 'eq':
+            return None if self.value is None else (self.value,)
+        if self.op == 'isin':
+            return None if None in self.value else tuple(self.value)
+        return None
+
+
+class Field():
+    """ Builder for comparison terms on a field path """
+
+    def __init__(self, path:str, root=FrozenPIDInst):
+        self.path = _check_path(path, root)
+        self.root = root
+
+    def _compare(self, op, value=None):
+        return Compare(self.path, op, value, self.root)
+
+    def __eq__(self, value):
+        return self._compare('eq', value)
+
+    def __ne__(self, value):
+        return self._compare('ne', value)
+
+    __hash__ = None
+
+    def eq(self, value):
+        return self._compare('eq', value)
+
+    def ne(self, value):
+        return self._compare('ne', value)
+
+    def isin(self, values):
+        return self._compare('isin', values)
+
+    def contains(self, value:str):
+        return self._compare('contains', value)
+
+    def startswith(self, value:str):
+        return self._compare('startswith', value)
+
+    def is_none(self):
+        return self._compare('is_none')
+
+    def exists(self):
+        return self._compare('exists')
+
+
+class Any(Term):
+    """
+    Matches records where a single entry of a repeated field satisfies every condition
+
+    Conditions are given as keyword arguments of sub-path=value (equality), or as
+    terms whose paths are relative to the entry.
+
+    """
+
+    def __init__(self, group:str, *terms, **conditions):
+        if group not in FrozenPIDInst._sequences:
+            raise ValueError(f"'{group}' is not a repeated field")
+        entry_class = FrozenPIDInst._sequences[group]
+        self.group = group
+        self.terms = tuple(terms) + tuple(Compare(path, 'eq', value, entry_class) for path, value in sorted(conditions.items()))
+        for term in self.terms:
+            if not isinstance(term, Compare) or term.root is not entry_class:
+                raise TypeError("Any() terms must be built with Any.field()")
+
+    @staticmethod
+    def field(group:str, path:str):
+        ''' Returns a builder for terms relative to the entries of group '''
+
+        if group not in FrozenPIDInst._sequences:
+            raise ValueError(f"'{group}' is not a repeated field")
+        return Field(path, FrozenPIDInst._sequences[group])
+
+    def __str__(self):
+        return f"ANY {self.group} ({' AND '.join(str(t) for t in self.terms)})"
+
+    def __repr__(self):
+        return f"Any ('{self}')"
+
+    def _key(self):
+        return (self.group, self.terms)
+
+    def compile(self):
+        get = attrgetter(self.group)
+        predicates = [term.compile() for term in self.terms]
+        return lambda record: any(all(p(entry) for p in predicates) for entry in get(record))
+
+    def index_terms(self):
+        ''' Returns (absolute path, values) pairs an index can narrow candidates with '''
+
+        pairs = []
+        for term in self.terms:
+            values = term.index_values()
+            if values is not None:
+                pairs.append((f"{self.group}.{term.path}", values))
+        return pairs
+
+
+class And(Term):
+    """ All terms match """
+
+    def __init__(self, *terms):
+        flat = []
+        for term in terms:
+            flat.extend(term.terms if isinstance(term, And) else (term,))
+        self.terms = tuple(flat)
+
+    def __str__(self):
+        return '(' + ' AND '.join(str(t) for t in self.terms) + ')'
+
+    def _key(self):
+        return self.terms
+
+    def compile(self):
+        predicates = [term.compile() for term in self.terms]
+        return lambda record: all(p(record) for p in predicates)
+
+
+class Or(Term):
+    """ At least one term matches """
+
+    def __init__(self, *terms):
+        flat = []
+        for term in terms:
+            flat.extend(term.terms if isinstance(term, Or) else (term,))
+        self.terms = tuple(flat)
+
+    def __str__(self):
+        return '(' + ' OR '.join(str(t) for t in self.terms) + ')'
+
+    def _key(self):
+        return self.terms
+
+    def compile(self):
+        predicates = [term.compile() for term in self.terms]
+        return lambda record: any(p(record) for p in predicates)
+
+
+class Not(Term):
+    """ The term does not match """
+
+    def __init__(self, term:Term):
+        self.term = term
+
+    def __str__(self):
+        return f"NOT {self.term}"
+
+    def _key(self):
+        return (self.term,)
+
+    def compile(self):
+        predicate = self.term.compile()
+        return lambda record: not predicate(record)
+
+
+class HashIndex():
+    """
+    Hash index from the values at a field path to the keys of records holding them
+
+    Args:
+        path: Dotted field path to index, e.g. 'owners.owner_identifier.owner_identifier_value'
+
+    """
+
+    def __init__(self, path:str):
+        self.path = _check_path(path)
+        self._get = _getter(path)
+        self._keys = {}
+        # Values whose key sets may be shared with another index (see copy())
+        self._shared = None
+
+    def __repr__(self):
+        return f"HashIndex ('{self.path}', {len(self._keys)} values)"
+
+    def __len__(self):
+        return len(self._keys)
+
+    def _own(self, value):
+        ''' Returns the key set for value, copying it first if it is shared with another index '''
+
+        keys = self._keys.get(value)
+        if keys is not None and self._shared is not None and value in self._shared:
+            keys = self._keys[value] = set(keys)
+            self._shared.discard(value)
+        return keys
+
+    def add(self, key, record):
+        for value in set(self._get(record)):
+            if value is not None:
+                keys = self._own(value)
+                if keys is None:
+                    keys = self._keys[value] = set()
+                keys.add(key)
+
+    def discard(self, key, record):
+        ''' Removes key from the entries for record's values (record as it was when added) '''
+
+        for value in set(self._get(record)):
+            keys = self._own(value)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._keys[value]
+
+    def copy(self):
+        ''' Returns a copy of the index that shares key sets with this one until either modifies them '''
+
+        index = object.__new__(HashIndex)
+        index.path = self.path
+        index._get = self._get
+        index._keys = dict(self._keys)
+        index._shared = set(self._keys)
+        self._shared = set(self._keys)
+        return index
+
+    def build(self, records:dict):
+        ''' Adds every (key, record) of a mapping to the index '''
+
+        for key, record in records.items():
+            self.add(key, record)
+        return self
+
+    def lookup(self, value):
+        return self._keys.get(value, frozenset())
+
+    def lookup_many(self, values):
+        keys = set()
+        for value in values:
+            keys.update(self._keys.get(value, ()))
+        return keys
+
+
+class Query():
+    """
+    A compiled query term with index-aware execution
+
+    Args:
+        term: Term to evaluate
+
+    """
+
+    def __init__(self, term:Term):
+        if not isinstance(term, Term):
+            raise TypeError("term must be instance of Term class")
+        self.term = term
+        self.predicate = term.compile()
+
+    def __repr__(self):
+        return f"Query ('{self.term}')"
+
+    def __call__(self, record):
+        return self.predicate(record)
+
+    def plan(self, indexes:dict = None):
+        '''
+        Returns (index steps, residual predicate, residual terms)
+
+        Index steps are (path, values, exact) tuples; exact steps fully answer
+        their term so it is dropped from the residual filter.
+
+        '''
+
+        indexes = indexes or {}
+        conjuncts = self.term.terms if isinstance(self.term, And) else (self.term,)
+        steps, residual = [], []
+        for term in conjuncts:
+            if isinstance(term, Compare) and term.path in indexes and term.index_values() is not None:
+                steps.append((term.path, term.index_values(), True))
+                continue
+            if isinstance(term, Any):
+                for path, values in term.index_terms():
+                    if path in indexes:
+                        steps.append((path, values, False))
+            residual.append(term)
+        if not residual:
+            predicate = None
+        elif len(residual) == len(conjuncts):
+            predicate = self.predicate
+        else:
+            predicate = And(*residual).compile() if len(residual) > 1 else residual[0].compile()
+        return steps, predicate, residual
+
+    def run(self, records, indexes:dict = None):
+        '''
+        Returns the keys of matching records, in collection order
+
+        Results found through indexes are put back in collection order: by
+        sorting positions for sequences, and with one pass over the keys of a
+        mapping (skipped when there is at most one match).
+
+        Args:
+            records: Mapping of key -> record, or a sequence (keys are positions)
+            indexes: Dict of field path -> HashIndex over the same records
+
+        '''
+
+        positional = not hasattr(records, 'items')
+        if positional:
+            records = dict(enumerate(records))
+        steps, predicate, _ = self.plan(indexes)
+
+        if not steps:
+            return [key for key, record in records.items() if predicate(record)]
+
+        # Intersect the most selective lookups first
+        candidate_sets = sorted((indexes[path].lookup_many(values) for path, values, _ in steps), key=len)
+        candidates = set(candidate_sets[0])
+        for keys in candidate_sets[1:]:
+            if not candidates:
+                break
+            candidates.intersection_update(keys)
+        if predicate is None:
+            matches = {key for key in candidates if key in records}
+        else:
+            matches = {key for key in candidates if key in records and predicate(records[key])}
+        if len(matches) < 2:
+            return list(matches)
+        if positional:
+            return sorted(matches)
+        return [key for key in records if key in matches]
+
+    def filter(self, records, indexes:dict = None):
+        ''' Returns the matching records '''
+
+        if not hasattr(records, 'items'):
+            records = dict(enumerate(records))
+        return [records[key] for key in self.run(records, indexes)]
+
+    def explain(self, indexes:dict = None):
+        ''' Returns a description of how run() would evaluate this query '''
+
+        steps, _, residual = self.plan(indexes)
+        lines = []
+        if steps:
+            for path, values, exact in steps:
+                lines.append(f"INDEX LOOKUP {path} ({len(values)} value{'s' if len(values) != 1 else ''}){'' if exact else ' [candidates]'}")
+            if len(steps) > 1:
+                lines.append("INTERSECT candidates, smallest first")
+            if residual:
+                lines.append(f"FILTER candidates: {' AND '.join(str(t) for t in residual)}")
+        else:
+            lines.append(f"SCAN all records: {self.term}")
+        return '\n'.join(lines)
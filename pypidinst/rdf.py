@@ -0,0 +1,251 @@
+""" PIDINST RDF
+Streaming RDF output of PIDInst records as N-Triples and chunked JSON-LD.
+
+Triples are generated lazily, record by record, from any iterable of PIDInst
+(or frozen PIDInst) records; nothing is collected into an in-memory graph, so
+memory use is bounded by one record (N-Triples) or one chunk of records
+(JSON-LD) however many records are written.
+
+Instruments, owners, manufacturers and models are subjects; an instrument is
+named by the resolver URL of its identifier (or its landing page), and the
+others by the URL of their identifier or else by a blank node. Related
+identifiers become objects of a predicate chosen by their relation type (see
+RELATION_PREDICATES).
+
+"""
+
+import json
+import re
+
+from .crosswalk import identifier_url
+from .vocabs import RELATED_IDENTIFIER_RELATION_TYPES
+
+RDF = 'http://www.w3.org/1999/02/22-rdf-syntax-ns#'
+DCTERMS = 'http://purl.org/dc/terms/'
+DCAT = 'http://www.w3.org/ns/dcat#'
+PIDINST = 'https://w3id.org/pidinst/terms#'
+
+PREFIXES = {'rdf': RDF, 'dcterms': DCTERMS, 'dcat': DCAT, 'pidinst': PIDINST}
+
+RDF_TYPE = RDF + 'type'
+
+# Relation types with a natural Dublin Core counterpart; the rest use the pidinst namespace
+_DCTERMS_RELATIONS = {
+    'IsNewVersionOf': 'replaces',
+    'IsPreviousVersionOf': 'isReplacedBy',
+    'HasComponent': 'hasPart',
+    'IsComponentOf': 'isPartOf',
+    'References': 'references',
+}
+
+RELATION_PREDICATES = {
+    relation: DCTERMS + _DCTERMS_RELATIONS[relation] if relation in _DCTERMS_RELATIONS else PIDINST + relation[0].lower() + relation[1:]
+    for relation in RELATED_IDENTIFIER_RELATION_TYPES
+}
+
+
+class Literal(str):
+    """ A plain string literal in a triple (other string terms are IRIs or blank nodes) """
+
+    __slots__ = ()
+
+
+def iter_triples(records, start:int = 0):
+    '''
+    Yields (subject, predicate, object) triples for records
+
+    Subjects and predicates are IRIs or '_:' blank node labels; objects are
+    IRIs, blank node labels or Literal strings. Blank node labels are unique
+    across the whole stream; start numbers the first record, so that streams
+    written in parts can keep them unique.
+
+    '''
+
+    for number, record in enumerate(records, start):
+        yield from record_triples(record, f'_:r{number}n')
+
+
+def record_triples(record, blank:str = '_:n'):
+    ''' Yields the triples of one record, naming its blank nodes with the prefix blank '''
+
+    identifier = record.identifier
+    subject = None
+    if identifier is not None:
+        subject = identifier_url(identifier.identifier_value, identifier.identifier_type)
+    subject = subject or record.landing_page or blank + 'i'
+
+    yield subject, RDF_TYPE, PIDINST + 'Instrument'
+    if identifier is not None:
+        yield subject, DCTERMS + 'identifier', Literal(identifier.identifier_value)
+        yield subject, PIDINST + 'identifierType', Literal(identifier.identifier_type)
+    if record.landing_page:
+        yield subject, DCAT + 'landingPage', record.landing_page
+    yield subject, DCTERMS + 'title', Literal(record.name)
+    if record.description:
+        yield subject, DCTERMS + 'description', Literal(record.description)
+
+    for position, owner in enumerate(record.owners):
+        owner_identifier = owner.owner_identifier
+        node = None
+        if owner_identifier is not None:
+            node = identifier_url(owner_identifier.owner_identifier_value, owner_identifier.owner_identifier_type)
+        node = node or f'{blank}o{position}'
+        yield subject, PIDINST + 'owner', node
+        yield node, RDF_TYPE, PIDINST + 'Owner'
+        yield node, PIDINST + 'ownerName', Literal(owner.owner_name)
+        if owner.owner_contact:
+            yield node, PIDINST + 'ownerContact', Literal(owner.owner_contact)
+        if owner_identifier is not None:
+            yield node, DCTERMS + 'identifier', Literal(owner_identifier.owner_identifier_value)
+            yield node, PIDINST + 'identifierType', Literal(owner_identifier.owner_identifier_type)
+
+    for position, manufacturer in enumerate(record.manufacturers):
+        manufacturer_identifier = manufacturer.manufacturer_identifier
+        node = None
+        if manufacturer_identifier is not None:
+            node = identifier_url(manufacturer_identifier.manufacturer_identifier_value, manufacturer_identifier.manufacturer_identifier_type)
+        node = node or f'{blank}m{position}'
+        yield subject, PIDINST + 'manufacturer', node
+        yield node, RDF_TYPE, PIDINST + 'Manufacturer'
+        yield node, PIDINST + 'manufacturerName', Literal(manufacturer.manufacturer_name)
+        if manufacturer_identifier is not None:
+            yield node, DCTERMS + 'identifier', Literal(manufacturer_identifier.manufacturer_identifier_value)
+            yield node, PIDINST + 'identifierType', Literal(manufacturer_identifier.manufacturer_identifier_type)
+
+    model = record.model
+    if model is not None:
+        model_identifier = model.model_identifier
+        node = None
+        if model_identifier is not None:
+            node = identifier_url(model_identifier.model_identifier_value, model_identifier.model_identifier_type)
+        node = node or f'{blank}model'
+        yield subject, PIDINST + 'model', node
+        yield node, RDF_TYPE, PIDINST + 'Model'
+        yield node, PIDINST + 'modelName', Literal(model.model_name)
+        if model_identifier is not None:
+            yield node, DCTERMS + 'identifier', Literal(model_identifier.model_identifier_value)
+            yield node, PIDINST + 'identifierType', Literal(model_identifier.model_identifier_type)
+
+    for position, related in enumerate(record.related_identifiers):
+        node = identifier_url(related.related_identifier_value, related.related_identifier_type) or f'{blank}r{position}'
+        yield subject, RELATION_PREDICATES[related.related_identifier_relation_type], node
+        yield node, DCTERMS + 'identifier', Literal(related.related_identifier_value)
+        yield node, PIDINST + 'identifierType', Literal(related.related_identifier_type)
+        if related.related_identifier_name:
+            yield node, DCTERMS + 'title', Literal(related.related_identifier_name)
+
+
+# Characters that must be escaped in N-Triples IRIs and string literals
+_IRI_ESCAPES = {i: f'\\u{i:04X}' for i in range(0x21)}
+_IRI_ESCAPES.update({ord(c): f'\\u{ord(c):04X}' for c in '<>"{}|^`\\'})
+_LITERAL_ESCAPES = {ord('\\'): '\\\\', ord('"'): '\\"', ord('\n'): '\\n', ord('\r'): '\\r'}
+_IRI_UNSAFE = re.compile(r'[\x00-\x20<>"{}|^`\\]').search
+_LITERAL_UNSAFE = re.compile(r'[\\"\n\r]').search
+
+
+def _term(value):
+    # translate() is slow, so only values that need escaping go through it
+    if isinstance(value, Literal):
+        if _LITERAL_UNSAFE(value) is None:
+            return f'"{value}"'
+        return f'"{value.translate(_LITERAL_ESCAPES)}"'
+    if value.startswith('_:'):
+        return value
+    if _IRI_UNSAFE(value) is None:
+        return f'<{value}>'
+    return f'<{value.translate(_IRI_ESCAPES)}>'
+
+
+def iter_ntriples(records, start:int = 0):
+    ''' Yields N-Triples lines (newline terminated) for records (see iter_triples) '''
+
+    # Predicates come from a small fixed set, and consecutive triples usually share a subject
+    predicates = {}
+    last_subject = last_term = None
+    for subject, predicate, obj in iter_triples(records, start):
+        if subject is not last_subject:
+            last_subject, last_term = subject, _term(subject)
+        predicate_term = predicates.get(predicate)
+        if predicate_term is None:
+            predicate_term = predicates[predicate] = _term(predicate)
+        yield f'{last_term} {predicate_term} {_term(obj)} .\n'
+
+
+def write_ntriples(records, fh):
+    ''' Writes records to a text file object as N-Triples and returns the number of triples written '''
+
+    count = 0
+    lines = []
+    for line in iter_ntriples(records):
+        lines.append(line)
+        if len(lines) >= 4096:
+            fh.write(''.join(lines))
+            count += len(lines)
+            lines = []
+    fh.write(''.join(lines))
+    return count + len(lines)
+
+
+_CONTEXT = dict(PREFIXES)
+
+
+def _compact(iri):
+    for prefix, namespace in PREFIXES.items():
+        if iri.startswith(namespace):
+            return f'{prefix}:{iri[len(namespace):]}'
+    return iri
+
+
+def iter_jsonld_chunks(records, chunk_size:int = 1000, start:int = 0):
+    '''
+    Yields JSON-LD documents (dicts) each holding the graph of at most chunk_size records
+
+    Nodes are grouped by subject within a chunk; the same subject (e.g. a
+    manufacturer shared by many instruments) may appear in several chunks,
+    which JSON-LD processors merge when loading.
+
+    '''
+
+    if chunk_size < 1:
+        raise ValueError("chunk_size must be at least 1")
+    nodes, seen = {}, set()
+    count = 0
+    for number, record in enumerate(records, start):
+        _add_triples(nodes, seen, record_triples(record, f'_:r{number}n'))
+        count += 1
+        if count == chunk_size:
+            yield {'@context': _CONTEXT, '@graph': list(nodes.values())}
+            nodes, seen = {}, set()
+            count = 0
+    if count:
+        yield {'@context': _CONTEXT, '@graph': list(nodes.values())}
+
+
+def _add_triples(nodes, seen, triples):
+    ''' Adds triples to JSON-LD node objects keyed by subject, skipping triples already in the chunk '''
+
+    for subject, predicate, obj in triples:
+        # Literals compare equal to IRIs with the same text, so their kind is part of the key
+        key = (subject, predicate, obj, isinstance(obj, Literal))
+        if key in seen:
+            continue
+        seen.add(key)
+        node = nodes.get(subject)
+        if node is None:
+            node = nodes[subject] = {'@id': subject}
+        if predicate == RDF_TYPE:
+            node.setdefault('@type', []).append(_compact(obj))
+            continue
+        value = str(obj) if isinstance(obj, Literal) else {'@id': obj}
+        node.setdefault(_compact(predicate), []).append(value)
+
+
+def write_jsonld(records, fh, chunk_size:int = 1000):
+    ''' Writes records to a text file object as JSON-LD documents, one chunk per line; returns the number of chunks '''
+
+    chunks = 0
+    for document in iter_jsonld_chunks(records, chunk_size):
+        fh.write(json.dumps(document, ensure_ascii=False, separators=(',', ':')))
+        fh.write('\n')
+        chunks += 1
+    return chunks
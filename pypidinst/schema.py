@@ -0,0 +1,320 @@
+""" PIDINST JSON Schema
+JSON Schema for PIDInst documents, and a compiled validator for raw documents.
+
+The schema is derived from the model classes rather than written by hand:
+the document structure comes from the frozen classes' field tables, and the
+rules for every scalar field are found by probing the mutable class's own
+property setter (does it accept None, an empty string, a non-string, strings
+of which lengths, values outside a vocabulary). Changing a setter or a list in
+vocabs.py therefore changes the schema with it.
+
+SchemaValidator compiles the schema once into the source of a plain Python
+function, so raw documents can be screened (and every problem in a batch
+reported) much faster than constructing PIDInst objects from them.
+
+"""
+
+import ast
+import copy
+import json
+import re
+
+from . import vocabs
+from .frozen import FrozenPIDInst
+from .serialization import SCHEMA_VERSION
+
+JSON_SCHEMA_DIALECT = 'https://json-schema.org/draft/2020-12/schema'
+
+# Longest string probed for a length limit; longer limits are left out of the schema
+_MAX_PROBED_LENGTH = 1 << 16
+_UNLISTED = '\x00unlisted'
+
+
+def _accepts(cls, field, value):
+    scratch = object.__new__(cls)
+    try:
+        getattr(cls, field).fset(scratch, value)
+    except (TypeError, ValueError):
+        return False
+    return True
+
+
+def _vocabularies():
+    return {name: values for name, values in vars(vocabs).items() if name.isupper() and isinstance(values, list)}
+
+
+def _scalar_schema(cls, field):
+    ''' Returns the schema of a scalar field, found by probing its property setter '''
+
+    if _accepts(cls, field, 1):
+        raise ValueError(f"{cls.__name__}.{field} accepts non-string values and cannot be described")
+    nullable = _accepts(cls, field, None)
+    schema = {'type': ['string', 'null'] if nullable else 'string'}
+    if _accepts(cls, field, _UNLISTED):
+        if not _accepts(cls, field, ''):
+            schema['minLength'] = 1
+        if not _accepts(cls, field, 'x' * _MAX_PROBED_LENGTH):
+            low, high = 1, _MAX_PROBED_LENGTH
+            # Longest accepted length lies in [low - 1, high)
+            while low < high:
+                middle = (low + high) // 2
+                if _accepts(cls, field, 'x' * middle):
+                    low = middle + 1
+                else:
+                    high = middle
+            schema['maxLength'] = low - 1
+        return schema
+
+    # The setter restricts values: use the largest vocabulary it accepts in full
+    accepted = [values for values in _vocabularies().values() if all(_accepts(cls, field, value) for value in values)]
+    if accepted:
+        schema['enum'] = list(max(accepted, key=len))
+        if nullable:
+            schema['enum'].append(None)
+        return schema
+    if _accepts(cls, field, 'http' + _UNLISTED):
+        schema['pattern'] = '^http'
+        return schema
+    raise ValueError(f"{cls.__name__}.{field} restricts values in a way that cannot be described")
+
+
+def _object_schema(frozen_cls):
+    properties = {}
+    required = []
+    for field in frozen_cls._fields:
+        if field in frozen_cls._children:
+            properties[field] = _object_schema(frozen_cls._children[field])
+            properties[field]['type'] = ['object', 'null']
+        elif field in frozen_cls._sequences:
+            properties[field] = {'type': ['array', 'null'], 'items': _object_schema(frozen_cls._sequences[field])}
+        else:
+            properties[field] = _scalar_schema(frozen_cls._mutable_class, field)
+            if 'null' not in properties[field]['type']:
+                required.append(field)
+    return {
+        'title': frozen_cls._mutable_class.__name__,
+        'type': 'object',
+        'properties': properties,
+        'required': required,
+        'additionalProperties': False,
+    }
+
+
+_schema = None
+
+
+def json_schema():
+    ''' Returns the JSON Schema (as a dict) of a serialized PIDInst document '''
+
+    global _schema
+    if _schema is None:
+        schema = _object_schema(FrozenPIDInst)
+        schema['properties'] = {'schema_version': {'const': SCHEMA_VERSION}, **schema['properties']}
+        _schema = {'$schema': JSON_SCHEMA_DIALECT, **schema}
+    return copy.deepcopy(_schema)
+
+
+def write_schema(path:str):
+    with open(path, 'w', encoding='utf-8') as fh:
+        json.dump(json_schema(), fh, indent=2)
+        fh.write('\n')
+
+
+class ValidationError():
+    """ One problem found in a document """
+
+    __slots__ = ('index', 'path', 'message')
+
+    def __init__(self, index, path, message):
+        self.index = index
+        self.path = path
+        self.message = message
+
+    def __repr__(self):
+        return f"ValidationError ({self.index}, '{self.path}', '{self.message}')"
+
+    def __eq__(self, other):
+        if not isinstance(other, ValidationError):
+            return NotImplemented
+        return (self.index, self.path, self.message) == (other.index, other.path, other.message)
+
+    def to_dict(self):
+        return {'index': self.index, 'path': self.path, 'message': self.message}
+
+
+_JSON_TYPES = {
+    'string': str,
+    'object': dict,
+    'array': list,
+    'null': type(None),
+}
+
+
+class _Compiler():
+    """
+    Translates a schema into the source of a validate(value, errors) function
+
+    Only the keywords json_schema() produces are supported. Each failing check
+    appends a (JSON Pointer, message) pair to errors; paths are only built
+    once a check has failed.
+
+    """
+
+    def __init__(self):
+        self.lines = []
+        self.namespace = {}
+        self._count = 0
+
+    def _name(self, prefix):
+        self._count += 1
+        return f"{prefix}{self._count}"
+
+    def _constant(self, value):
+        name = self._name('c')
+        self.namespace[name] = value
+        return name
+
+    def _emit(self, depth, line):
+        self.lines.append('    ' * depth + line)
+
+    @staticmethod
+    def _join(path, suffix):
+        ''' Returns the expression of path followed by a literal suffix, folding constant paths '''
+
+        try:
+            return repr(ast.literal_eval(path) + suffix)
+        except ValueError:
+            return f"{path} + {suffix!r}"
+
+    def compile(self, schema):
+        self._emit(0, 'def validate(v0, errors):')
+        self._emit(1, 'start = len(errors)')
+        self._node(schema, 'v0', "''", 1)
+        self._emit(1, 'return len(errors) == start')
+        source = '\n'.join(self.lines) + '\n'
+        exec(compile(source, '<pidinst schema validator>', 'exec'), self.namespace)
+        return self.namespace['validate'], source
+
+    def _node(self, schema, var, path, depth):
+        unknown = set(schema) - {'$schema', 'title', 'const', 'type', 'enum', 'minLength', 'maxLength', 'pattern',
+                                 'properties', 'required', 'additionalProperties', 'items'}
+        if unknown:
+            raise ValueError(f"Unsupported schema keywords: {', '.join(sorted(unknown))}")
+
+        names = schema.get('type', [])
+        names = names if isinstance(names, list) else [names]
+        nullable = not names or 'null' in names
+        not_none = f"{var} is not None and " if nullable else ''
+
+        # (failure condition, message expression), tested in order until one fails
+        checks = []
+        if 'const' in schema:
+            checks.append((f"{var} != {self._constant(schema['const'])}", repr(f"must be {json.dumps(schema['const'])}")))
+        if names:
+            types = self._constant(tuple(_JSON_TYPES[name] for name in names))
+            checks.append((f"not isinstance({var}, {types})", repr(f"must be {' or '.join(names)}")))
+        if 'enum' in schema:
+            checks.append((f"{var} not in {self._constant(frozenset(schema['enum']))}", f"\"'\" + str({var}) + \"' is not a recognised value\""))
+        if 'minLength' in schema:
+            minimum = schema['minLength']
+            checks.append((f"{not_none}len({var}) < {minimum}", repr("cannot be an empty string" if minimum == 1 else f"must be at least {minimum} chars")))
+        if 'maxLength' in schema:
+            checks.append((f"{not_none}len({var}) > {schema['maxLength']}", repr(f"must be at most {schema['maxLength']} chars")))
+        if 'pattern' in schema:
+            search = self._constant(re.compile(schema['pattern']).search)
+            checks.append((f"{not_none}{search}({var}) is None", repr(f"must match {schema['pattern']}")))
+
+        for position, (condition, message) in enumerate(checks):
+            self._emit(depth, f"{'if' if position == 0 else 'elif'} {condition}:")
+            self._emit(depth + 1, f"errors.append(({path}, {message}))")
+
+        if 'properties' not in schema and 'items' not in schema:
+            return
+        if checks:
+            self._emit(depth, 'else:')
+            depth += 1
+
+        if 'properties' in schema:
+            if names != ['object']:
+                self._emit(depth, f"if isinstance({var}, dict):")
+                depth += 1
+            for field in schema.get('required', ()):
+                self._emit(depth, f"if {field!r} not in {var}:")
+                self._emit(depth + 1, f"errors.append(({self._join(path, '/' + field)}, 'is required'))")
+            if schema.get('additionalProperties', True) is False:
+                known = self._constant(frozenset(schema['properties']))
+                key = self._name('k')
+                self._emit(depth, f"if not {known}.issuperset({var}):")
+                self._emit(depth + 1, f"for {key} in {var}:")
+                self._emit(depth + 2, f"if {key} not in {known}:")
+                self._emit(depth + 3, f"errors.append(({self._join(path, '/')} + str({key}), 'is not a recognised field'))")
+            for field, subschema in schema['properties'].items():
+                item = self._name('v')
+                self._emit(depth, f"if {field!r} in {var}:")
+                self._emit(depth + 1, f"{item} = {var}[{field!r}]")
+                self._node(subschema, item, self._join(path, '/' + field), depth + 1)
+            if names != ['object']:
+                depth -= 1
+
+        if 'items' in schema:
+            index, item = self._name('i'), self._name('v')
+            self._emit(depth, f"if isinstance({var}, list):")
+            self._emit(depth + 1, f"for {index}, {item} in enumerate({var}):")
+            self._node(schema['items'], item, f"{self._join(path, '/')} + str({index})", depth + 2)
+
+
+class SchemaValidator():
+    """
+    Validator for raw PIDInst documents, compiled from a JSON Schema
+
+    Error paths are JSON Pointers into the document, e.g. '/owners/0/owner_name'.
+
+    Args:
+        schema: JSON Schema to compile (json_schema() when None)
+
+    """
+
+    def __init__(self, schema:dict = None):
+        self.schema = json_schema() if schema is None else schema
+        self._check, self.source = _Compiler().compile(self.schema)
+
+    def is_valid(self, doc):
+        return self._check(doc, [])
+
+    def errors(self, doc, index=None):
+        ''' Returns a list of ValidationError for one document '''
+
+        found = []
+        self._check(doc, found)
+        return [ValidationError(index, path, message) for path, message in found]
+
+    def validate_many(self, documents):
+        '''
+        Validates a batch of documents
+
+        Returns (valid documents, list of ValidationError) where each error
+        carries the position of its document in the batch.
+
+        '''
+
+        valid, errors = [], []
+        check = self._check
+        for index, doc in enumerate(documents):
+            found = []
+            if check(doc, found):
+                valid.append(doc)
+            else:
+                errors.extend(ValidationError(index, path, message) for path, message in found)
+        return valid, errors
+
+
+_default_validator = None
+
+
+def validate_documents(documents):
+    ''' Validates a batch of documents against json_schema(); returns (valid documents, errors) '''
+
+    global _default_validator
+    if _default_validator is None:
+        _default_validator = SchemaValidator()
+    return _default_validator.validate_many(documents)
@@ -0,0 +1,144 @@
+""" PIDINST Serialization
+Conversion of PIDInst records to and from plain dict documents and JSON lines files.
+
+Documents use the PIDInst attribute names as keys and carry the schema version
+they were written with under "schema_version".
+
+"""
+
+import json
+
+from .pidinst import PIDInst, Identifier, OwnerIdentifier, Owner, ManufacturerIdentifier, \
+    Manufacturer, ModelIdentifier, Model, RelatedIdentifier
+
+SCHEMA_VERSION = str(PIDInst._schema_version)
+
+
+def _identifier_to_dict(identifier, fields):
+    if identifier is None:
+        return None
+    return {field: getattr(identifier, field) for field in fields}
+
+
+def owner_to_dict(owner):
+    return {
+        'owner_name': owner.owner_name,
+        'owner_contact': owner.owner_contact,
+        'owner_identifier': _identifier_to_dict(owner.owner_identifier, ('owner_identifier_value', 'owner_identifier_type')),
+    }
+
+
+def manufacturer_to_dict(manufacturer):
+    return {
+        'manufacturer_name': manufacturer.manufacturer_name,
+        'manufacturer_identifier': _identifier_to_dict(manufacturer.manufacturer_identifier, ('manufacturer_identifier_value', 'manufacturer_identifier_type')),
+    }
+
+
+def model_to_dict(model):
+    if model is None:
+        return None
+    return {
+        'model_name': model.model_name,
+        'model_identifier': _identifier_to_dict(model.model_identifier, ('model_identifier_value', 'model_identifier_type')),
+    }
+
+
+def related_identifier_to_dict(related_identifier):
+    return {
+        'related_identifier_value': related_identifier.related_identifier_value,
+        'related_identifier_type': related_identifier.related_identifier_type,
+        'related_identifier_relation_type': related_identifier.related_identifier_relation_type,
+        'related_identifier_name': related_identifier.related_identifier_name,
+    }
+
+
+def to_dict(record):
+    ''' Returns a plain dict document for a PIDInst (or frozen PIDInst) record '''
+
+    return {
+        'schema_version': SCHEMA_VERSION,
+        'identifier': _identifier_to_dict(record.identifier, ('identifier_value', 'identifier_type')),
+        'landing_page': record.landing_page,
+        'name': record.name,
+        'description': record.description,
+        'model': model_to_dict(record.model),
+        'owners': [owner_to_dict(owner) for owner in record.owners],
+        'manufacturers': [manufacturer_to_dict(manufacturer) for manufacturer in record.manufacturers],
+        'related_identifiers': [related_identifier_to_dict(related) for related in record.related_identifiers],
+    }
+
+
+def _build(cls, doc, children=None):
+    if doc is None:
+        return None
+    if not isinstance(doc, dict):
+        raise TypeError(f"{cls.__name__} document must be a dict")
+    kwargs = dict(doc)
+    for field, child_cls in (children or {}).items():
+        kwargs[field] = _build(child_cls, kwargs.get(field))
+    return cls(**kwargs)
+
+
+def _build_list(cls, docs, children=None):
+    if docs is None:
+        return []
+    if not isinstance(docs, list):
+        raise TypeError(f"{cls.__name__} documents must be a list")
+    return [_build(cls, doc, children) for doc in docs]
+
+
+def from_dict(doc):
+    ''' Returns a new PIDInst record built (and validated) from a dict document '''
+
+    if not isinstance(doc, dict):
+        raise TypeError("document must be a dict")
+    version = doc.get('schema_version', SCHEMA_VERSION)
+    if version != SCHEMA_VERSION:
+        raise ValueError(f"document has schema version {version}, expected {SCHEMA_VERSION} (migrate it first)")
+    unknown = set(doc) - {'schema_version', 'identifier', 'landing_page', 'name', 'description', 'model', 'owners', 'manufacturers', 'related_identifiers'}
+    if unknown:
+        raise ValueError(f"Unknown fields in document: {', '.join(sorted(unknown))}")
+
+    record = PIDInst(
+        identifier=_build(Identifier, doc.get('identifier')),
+        landing_page=doc.get('landing_page'),
+        name=doc.get('name'),
+        description=doc.get('description'),
+        model=_build(Model, doc.get('model'), {'model_identifier': ModelIdentifier}),
+        owners=_build_list(Owner, doc.get('owners'), {'owner_identifier': OwnerIdentifier}),
+        manufacturers=_build_list(Manufacturer, doc.get('manufacturers'), {'manufacturer_identifier': ManufacturerIdentifier}),
+        related_identifiers=_build_list(RelatedIdentifier, doc.get('related_identifiers')),
+    )
+    return record
+
+
+def iter_documents(fh):
+    ''' Yields dict documents from a JSON lines file object, skipping blank lines '''
+
+    for line in fh:
+        if line.strip():
+            yield json.loads(line)
+
+
+def write_documents(documents, fh):
+    ''' Writes dict documents to a JSON lines file object and returns the number written '''
+
+    count = 0
+    for doc in documents:
+        fh.write(json.dumps(doc, separators=(',', ':')))
+        fh.write('\n')
+        count += 1
+    return count
+
+
+def load_records(fh):
+    ''' Yields PIDInst records from a JSON lines file object '''
+
+    for doc in iter_documents(fh):
+        yield from_dict(doc)
+
+
+def dump_records(records, fh):
+    ''' Writes PIDInst records to a JSON lines file object and returns the number written '''
+    return write_documents((to_dict(record) for record in records), fh)
@@ -0,0 +1,305 @@
+""" PIDINST Sharded Catalog
+Catalog partitioned across local worker processes.
+
+Records are assigned to shards by a consistent hash ring over their
+identifier value, so adding a worker only moves the records that now belong
+to it. Each shard is a worker process holding frozen records, hash indexes
+and CatalogStats for its partition, and talks to the coordinating process
+over a pipe. Lookups are routed to a single shard; queries, counts and
+statistics are sent to every shard at once and the partial results gathered.
+
+"""
+
+import multiprocessing
+import zlib
+from bisect import bisect_right
+
+from .catalog import record_key
+from .frozen import freeze
+from .query import HashIndex, Query, Term
+from .stats import CatalogStats, COMPLETENESS
+
+
+def _hash(value:str):
+    return zlib.crc32(value.encode('utf-8'))
+
+
+class HashRing():
+    """
+    Consistent hash ring mapping keys to node ids
+
+    Args:
+        nodes: Initial node ids
+        replicas: Virtual points per node on the ring
+
+    """
+
+    def __init__(self, nodes:list = (), replicas:int = 64):
+        self.replicas = replicas
+        self._points = []
+        self._owners = []
+        self.nodes = []
+        for node in nodes:
+            self.add(node)
+
+    def add(self, node:int):
+        if node in self.nodes:
+            raise ValueError(f"Node {node} is already on the ring")
+        self.nodes.append(node)
+        points = dict(zip(self._points, self._owners))
+        for replica in range(self.replicas):
+            points[_hash(f"{node}:{replica}")] = node
+        self._points = sorted(points)
+        self._owners = [points[point] for point in self._points]
+
+    def remove(self, node:int):
+        if node not in self.nodes:
+            raise ValueError(f"Node {node} is not on the ring")
+        self.nodes.remove(node)
+        kept = [(point, owner) for point, owner in zip(self._points, self._owners) if owner != node]
+        self._points = [point for point, _ in kept]
+        self._owners = [owner for _, owner in kept]
+
+    def node_for(self, key:str):
+        if not self._points:
+            raise LookupError("The ring has no nodes")
+        position = bisect_right(self._points, _hash(key)) % len(self._points)
+        return self._owners[position]
+
+
+def _shard_worker(conn, index_paths):
+    ''' Worker process loop serving one shard '''
+
+    records = {}
+    indexes = {path: HashIndex(path) for path in index_paths}
+    stats = CatalogStats()
+
+    def put(record):
+        key = record_key(record)
+        old = records.get(key)
+        if old is not None:
+            for index in indexes.values():
+                index.discard(key, old)
+        records[key] = record
+        for index in indexes.values():
+            index.add(key, record)
+        stats.add(key, record)
+
+    def delete(key):
+        old = records.pop(key, None)
+        if old is None:
+            return False
+        for index in indexes.values():
+            index.discard(key, old)
+        stats.remove(key)
+        return True
+
+    while True:
+        command, argument = conn.recv()
+        try:
+            if command == 'put':
+                for record in argument:
+                    put(record)
+                result = len(argument)
+            elif command == 'get':
+                result = records.get(argument)
+            elif command == 'delete':
+                result = sum(delete(key) for key in argument)
+            elif command == 'query':
+                result = [records[key] for key in Query(argument).run(records, indexes)]
+            elif command == 'count':
+                result = len(Query(argument).run(records, indexes))
+            elif command == 'stats':
+                snapshot = stats.snapshot()
+                result = {name: dict(value) if name in ('invalid_reasons', 'completeness') else value
+                          for name, value in snapshot.items() if name != 'histograms'}
+                result['histograms'] = {name: dict(counts) for name, counts in snapshot['histograms'].items()}
+            elif command == 'len':
+                result = len(records)
+            elif command == 'rebalance':
+                # Records are only deleted once the shard now owning them has stored them
+                ring, node = argument
+                result = [record for key, record in records.items() if ring.node_for(key) != node]
+            elif command == 'stop':
+                conn.send(('ok', None))
+                break
+            else:
+                raise ValueError(f"Unknown command '{command}'")
+            conn.send(('ok', result))
+        except Exception as exc:
+            conn.send(('error', exc))
+    conn.close()
+
+
+class ShardedCatalog():
+    """
+    Catalog of PIDInst records partitioned by identifier value across worker processes
+
+    Args:
+        workers: Number of worker processes to start
+        index_paths: Field paths each shard keeps hash indexes on
+        replicas: Virtual points per worker on the hash ring
+
+    """
+
+    def __init__(self, workers:int = None, index_paths:list = (), replicas:int = 64):
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+        if workers < 1:
+            raise ValueError("workers must be at least 1")
+        self.index_paths = tuple(index_paths)
+        self._ring = HashRing(replicas=replicas)
+        self._shards = {}
+        for _ in range(workers):
+            self._start_worker()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def __repr__(self):
+        return f"ShardedCatalog ({len(self._shards)} workers)"
+
+    def __len__(self):
+        return sum(self._gather('len'))
+
+    @property
+    def workers(self):
+        return len(self._shards)
+
+    def _start_worker(self):
+        node = max(self._shards, default=-1) + 1
+        parent, child = multiprocessing.Pipe()
+        process = multiprocessing.Process(target=_shard_worker, args=(child, self.index_paths), daemon=True)
+        process.start()
+        child.close()
+        self._shards[node] = (process, parent)
+        self._ring.add(node)
+        return node
+
+    @staticmethod
+    def _receive(conn):
+        status, result = conn.recv()
+        if status == 'error':
+            raise result
+        return result
+
+    def _call(self, node, command, argument=None):
+        conn = self._shards[node][1]
+        conn.send((command, argument))
+        return self._receive(conn)
+
+    def _scatter(self, messages:dict):
+        ''' Sends node -> (command, argument) messages before collecting any reply, so shards work in parallel '''
+
+        for node, message in messages.items():
+            self._shards[node][1].send(message)
+        # Collect every reply before raising so that no pipe is left with an unread message
+        replies = {node: self._shards[node][1].recv() for node in messages}
+        for status, result in replies.values():
+            if status == 'error':
+                raise result
+        return {node: result for node, (_, result) in replies.items()}
+
+    def _gather(self, command, argument=None):
+        ''' Sends the same command to every shard and returns their replies '''
+        return list(self._scatter({node: (command, argument) for node in self._shards}).values())
+
+    def shard_for(self, key:str):
+        ''' Returns the id of the worker holding key '''
+        return self._ring.node_for(key)
+
+    def put_many(self, records):
+        ''' Adds or replaces records, sending one message per shard; returns the number stored '''
+
+        routed = {}
+        for record in records:
+            record = freeze(record)
+            routed.setdefault(self._ring.node_for(record_key(record)), []).append(record)
+        return sum(self._scatter({node: ('put', batch) for node, batch in routed.items()}).values())
+
+    def put(self, record):
+        self.put_many([record])
+
+    def get(self, key:str, default=None):
+        record = self._call(self._ring.node_for(key), 'get', key)
+        return default if record is None else record
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def delete(self, key:str):
+        return bool(self._call(self._ring.node_for(key), 'delete', [key]))
+
+    def query(self, term:Term):
+        ''' Returns the records matching term, gathered from every shard '''
+
+        results = []
+        for part in self._gather('query', term):
+            results.extend(part)
+        return results
+
+    def count(self, term:Term):
+        return sum(self._gather('count', term))
+
+    def stats(self):
+        ''' Returns catalog statistics (as CatalogStats.snapshot()) merged across shards '''
+
+        parts = self._gather('stats')
+        total = sum(part['total'] for part in parts)
+        merged = {
+            'total': total,
+            'valid': sum(part['valid'] for part in parts),
+            'invalid': sum(part['invalid'] for part in parts),
+            'invalid_reasons': {},
+            'completeness': {},
+            'histograms': {},
+        }
+        for part in parts:
+            for reason, count in part['invalid_reasons'].items():
+                merged['invalid_reasons'][reason] = merged['invalid_reasons'].get(reason, 0) + count
+            for name, counts in part['histograms'].items():
+                histogram = merged['histograms'].setdefault(name, {})
+                for value, count in counts.items():
+                    histogram[value] = histogram.get(value, 0) + count
+        for name in COMPLETENESS:
+            complete = sum(part['completeness'][name] * part['total'] for part in parts)
+            merged['completeness'][name] = complete / total if total else 0.0
+        return merged
+
+    def add_worker(self):
+        ''' Starts another worker and moves the records it now owns to it; returns the number moved '''
+
+        node = self._start_worker()
+        try:
+            replies = self._scatter({other: ('rebalance', (self._ring, other)) for other in self._shards if other != node})
+            moved = [record for part in replies.values() for record in part]
+            if moved:
+                self._call(node, 'put', moved)
+        except BaseException:
+            # Nothing has been deleted yet: drop the new worker and the old shards keep their records
+            self._ring.remove(node)
+            process, conn = self._shards.pop(node)
+            conn.close()
+            process.terminate()
+            raise
+        self._scatter({other: ('delete', [record_key(record) for record in part]) for other, part in replies.items() if part})
+        return len(moved)
+
+    def close(self):
+        ''' Stops every worker process '''
+
+        for node, (process, conn) in list(self._shards.items()):
+            try:
+                conn.send(('stop', None))
+                self._receive(conn)
+            except (BrokenPipeError, EOFError, OSError):
+                pass
+            conn.close()
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        self._shards.clear()
@@ -0,0 +1,331 @@
+""" PIDINST Landing Pages
+Static HTML landing page generator for PIDInst records.
+
+Each record is rendered through templates compiled once at import time into
+an HTML page describing the instrument, its owners, manufacturers, model and
+related identifiers, with its schema.org JSON-LD embedded. Pages are written
+under the output directory at the path of the record's landing_page URL
+relative to the site's base URL.
+
+A fingerprint of each record's content is kept in a manifest in the output
+directory, so a rebuild only re-renders pages whose record changed and
+removes pages whose record is gone. Sitemaps are written in shards of at most
+50,000 URLs with a sitemap index, as the sitemap protocol requires.
+
+"""
+
+import hashlib
+import html
+import json
+import os
+import posixpath
+from string import Template
+from urllib.parse import quote
+
+from .crosswalk import SchemaOrgMapper, identifier_url
+from .serialization import to_dict
+
+# Bump when the templates change so that every page is re-rendered
+TEMPLATE_VERSION = '1'
+
+MANIFEST_NAME = '.pidinst-site.json'
+SITEMAP_LIMIT = 50000
+
+PAGE_TEMPLATE = Template('''<!DOCTYPE html>
+<html lang="en">
+<head>
+<meta charset="utf-8">
+<title>$name</title>
+<link rel="canonical" href="$url">
+<script type="application/ld+json">$jsonld</script>
+</head>
+<body>
+<main>
+<h1>$name</h1>
+$identifier$description<dl>
+$details</dl>
+$related</main>
+</body>
+</html>
+''')
+DETAIL_TEMPLATE = Template('<dt>$label</dt><dd>$value</dd>\n')
+LINK_TEMPLATE = Template('<a href="$href">$text</a>')
+RELATED_TEMPLATE = Template('<li>$relation: $link</li>\n')
+
+_schema_org = SchemaOrgMapper()
+
+
+def _escape(value):
+    return html.escape(value, quote=True)
+
+
+def _link(value, identifier_type, text=None):
+    text = _escape(text or value)
+    url = identifier_url(value, identifier_type)
+    if url is None:
+        return text
+    return LINK_TEMPLATE.substitute(href=_escape(url), text=text)
+
+
+def render_page(doc:dict, url:str):
+    ''' Returns the HTML landing page for a serialized record document '''
+
+    details = []
+    identifier = doc['identifier']
+    for owner in doc['owners']:
+        value = _escape(owner['owner_name'])
+        if owner['owner_identifier']:
+            value += ' (' + _link(owner['owner_identifier']['owner_identifier_value'], owner['owner_identifier']['owner_identifier_type']) + ')'
+        if owner['owner_contact']:
+            value += ' &ndash; ' + _escape(owner['owner_contact'])
+        details.append(DETAIL_TEMPLATE.substitute(label='Owner', value=value))
+    for manufacturer in doc['manufacturers']:
+        value = _escape(manufacturer['manufacturer_name'])
+        if manufacturer['manufacturer_identifier']:
+            value = _link(manufacturer['manufacturer_identifier']['manufacturer_identifier_value'], manufacturer['manufacturer_identifier']['manufacturer_identifier_type'], manufacturer['manufacturer_name'])
+        details.append(DETAIL_TEMPLATE.substitute(label='Manufacturer', value=value))
+    if doc['model']:
+        model = doc['model']
+        value = _escape(model['model_name'])
+        if model['model_identifier']:
+            value = _link(model['model_identifier']['model_identifier_value'], model['model_identifier']['model_identifier_type'], model['model_name'])
+        details.append(DETAIL_TEMPLATE.substitute(label='Model', value=value))
+
+    related = ''
+    if doc['related_identifiers']:
+        items = ''.join(RELATED_TEMPLATE.substitute(
+            relation=_escape(r['related_identifier_relation_type']),
+            link=_link(r['related_identifier_value'], r['related_identifier_type'], r['related_identifier_name']))
+            for r in doc['related_identifiers'])
+        related = f'<h2>Related identifiers</h2>\n<ul>\n{items}</ul>\n'
+
+    jsonld = json.dumps(_schema_org.map(doc), ensure_ascii=False, separators=(',', ':')).replace('</', '<\\/')
+    return PAGE_TEMPLATE.substitute(
+        name=_escape(doc['name']),
+        url=_escape(url),
+        jsonld=jsonld,
+        identifier=f"<p>{_escape(identifier['identifier_type'])}: {_link(identifier['identifier_value'], identifier['identifier_type'])}</p>\n" if identifier else '',
+        description=f"<p>{_escape(doc['description'])}</p>\n" if doc['description'] else '',
+        details=''.join(details),
+        related=related,
+    )
+
+
+def fingerprint(doc:dict):
+    ''' Returns the content fingerprint of a serialized record document '''
+
+    canonical = json.dumps(doc, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256((TEMPLATE_VERSION + canonical).encode('utf-8')).hexdigest()
+
+
+def _site_path(relative):
+    ''' Returns the file path of a page URL path relative to the site, or None if it is absolute or leaves the site '''
+
+    path = relative if relative.endswith('.html') else relative.rstrip('/') + '/index.html' if relative.strip('/') else 'index.html'
+    if '..' in path.split('/'):
+        return None
+    path = posixpath.normpath(path)
+    return None if posixpath.isabs(path) else path
+
+
+def _write_pages(output_dir, pages):
+    ''' Renders and writes (relative path, url, doc) pages; runs in worker processes '''
+
+    for path, url, doc in pages:
+        target = os.path.join(output_dir, path)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        tmp = f"{target}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as fh:
+            fh.write(render_page(doc, url))
+        os.replace(tmp, target)
+    return len(pages)
+
+
+class SiteBuildReport():
+    """ Outcome of a site build """
+
+    def __init__(self):
+        self.rendered = 0
+        self.unchanged = 0
+        self.removed = 0
+        self.skipped = []
+        self.sitemaps = []
+
+    def __repr__(self):
+        return f"SiteBuildReport (rendered {self.rendered}, unchanged {self.unchanged}, removed {self.removed}, skipped {len(self.skipped)})"
+
+
+class SiteGenerator():
+    """
+    Incremental static landing page generator
+
+    Args:
+        output_dir: Directory to write the site into
+        base_url: Public URL of output_dir, e.g. 'https://instruments.example.org/'
+        workers: Worker processes rendering pages (1 renders in this process)
+        chunk_size: Pages sent to a worker at a time
+        sitemap_limit: Maximum URLs per sitemap shard
+
+    """
+
+    def __init__(self, output_dir:str, base_url:str, workers:int = 1, chunk_size:int = 200, sitemap_limit:int = SITEMAP_LIMIT):
+        if not base_url.startswith('http'):
+            raise ValueError("base_url must start with either http or https")
+        self.output_dir = output_dir
+        self.base_url = base_url.rstrip('/') + '/'
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.sitemap_limit = sitemap_limit
+
+    def page_location(self, doc:dict):
+        '''
+        Returns (relative file path, page URL) for a record document, or None if it has no page
+
+        Records whose landing_page lies under base_url are written at that path;
+        others, and those whose path would leave output_dir, are given a page
+        at base_url + instrument/<identifier>/. Slashes in the identifier are
+        kept as path segments (instrument/10.1000/xyz/) since many servers
+        decode %2F before looking a path up; identifiers with empty, '.' or
+        '..' segments get no page.
+
+        '''
+
+        landing_page = doc['landing_page']
+        if landing_page and landing_page.startswith(self.base_url):
+            path = _site_path(landing_page[len(self.base_url):].split('?', 1)[0].split('#', 1)[0])
+            if path is not None:
+                return path, landing_page
+        if not doc['identifier']:
+            return None
+        segments = doc['identifier']['identifier_value'].split('/')
+        if any(segment in ('', '.', '..') for segment in segments):
+            return None
+        relative = 'instrument/' + '/'.join(quote(segment, safe='') for segment in segments) + '/'
+        path = _site_path(relative)
+        if path is None:
+            return None
+        return path, self.base_url + relative
+
+    def _load_manifest(self):
+        try:
+            with open(os.path.join(self.output_dir, MANIFEST_NAME), encoding='utf-8') as fh:
+                return json.load(fh)
+        except FileNotFoundError:
+            return {}
+
+    def _save_manifest(self, manifest):
+        path = os.path.join(self.output_dir, MANIFEST_NAME)
+        with open(f"{path}.tmp", 'w', encoding='utf-8') as fh:
+            json.dump(manifest, fh, separators=(',', ':'))
+        os.replace(f"{path}.tmp", path)
+
+    def build(self, records):
+        ''' Renders the pages of changed records, removes stale pages and rewrites the sitemaps; returns a SiteBuildReport '''
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        previous = self._load_manifest()
+        manifest = {}
+        report = SiteBuildReport()
+        sitemap = _SitemapWriter(self.output_dir, self.base_url, self.sitemap_limit)
+
+        pool = None
+        if self.workers > 1:
+            from concurrent.futures import ProcessPoolExecutor
+            pool = ProcessPoolExecutor(max_workers=self.workers)
+        pending, futures = [], []
+
+        def flush():
+            if not pending:
+                return
+            if pool is None:
+                report.rendered += _write_pages(self.output_dir, pending)
+            else:
+                futures.append(pool.submit(_write_pages, self.output_dir, list(pending)))
+                # Bound the work queued ahead of the workers
+                while len(futures) > 2 * self.workers:
+                    report.rendered += futures.pop(0).result()
+            pending.clear()
+
+        try:
+            for record in records:
+                doc = to_dict(record)
+                location = self.page_location(doc)
+                if location is None:
+                    report.skipped.append(doc['name'])
+                    continue
+                path, url = location
+                digest = fingerprint(doc)
+                manifest[path] = digest
+                sitemap.add(url)
+                if previous.get(path) == digest and os.path.exists(os.path.join(self.output_dir, path)):
+                    report.unchanged += 1
+                    continue
+                pending.append((path, url, doc))
+                if len(pending) >= self.chunk_size:
+                    flush()
+            flush()
+            for future in futures:
+                report.rendered += future.result()
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+        for path in previous:
+            # Paths from the manifest on disk are only trusted if they stay inside the site
+            if path not in manifest and _site_path(path) == path:
+                try:
+                    os.remove(os.path.join(self.output_dir, path))
+                    report.removed += 1
+                except FileNotFoundError:
+                    pass
+
+        report.sitemaps = sitemap.close()
+        self._save_manifest(manifest)
+        return report
+
+
+class _SitemapWriter():
+    """ Writes sitemap shards of at most `limit` URLs and a sitemap index """
+
+    def __init__(self, output_dir, base_url, limit):
+        self.output_dir = output_dir
+        self.base_url = base_url
+        self.limit = limit
+        self.shards = []
+        self._fh = None
+        self._count = 0
+
+    def add(self, url):
+        if self._fh is None or self._count >= self.limit:
+            self._next_shard()
+        self._fh.write(f'<url><loc>{_escape(url)}</loc></url>\n')
+        self._count += 1
+
+    def _next_shard(self):
+        self._end_shard()
+        name = f'sitemap-{len(self.shards) + 1}.xml'
+        self.shards.append(name)
+        self._fh = open(os.path.join(self.output_dir, name), 'w', encoding='utf-8')
+        self._fh.write('<?xml version="1.0" encoding="UTF-8"?>\n<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n')
+        self._count = 0
+
+    def _end_shard(self):
+        if self._fh is not None:
+            self._fh.write('</urlset>\n')
+            self._fh.close()
+            self._fh = None
+
+    def close(self):
+        ''' Finishes the last shard, removes shards left over from larger builds and writes sitemap.xml '''
+
+        self._end_shard()
+        number = len(self.shards) + 1
+        while os.path.exists(os.path.join(self.output_dir, f'sitemap-{number}.xml')):
+            os.remove(os.path.join(self.output_dir, f'sitemap-{number}.xml'))
+            number += 1
+        with open(os.path.join(self.output_dir, 'sitemap.xml'), 'w', encoding='utf-8') as fh:
+            fh.write('<?xml version="1.0" encoding="UTF-8"?>\n<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n')
+            for name in self.shards:
+                fh.write(f'<sitemap><loc>{_escape(self.base_url + name)}</loc></sitemap>\n')
+            fh.write('</sitemapindex>\n')
+        return list(self.shards)
@@ -0,0 +1,203 @@
+""" PIDINST Catalog Statistics
+Incrementally maintained validity and completeness statistics for a catalog.
+
+CatalogStats keeps counters up to date as records are added, changed or
+removed, remembering each record's contribution so that a change only costs
+the size of that record. Individual figures are read in O(1).
+
+snapshot() returns an immutable copy of every figure. It is O(1) to read
+while nothing changes; after a change the next call rebuilds it, copying
+only the sections the change touched (the counts, and the invalid reasons and
+histograms whose values moved), so that cost is bounded by the number of
+distinct values in those sections rather than the whole catalog. Keeping a
+fully persistent snapshot up to date on every write would move that cost onto
+writers, which are the hot path when a catalog is loaded.
+
+"""
+
+import threading
+from collections import Counter
+from types import MappingProxyType
+
+# Fields checked by PIDInst.is_valid_pidinst()
+MANDATORY_FIELDS = ('identifier', 'landing_page', 'name', 'owners', 'manufacturers')
+
+# Completeness checks: name -> function of record returning whether it is filled in
+COMPLETENESS = {
+    'identifier': lambda record: record.identifier is not None,
+    'landing_page': lambda record: bool(record.landing_page),
+    'description': lambda record: bool(record.description),
+    'model': lambda record: record.model is not None,
+    'owners': lambda record: bool(record.owners),
+    'owner_orcid': lambda record: any(owner.owner_identifier is not None and owner.owner_identifier.owner_identifier_type == 'ORCID' for owner in record.owners),
+    'manufacturers': lambda record: bool(record.manufacturers),
+    'manufacturer_identifier': lambda record: any(m.manufacturer_identifier is not None for m in record.manufacturers),
+    'related_identifiers': lambda record: bool(record.related_identifiers),
+}
+
+# Histograms: name -> function of record returning the values it contributes
+HISTOGRAMS = {
+    'identifier_type': lambda record: [record.identifier.identifier_type] if record.identifier is not None else [],
+    'manufacturer_name': lambda record: [m.manufacturer_name for m in record.manufacturers],
+    'owner_identifier_type': lambda record: [o.owner_identifier.owner_identifier_type for o in record.owners if o.owner_identifier is not None],
+    'related_identifier_type': lambda record: [r.related_identifier_type for r in record.related_identifiers],
+    'related_identifier_relation_type': lambda record: [r.related_identifier_relation_type for r in record.related_identifiers],
+}
+
+
+def invalid_reasons(record):
+    ''' Returns why a record fails is_valid_pidinst(), as a tuple of 'missing <field>' strings '''
+    return tuple(f"missing {field}" for field in MANDATORY_FIELDS if not getattr(record, field))
+
+
+class CatalogStats():
+    """
+    Aggregate statistics over a keyed collection of PIDInst records
+
+    Records are registered with add() or update() and dropped with remove().
+    A CatalogStats can also be attached to a ConcurrentCatalog with
+    catalog.add_listener(stats.on_change).
+
+    """
+
+    def __init__(self, records:dict = None):
+        self._lock = threading.Lock()
+        self._contributions = {}
+        self.valid = 0
+        self._reasons = Counter()
+        self._complete = Counter()
+        self._histograms = {name: Counter() for name in HISTOGRAMS}
+        self._snapshot = None
+        # Read-only copies of sections reused by snapshot(); None when the section changed
+        self._frozen_reasons = None
+        self._frozen_histograms = dict.fromkeys(HISTOGRAMS)
+        for key, record in (records or {}).items():
+            self.add(key, record)
+
+    def __repr__(self):
+        return f"CatalogStats ({self.total} records, {self.valid} valid)"
+
+    def __len__(self):
+        return len(self._contributions)
+
+    def __contains__(self, key):
+        return key in self._contributions
+
+    @property
+    def total(self):
+        return len(self._contributions)
+
+    @property
+    def invalid(self):
+        return self.total - self.valid
+
+    def invalid_reasons(self):
+        return MappingProxyType(self._reasons)
+
+    def completeness(self, name:str):
+        ''' Returns the fraction of records with the named field filled in (see COMPLETENESS) '''
+
+        if name not in COMPLETENESS:
+            raise ValueError(f"Unknown completeness field '{name}'")
+        return self._complete[name] / self.total if self.total else 0.0
+
+    def histogram(self, name:str):
+        ''' Returns a read-only view of the value counts for the named histogram (see HISTOGRAMS) '''
+
+        if name not in HISTOGRAMS:
+            raise ValueError(f"Unknown histogram '{name}'")
+        return MappingProxyType(self._histograms[name])
+
+    @staticmethod
+    def _contribution(record):
+        reasons = invalid_reasons(record)
+        complete = tuple(name for name, check in COMPLETENESS.items() if check(record))
+        values = tuple((name, tuple(values(record))) for name, values in HISTOGRAMS.items())
+        return reasons, complete, values
+
+    def _apply(self, contribution, sign):
+        reasons, complete, values = contribution
+        if not reasons:
+            self.valid += sign
+        if reasons:
+            self._frozen_reasons = None
+        for reason in reasons:
+            self._reasons[reason] += sign
+            if not self._reasons[reason]:
+                del self._reasons[reason]
+        for name in complete:
+            self._complete[name] += sign
+        for name, entries in values:
+            histogram = self._histograms[name]
+            if entries:
+                self._frozen_histograms[name] = None
+            for value in entries:
+                histogram[value] += sign
+                if not histogram[value]:
+                    del histogram[value]
+
+    def add(self, key, record):
+        ''' Adds a record, or replaces the statistics of the record already held under key '''
+
+        contribution = self._contribution(record)
+        with self._lock:
+            old = self._contributions.get(key)
+            if old == contribution:
+                return
+            if old is not None:
+                self._apply(old, -1)
+            self._apply(contribution, 1)
+            self._contributions[key] = contribution
+            self._snapshot = None
+
+    # A changed record is re-registered under its key
+    update = add
+
+    def remove(self, key):
+        if not self.discard(key):
+            raise KeyError(key)
+
+    def discard(self, key):
+        ''' Removes the record held under key if there is one; returns whether there was '''
+
+        with self._lock:
+            old = self._contributions.pop(key, None)
+            if old is None:
+                return False
+            self._apply(old, -1)
+            self._snapshot = None
+            return True
+
+    def on_change(self, key, old, record):
+        ''' Catalog listener: keeps statistics in step with catalog changes '''
+
+        if record is None:
+            self.discard(key)
+        else:
+            self.add(key, record)
+
+    def snapshot(self):
+        ''' Returns an immutable dict of every figure, reused until the statistics change '''
+
+        snapshot = self._snapshot
+        if snapshot is not None:
+            return snapshot
+        with self._lock:
+            if self._snapshot is not None:
+                return self._snapshot
+            total = self.total
+            if self._frozen_reasons is None:
+                self._frozen_reasons = MappingProxyType(dict(self._reasons))
+            for name, frozen in self._frozen_histograms.items():
+                if frozen is None:
+                    self._frozen_histograms[name] = MappingProxyType(dict(self._histograms[name]))
+            snapshot = MappingProxyType({
+                'total': total,
+                'valid': self.valid,
+                'invalid': total - self.valid,
+                'invalid_reasons': self._frozen_reasons,
+                'completeness': MappingProxyType({name: (self._complete[name] / total if total else 0.0) for name in COMPLETENESS}),
+                'histograms': MappingProxyType(dict(self._frozen_histograms)),
+            })
+            self._snapshot = snapshot
+        return snapshot
@@ -1,5 +1,42 @@
 import unittest
+import asyncio
+import contextlib
+import copy
+import csv
+import gc
+import io
+import json
+import os
+import pickle
+import subprocess
+import sys
+import tempfile
+import threading
+import warnings
+import weakref
+from unittest import mock
 from pypidinst.pidinst import PIDInst, Identifier, Owner, OwnerIdentifier, Manufacturer, ManufacturerIdentifier, Model, ModelIdentifier, RelatedIdentifier
+from pypidinst.frozen import FrozenPIDInst, FrozenOwner, FrozenModel, freeze, thaw
+from pypidinst.history import RecordHistory, VersionStore
+from pypidinst.serialization import to_dict, from_dict, dump_records, load_records
+from pypidinst.migrations import MigrationRegistry, MigrationError, migrate_stream, migrate_file
+from pypidinst.crosswalk import crosswalk, Mapper, DataCiteMapper, SchemaOrgMapper, EpicMapper
+from pypidinst.importer import ColumnMapping, RowError, import_csv, import_rows
+from pypidinst.query import Field, Any, Query, HashIndex
+from pypidinst.catalog import ConcurrentCatalog
+from pypidinst.stats import CatalogStats
+from pypidinst.sharding import HashRing, ShardedCatalog
+from pypidinst.archive import ArchiveReader, ArchiveWriter, ArchiveError, write_archive
+from pypidinst.manifest import BuildManifest, IncrementalIndexer
+from pypidinst.bloom import BloomFilter, normalize_identifier
+from pypidinst.site import SiteGenerator, render_page
+from pypidinst.schema import SchemaValidator, ValidationError, json_schema, validate_documents
+from pypidinst.rdf import RELATION_PREDICATES, Literal, iter_triples, write_ntriples, iter_jsonld_chunks
+from pypidinst import cli
+from pypidinst.events import EventBus, EventLog, FieldChanged, OwnerAppended, RecordAdded, RecordReplaced, RecordRemoved, \
+    RelatedIdentifierAppended, RelatedIdentifierRemoved
+from pypidinst.allocations import AllocationBudgetError, OPERATIONS, check_budgets, measure, run_budgets
+from pypidinst.vocabs import INSTRUMENT_IDENTIFIER_TYPES, RELATED_IDENTIFIER_RELATION_TYPES
 
 class TestInstruments(unittest.TestCase):
 
@@ -526,5 +563,1199 @@ class TestValidations(unittest.TestCase):
         self.assertFalse(instrument.is_valid_pidinst(), 'Something went wrong with PIDInst validation')
 
 
+def build_instrument(identifier_value="10.1000/retwebwb", name="Instrument XYZ"):
+    ''' Builds a fully populated, valid PIDInst record for use in tests '''
+    instrument = PIDInst(landing_page='https://www.landingpage.com', name=name, description='A description of this instrument')
+    instrument.identifier = Identifier(identifier_value=identifier_value, identifier_type="DOI")
+    owner = Owner(owner_name="Jane Doe", owner_contact="jane.doe@email.com")
+    owner.owner_identifier = OwnerIdentifier(owner_identifier_value="0000-ABCD-1234-WXYZ", owner_identifier_type='ORCID')
+    instrument.append_owner(owner)
+    manufacturer = Manufacturer(manufacturer_name="Acme Inc")
+    manufacturer.manufacturer_identifier = ManufacturerIdentifier(manufacturer_identifier_value="https://www.acme.com", manufacturer_identifier_type='URL')
+    instrument.append_manufacturer(manufacturer)
+    model = Model(model_name="Model OPQ")
+    model.model_identifier = ModelIdentifier(model_identifier_value="ABC123", model_identifier_type='URL')
+    instrument.model = model
+    instrument.append_related_identifier(RelatedIdentifier(related_identifier_value="https://www.pathtopaper.edu.au", related_identifier_type="URL", related_identifier_relation_type="IsDescribedBy", related_identifier_name="Documentation Paper"))
+    return instrument
+
+
+class TestFrozen(unittest.TestCase):
+
+    def test_roundtrip(self):
+        instrument = build_instrument()
+        frozen = freeze(instrument)
+        self.assertIsInstance(frozen, FrozenPIDInst)
+        self.assertIsInstance(frozen.owners, tuple)
+        self.assertIsInstance(frozen.owners[0], FrozenOwner)
+        self.assertTrue(frozen.is_valid_pidinst())
+        mutable = thaw(frozen)
+        self.assertIsInstance(mutable, PIDInst)
+        self.assertIsInstance(mutable.owners, list)
+        self.assertEqual(mutable.manufacturers[0].manufacturer_identifier.manufacturer_identifier_value, "https://www.acme.com")
+        self.assertEqual(freeze(mutable), frozen)
+
+    def test_immutable(self):
+        frozen = freeze(build_instrument())
+        with self.assertRaises(AttributeError):
+            frozen.name = "Other"
+        self.assertIs(copy.deepcopy(frozen), frozen)
+
+    def test_hash_and_eq(self):
+        first = freeze(build_instrument())
+        second = freeze(build_instrument())
+        self.assertIsNot(first, second)
+        self.assertEqual(first, second)
+        self.assertEqual(len({first, second}), 1)
+        self.assertNotEqual(first, first.evolve(description="Another description"))
+
+    def test_evolve_shares_unchanged_subtrees(self):
+        frozen = freeze(build_instrument())
+        evolved = frozen.evolve(model=FrozenModel(model_name="Model RST"))
+        self.assertEqual(evolved.model.model_name, "Model RST")
+        self.assertEqual(frozen.model.model_name, "Model OPQ")
+        self.assertIs(evolved.owners, frozen.owners)
+        self.assertIs(evolved.identifier, frozen.identifier)
+
+    def test_evolve_validates(self):
+        frozen = freeze(build_instrument())
+        with self.assertRaises(ValueError) as exc:
+            frozen.evolve(name="A"*201)
+        self.assertEqual(str(exc.exception), "name must be less than 200 chars")
+        with self.assertRaises(TypeError) as exc:
+            frozen.evolve(owners=[{'owner_name': 'Jane Doe'}])
+        self.assertEqual(str(exc.exception), "owners must be a list of Owner objects")
+        with self.assertRaises(ValueError):
+            frozen.evolve(identifier=Identifier(identifier_value="10.1000/other", identifier_type="DOI"))
+
+    def test_evolve_freezes_mutable_children(self):
+        frozen = FrozenPIDInst(name="Instrument XYZ")
+        evolved = frozen.evolve(owners=[Owner(owner_name="Jane Doe")])
+        self.assertIsInstance(evolved.owners[0], FrozenOwner)
+
+    def test_pickle(self):
+        frozen = freeze(build_instrument())
+        self.assertEqual(pickle.loads(pickle.dumps(frozen)), frozen)
+
+
+class TestHistory(unittest.TestCase):
+
+    def test_revisions_by_number(self):
+        history = RecordHistory(snapshot_interval=3)
+        record = freeze(build_instrument())
+        names = []
+        for i in range(10):
+            record = record.evolve(name=f"Instrument {i}")
+            names.append(record.name)
+            self.assertEqual(history.commit(record, timestamp=float(i)), i)
+        self.assertEqual(len(history), 10)
+        self.assertEqual([history.get(i).name for i in range(10)], names)
+        self.assertEqual(history.get(-1).name, "Instrument 9")
+        with self.assertRaises(IndexError):
+            history.get(10)
+
+    def test_revisions_by_timestamp(self):
+        history = RecordHistory()
+        record = freeze(build_instrument())
+        history.commit(record, timestamp=10.0)
+        history.commit(record.evolve(description="Corrected"), timestamp=20.0)
+        self.assertEqual(history.at(15.0), record)
+        self.assertEqual(history.at(20.0).description, "Corrected")
+        with self.assertRaises(LookupError):
+            history.at(5.0)
+        with self.assertRaises(ValueError):
+            history.commit(record, timestamp=1.0)
+
+    def test_revisions_share_subobjects(self):
+        history = RecordHistory(snapshot_interval=2)
+        history.commit(build_instrument(), timestamp=1.0)
+        updated = build_instrument()
+        updated.model = Model(model_name="Model RST")
+        updated.append_owner(Owner(owner_name="John Doe"))
+        history.commit(updated, timestamp=2.0)
+        first, second = history.get(0), history.get(1)
+        self.assertIs(second.owners[0], first.owners[0])
+        self.assertIs(second.manufacturers, first.manufacturers)
+        self.assertIsNot(second.model, first.model)
+        self.assertEqual(set(history._entries[1]), {'model', 'owners'})
+
+    def test_version_store(self):
+        store = VersionStore()
+        store.commit(build_instrument("10.1000/a"), timestamp=1.0)
+        store.commit(build_instrument("10.1000/b"), timestamp=1.0)
+        store.commit(build_instrument("10.1000/a", name="Renamed"), timestamp=2.0)
+        self.assertEqual(len(store), 2)
+        self.assertEqual(store.get("10.1000/a").name, "Renamed")
+        self.assertEqual(store.get("10.1000/a", revision=0).name, "Instrument XYZ")
+        self.assertEqual(store.get("10.1000/a", timestamp=1.5).name, "Instrument XYZ")
+        with self.assertRaises(KeyError):
+            store.get("10.1000/c")
+        with self.assertRaises(ValueError):
+            store.commit(PIDInst(name="No identifier"))
+
+
+class TestSerialization(unittest.TestCase):
+
+    def test_roundtrip(self):
+        doc = to_dict(build_instrument())
+        self.assertEqual(doc['schema_version'], '1.0')
+        self.assertEqual(to_dict(from_dict(doc)), doc)
+        self.assertEqual(to_dict(freeze(build_instrument())), doc)
+
+    def test_jsonl_roundtrip(self):
+        fh = io.StringIO()
+        self.assertEqual(dump_records([build_instrument("10.1000/a"), build_instrument("10.1000/b")], fh), 2)
+        fh.seek(0)
+        records = list(load_records(fh))
+        self.assertEqual([r.identifier.identifier_value for r in records], ["10.1000/a", "10.1000/b"])
+
+    def test_invalid_document(self):
+        doc = to_dict(build_instrument())
+        doc['name'] = "A"*201
+        with self.assertRaises(ValueError) as exc:
+            from_dict(doc)
+        self.assertEqual(str(exc.exception), "name must be less than 200 chars")
+        doc = to_dict(build_instrument())
+        doc['schema_version'] = '0.9'
+        with self.assertRaises(ValueError):
+            from_dict(doc)
+
+
+class TestMigrations(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = MigrationRegistry()
+
+        @self.registry.register('0.8', '0.9')
+        def add_description(doc):
+            doc.setdefault('description', None)
+            return doc
+
+        @self.registry.register('0.9', '1.0')
+        def rename_title(doc):
+            if 'title' not in doc:
+                raise KeyError('title')
+            doc['name'] = doc.pop('title')
+            return doc
+
+    def test_chained_migration(self):
+        doc, versions = self.registry.migrate({'schema_version': '0.8', 'title': 'Instrument XYZ'})
+        self.assertEqual(versions, ['0.8', '0.9', '1.0'])
+        self.assertEqual(from_dict(doc).name, 'Instrument XYZ')
+
+    def test_no_path(self):
+        with self.assertRaises(MigrationError):
+            self.registry.migrate({'schema_version': '0.5'})
+
+    def test_stream_reports(self):
+        docs = [{'schema_version': '0.8', 'title': 'A'}, '{"schema_version": "0.8"}', 'not json']
+        results = list(migrate_stream(docs, registry=self.registry))
+        self.assertEqual([report.ok for _, report in results], [True, False, False])
+        self.assertIsNone(results[1][0])
+        self.assertIn('KeyError', results[1][1].error)
+
+    def test_file_resumes_from_checkpoint(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            source, destination = os.path.join(tmp, 'in.jsonl'), os.path.join(tmp, 'out.jsonl')
+            checkpoint = os.path.join(tmp, 'checkpoint.json')
+            with open(source, 'w') as fh:
+                for i in range(10):
+                    fh.write(json.dumps({'schema_version': '0.8', 'title': f'Instrument {i}'}) + '\n')
+
+            calls = []
+            @self.registry.register('1.0', '1.1')
+            def interrupt(doc):
+                calls.append(doc['name'])
+                if len(calls) == 7:
+                    raise KeyboardInterrupt
+                return doc
+
+            with self.assertRaises(KeyboardInterrupt):
+                migrate_file(source, destination, '1.1', self.registry, checkpoint_path=checkpoint, checkpoint_every=3)
+            self.assertTrue(os.path.exists(checkpoint))
+            counts = migrate_file(source, destination, '1.1', self.registry, checkpoint_path=checkpoint, checkpoint_every=3)
+            self.assertEqual(counts, {'migrated': 10, 'failed': 0, 'skipped': 6})
+            self.assertFalse(os.path.exists(checkpoint))
+            with open(destination) as fh:
+                names = [json.loads(line)['name'] for line in fh]
+            self.assertEqual(names, [f'Instrument {i}' for i in range(10)])
+
+    def test_resume_without_outputs(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            source, destination = os.path.join(tmp, 'in.jsonl'), os.path.join(tmp, 'out.jsonl')
+            checkpoint, report = os.path.join(tmp, 'checkpoint.json'), os.path.join(tmp, 'report.jsonl')
+            with open(source, 'w') as fh:
+                fh.write(json.dumps({'schema_version': '0.8', 'title': 'Instrument'}) + '\n')
+            with open(checkpoint, 'w') as fh:
+                json.dump({'to_version': '1.0', 'records': 1, 'migrated': 1, 'failed': 0, 'output_offset': 10, 'report_offset': 0}, fh)
+            with self.assertRaises(MigrationError):
+                migrate_file(source, destination, '1.0', self.registry, checkpoint_path=checkpoint)
+            with open(destination, 'w') as fh:
+                fh.write('x' * 10)
+            with self.assertRaises(MigrationError):
+                migrate_file(source, destination, '1.0', self.registry, report_path=report, checkpoint_path=checkpoint)
+            self.assertTrue(os.path.exists(checkpoint))
+            self.assertEqual(os.path.getsize(destination), 10)
+
+
+class TestCrosswalk(unittest.TestCase):
+
+    def test_datacite(self):
+        mapped = DataCiteMapper().map(to_dict(build_instrument()))['data']['attributes']
+        self.assertEqual(mapped['doi'], "10.1000/retwebwb")
+        self.assertEqual(mapped['titles'], [{'title': "Instrument XYZ"}])
+        self.assertEqual(mapped['creators'][0]['name'], "Acme Inc")
+        self.assertEqual(mapped['contributors'][0]['contributorType'], "HostingInstitution")
+        self.assertEqual(mapped['relatedIdentifiers'][0]['relationType'], "IsDescribedBy")
+
+    def test_schemaorg(self):
+        mapped = SchemaOrgMapper().map(to_dict(build_instrument()))
+        self.assertEqual(mapped['@id'], "https://doi.org/10.1000/retwebwb")
+        self.assertEqual(mapped['model']['name'], "Model OPQ")
+        self.assertEqual(mapped['subjectOf'][0]['@id'], "https://www.pathtopaper.edu.au")
+
+    def test_epic(self):
+        mapped = EpicMapper().map(to_dict(build_instrument()))
+        self.assertEqual(mapped['handle'], "10.1000/retwebwb")
+        self.assertEqual([value['type'] for value in mapped['values']][:4], ['URL', 'Name', 'Owner', 'Manufacturer'])
+
+    def test_single_pass_to_many_outputs(self):
+        class CountingMapper(Mapper):
+            def __init__(self):
+                self.seen = 0
+            def map(self, doc):
+                self.seen += 1
+                return doc['name']
+
+        records = (build_instrument(f"10.1000/{i}") for i in range(3))
+        counting = CountingMapper()
+        outputs = {DataCiteMapper(): io.StringIO(), EpicMapper(): io.StringIO(), counting: io.StringIO()}
+        self.assertEqual(crosswalk(records, outputs), 3)
+        self.assertEqual(counting.seen, 3)
+        for fh in outputs.values():
+            self.assertEqual(len(fh.getvalue().splitlines()), 3)
+
+    def test_output_paths(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'datacite.jsonl')
+            crosswalk([build_instrument()], {DataCiteMapper(): path})
+            with open(path) as fh:
+                self.assertEqual(json.loads(fh.readline())['data']['attributes']['doi'], "10.1000/retwebwb")
+
+
+class TestImporter(unittest.TestCase):
+
+    CSV = (
+        "identifier,identifier_type,name,landing_page,owner_1_name,owner_1_orcid,owner_2_name,manufacturer_1_name,manufacturer_1_url\n"
+        "10.1000/a,DOI,Instrument A,https://a.org,Jane Doe,0000-ABCD-1234-WXYZ,John Doe,Acme Inc,https://www.acme.com\n"
+        "10.1000/b,XYZ,,a.org,Jane Doe,,,Acme Inc,\n"
+        "10.1000/c,DOI,Instrument C,https://c.org,,,,,\n"
+    )
+
+    def test_import_with_rejects(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            source, rejects = os.path.join(tmp, 'in.csv'), os.path.join(tmp, 'rejects.csv')
+            with open(source, 'w') as fh:
+                fh.write(self.CSV)
+            records = list(import_csv(source, reject_path=rejects))
+            self.assertEqual([r.name for r in records], ['Instrument A', 'Instrument C'])
+            self.assertEqual([o.owner_name for o in records[0].owners], ['Jane Doe', 'John Doe'])
+            self.assertEqual(records[0].owners[0].owner_identifier.owner_identifier_type, 'ORCID')
+            self.assertIsNone(records[0].owners[1].owner_identifier)
+            self.assertEqual(records[0].manufacturers[0].manufacturer_identifier.manufacturer_identifier_value, 'https://www.acme.com')
+            self.assertTrue(records[0].is_valid_pidinst())
+            self.assertEqual(records[1].owners, [])
+
+            with open(rejects) as fh:
+                rejected = list(csv.DictReader(fh))
+            self.assertEqual(len(rejected), 1)
+            self.assertEqual(rejected[0]['_line'], '3')
+            self.assertIn('Identifier Type not recognised', rejected[0]['_errors'])
+            self.assertIn('name cannot be None', rejected[0]['_errors'])
+            self.assertIn('landing_page must start with either http or https', rejected[0]['_errors'])
+
+    def test_raises_without_reject_sink(self):
+        with self.assertRaises(RowError) as exc:
+            list(import_csv(io.StringIO(self.CSV)))
+        self.assertEqual(exc.exception.line, 3)
+        self.assertEqual(len(exc.exception.errors), 3)
+
+    def test_lines_follow_multiline_cells(self):
+        source = self.CSV.replace('Instrument A', '"Instrument\nA"', 1)
+        with self.assertRaises(RowError) as exc:
+            list(import_csv(io.StringIO(source)))
+        self.assertEqual(exc.exception.line, 4)
+        rejected = []
+        rows = [{'name': ''}, {'name': 'B'}, {'name': ''}]
+        list(import_rows(rows, ['name'], ColumnMapping(fields={'name': 'name'}), rejected.append, first_line=5))
+        self.assertEqual([error.line for error in rejected], [5, 7])
+
+    def test_tsv_and_custom_mapping(self):
+        mapping = ColumnMapping(fields={'name': 'Title', 'identifier.identifier_value': 'PID'}, constants={'identifier.identifier_type': 'Handle'})
+        records = list(import_csv(io.StringIO("Title\tPID\nInstrument A\t20.500/abc\n"), mapping, delimiter='\t'))
+        self.assertEqual(records[0].identifier.identifier_type, 'Handle')
+
+    def test_invalid_mapping(self):
+        with self.assertRaises(ValueError):
+            ColumnMapping(fields={'owner_name': 'x'})
+        with self.assertRaises(ValueError):
+            ColumnMapping(owners={'owner_name': 'owner_name'})
+
+
+class TestQuery(unittest.TestCase):
+
+    def setUp(self):
+        self.records = {}
+        for i in range(6):
+            record = build_instrument(f"10.1000/{i}")
+            if i % 2:
+                record.model = None
+            if i < 3:
+                record.owners[0].owner_identifier.owner_identifier_value = f"0000-0000-0000-000{i}"
+            if i in (1, 4):
+                record.append_related_identifier(RelatedIdentifier(related_identifier_value="10.1000/parent", related_identifier_type="DOI", related_identifier_relation_type="IsComponentOf"))
+            self.records[record.identifier.identifier_value] = record
+        self.query = Query(
+            Field('owners.owner_identifier.owner_identifier_value').isin(["0000-0000-0000-0001", "0000-0000-0000-0002"])
+            & Any('related_identifiers', related_identifier_relation_type='IsComponentOf', related_identifier_value='10.1000/parent')
+            & Field('model').is_none()
+        )
+
+    def test_scan(self):
+        self.assertEqual(self.query.run(self.records), ["10.1000/1"])
+        self.assertTrue(self.query.explain().startswith("SCAN"))
+        self.assertEqual(self.query.filter(list(self.records.values()))[0].name, "Instrument XYZ")
+
+    def test_index_push_down(self):
+        paths = ['owners.owner_identifier.owner_identifier_value', 'related_identifiers.related_identifier_value']
+        indexes = {path: HashIndex(path).build(self.records) for path in paths}
+        self.assertEqual(self.query.run(self.records, indexes), ["10.1000/1"])
+        plan = self.query.explain(indexes)
+        self.assertIn("INDEX LOOKUP owners.owner_identifier.owner_identifier_value (2 values)", plan)
+        self.assertIn("INDEX LOOKUP related_identifiers.related_identifier_value (1 value) [candidates]", plan)
+        self.assertNotIn("IN (2 values)", plan.splitlines()[-1])
+        self.assertIn("model IS NONE", plan)
+
+    def test_index_maintenance(self):
+        index = HashIndex('identifier.identifier_value').build(self.records)
+        record = self.records["10.1000/0"]
+        index.discard("10.1000/0", record)
+        self.assertEqual(index.lookup("10.1000/0"), frozenset())
+        self.assertEqual(Query(Field('identifier.identifier_value') == "10.1000/0").run(self.records, {index.path: index}), [])
+
+    def test_indexed_results_match_scan(self):
+        records = list(self.records.values())
+        records[2].description = None
+        records.reverse()
+        indexes = {path: HashIndex(path).build(dict(enumerate(records))) for path in ('description', 'owners.owner_name')}
+        for term in (Field('description') == None, Field('description').isin([None, 'x']), Field('owners.owner_name') == "Jane Doe"):
+            query = Query(term)
+            self.assertEqual(query.filter(records, indexes), query.filter(records))
+            self.assertEqual(query.run(records, indexes), query.run(records))
+        self.assertEqual(Query(Field('description') == None).run(records, indexes), [3])
+        self.assertTrue(Query(Field('description') == None).explain(indexes).startswith("SCAN"))
+        self.assertEqual(Query(Field('owners.owner_name') == "Jane Doe").run(records, indexes), list(range(6)))
+
+    def test_combinators(self):
+        term = (Field('model').exists() | Field('name').startswith('Nope')) & ~Field('description').contains('xyz')
+        self.assertEqual(sorted(Query(term).run(self.records)), ["10.1000/0", "10.1000/2", "10.1000/4"])
+        self.assertEqual(pickle.loads(pickle.dumps(term)), term)
+        self.assertEqual(Query(Any('owners', Any.field('owners', 'owner_contact').contains('@email'))).run(list(self.records.values())), list(range(6)))
+
+    def test_invalid_path(self):
+        with self.assertRaises(ValueError):
+            Field('owners.manufacturer_name')
+        with self.assertRaises(ValueError):
+            Any('model', model_name='x')
+
+
+class TestConcurrentCatalog(unittest.TestCase):
+
+    def test_snapshot_isolation(self):
+        catalog = ConcurrentCatalog([build_instrument("10.1000/a")], index_paths=['name'])
+        before = catalog.snapshot()
+        with catalog.batch() as batch:
+            batch.put(build_instrument("10.1000/a", name="Renamed"))
+            batch.put(build_instrument("10.1000/b"))
+        after = catalog.snapshot()
+        self.assertEqual(before.get("10.1000/a").name, "Instrument XYZ")
+        self.assertEqual(len(before), 1)
+        self.assertEqual(after.get("10.1000/a").name, "Renamed")
+        self.assertEqual(after.generation, before.generation + 1)
+        self.assertEqual([r.identifier.identifier_value for r in before.query(Field('name') == "Instrument XYZ")], ["10.1000/a"])
+        self.assertEqual([r.identifier.identifier_value for r in after.query(Field('name') == "Instrument XYZ")], ["10.1000/b"])
+        catalog.delete("10.1000/a")
+        self.assertNotIn("10.1000/a", catalog)
+        self.assertIn("10.1000/a", after)
+
+    def test_empty_batch_copies_nothing(self):
+        catalog = ConcurrentCatalog([build_instrument("10.1000/a")], index_paths=['name'])
+        before = catalog.snapshot()
+        with mock.patch.object(HashIndex, 'copy', side_effect=AssertionError("index copied")):
+            with catalog.batch():
+                pass
+        self.assertIs(catalog.snapshot(), before)
+
+    def test_unchanged_batch_keeps_generation(self):
+        catalog = ConcurrentCatalog([build_instrument()])
+        generation = catalog.snapshot().generation
+        catalog.put(build_instrument())
+        self.assertEqual(catalog.snapshot().generation, generation)
+
+    def test_concurrent_readers_and_writer(self):
+        catalog = ConcurrentCatalog([build_instrument(f"10.1000/{i}", name="Rev 0") for i in range(50)], index_paths=['name'])
+        stop = threading.Event()
+        failures = []
+
+        def reader():
+            while not stop.is_set():
+                snapshot = catalog.snapshot()
+                names = {record.name for record in snapshot}
+                indexed = snapshot.query(Field('name').isin(names))
+                # Every batch renames all records, so a consistent snapshot holds exactly one revision
+                if len(names) != 1 or len(indexed) != 50:
+                    failures.append(names)
+
+        threads = [threading.Thread(target=reader) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for revision in range(1, 30):
+            with catalog.batch() as batch:
+                for i in range(50):
+                    batch.put(build_instrument(f"10.1000/{i}", name=f"Rev {revision}"))
+        stop.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(failures, [])
+        self.assertEqual({record.name for record in catalog.snapshot()}, {"Rev 29"})
+
+
+class TestCatalogStats(unittest.TestCase):
+
+    def test_incremental_counts(self):
+        stats = CatalogStats({"a": build_instrument("10.1000/a"), "b": PIDInst(name="Bare")})
+        self.assertEqual((stats.total, stats.valid, stats.invalid), (2, 1, 1))
+        self.assertEqual(stats.invalid_reasons()["missing owners"], 1)
+        self.assertEqual(stats.completeness('model'), 0.5)
+        self.assertEqual(stats.histogram('manufacturer_name')["Acme Inc"], 1)
+
+        record = build_instrument("10.1000/c")
+        record.model = None
+        stats.add("c", record)
+        self.assertAlmostEqual(stats.completeness('model'), 1 / 3)
+        record.model = Model(model_name="Model OPQ")
+        stats.update("c", record)
+        self.assertAlmostEqual(stats.completeness('model'), 2 / 3)
+        self.assertEqual(stats.histogram('manufacturer_name')["Acme Inc"], 2)
+
+        stats.remove("b")
+        self.assertEqual((stats.total, stats.invalid), (2, 0))
+        self.assertEqual(dict(stats.invalid_reasons()), {})
+        with self.assertRaises(KeyError):
+            stats.remove("b")
+
+    def test_snapshot_reused_until_change(self):
+        stats = CatalogStats({"a": build_instrument()})
+        snapshot = stats.snapshot()
+        self.assertIs(stats.snapshot(), snapshot)
+        self.assertEqual(snapshot['completeness']['owner_orcid'], 1.0)
+        stats.add("b", PIDInst(name="Bare"))
+        self.assertIsNot(stats.snapshot(), snapshot)
+        self.assertEqual(snapshot['total'], 1)
+        self.assertEqual(stats.snapshot()['total'], 2)
+
+    def test_snapshot_reuses_unchanged_sections(self):
+        stats = CatalogStats({"a": build_instrument()})
+        snapshot = stats.snapshot()
+        stats.add("b", PIDInst(name="Bare"))
+        rebuilt = stats.snapshot()
+        self.assertIs(rebuilt['histograms']['manufacturer_name'], snapshot['histograms']['manufacturer_name'])
+        self.assertEqual(rebuilt['histograms']['manufacturer_name'], {"Acme Inc": 1})
+        stats.discard("a")
+        self.assertEqual(stats.snapshot()['histograms']['manufacturer_name'], {})
+        self.assertEqual(snapshot['histograms']['manufacturer_name'], {"Acme Inc": 1})
+
+    def test_concurrent_discard(self):
+        stats = CatalogStats({str(i): build_instrument() for i in range(200)})
+        removed = []
+        def discard_all():
+            removed.append(sum(stats.discard(str(i)) for i in range(200)))
+        threads = [threading.Thread(target=discard_all) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sum(removed), 200)
+        self.assertEqual(stats.total, 0)
+        self.assertFalse(stats.discard("0"))
+
+    def test_catalog_listener(self):
+        catalog = ConcurrentCatalog()
+        stats = CatalogStats()
+        catalog.add_listener(stats.on_change)
+        with catalog.batch() as batch:
+            batch.put(build_instrument("10.1000/a"))
+            batch.put(build_instrument("10.1000/b"))
+        catalog.delete("10.1000/a")
+        self.assertEqual(stats.total, 1)
+        self.assertEqual(stats.histogram('related_identifier_relation_type')["IsDescribedBy"], 1)
+
+
+class TestSharding(unittest.TestCase):
+
+    def test_hash_ring_moves_few_keys(self):
+        ring = HashRing([0, 1, 2])
+        keys = [f"10.1000/{i}" for i in range(1000)]
+        before = {key: ring.node_for(key) for key in keys}
+        ring.add(3)
+        moved = [key for key in keys if ring.node_for(key) != before[key]]
+        self.assertTrue(all(ring.node_for(key) == 3 for key in moved))
+        self.assertLess(len(moved), 500)
+        ring.remove(3)
+        self.assertEqual({key: ring.node_for(key) for key in keys}, before)
+
+    def test_sharded_catalog(self):
+        with ShardedCatalog(workers=2, index_paths=['name']) as catalog:
+            records = [build_instrument(f"10.1000/{i}", name=f"Instrument {i % 3}") for i in range(30)]
+            records[0].model = None
+            self.assertEqual(catalog.put_many(records), 30)
+            self.assertEqual(len(catalog), 30)
+            self.assertEqual(catalog.get("10.1000/7").name, "Instrument 1")
+            self.assertIsNone(catalog.get("10.1000/missing"))
+            self.assertEqual(catalog.count(Field('name') == "Instrument 0"), 10)
+            self.assertEqual(len(catalog.query(Field('model').is_none())), 1)
+
+            stats = catalog.stats()
+            self.assertEqual((stats['total'], stats['valid']), (30, 30))
+            self.assertAlmostEqual(stats['completeness']['model'], 29 / 30)
+            self.assertEqual(stats['histograms']['manufacturer_name'], {"Acme Inc": 30})
+
+            moved = catalog.add_worker()
+            self.assertEqual(catalog.workers, 3)
+            self.assertGreater(moved, 0)
+            self.assertEqual(len(catalog), 30)
+            self.assertTrue(all(catalog.get(f"10.1000/{i}") is not None for i in range(30)))
+            self.assertTrue(catalog.delete("10.1000/7"))
+            self.assertNotIn("10.1000/7", catalog)
+            with self.assertRaises(ValueError):
+                catalog.put(PIDInst(name="No identifier"))
+
+    def test_failed_rebalance_keeps_records(self):
+        with self.assertRaises(ValueError):
+            ShardedCatalog(workers=0)
+        with ShardedCatalog(workers=2) as catalog:
+            catalog.put_many(build_instrument(f"10.1000/{i}") for i in range(30))
+            call = catalog._call
+
+            def failing_call(node, command, argument=None):
+                if command == 'put':
+                    raise RuntimeError("worker failed")
+                return call(node, command, argument)
+
+            catalog._call = failing_call
+            with self.assertRaises(RuntimeError):
+                catalog.add_worker()
+            catalog._call = call
+            self.assertEqual((catalog.workers, len(catalog)), (2, 30))
+            self.assertTrue(all(f"10.1000/{i}" in catalog for i in range(30)))
+
+
+class TestArchive(unittest.TestCase):
+
+    def test_roundtrip(self):
+        records = [build_instrument(f"10.1000/{i}", name=f"Instrument {i}") for i in range(25)]
+        for codec in ('zlib', 'lzma'):
+            with tempfile.TemporaryDirectory() as tmp:
+                path = os.path.join(tmp, 'dump.pida')
+                self.assertEqual(write_archive(path, records, codec=codec, block_size=10), 25)
+                with ArchiveReader(path) as reader:
+                    self.assertEqual(reader.codec, codec)
+                    self.assertEqual(len(reader), 25)
+                    self.assertEqual(len(reader.blocks), 3)
+                    self.assertEqual([to_dict(r) for r in reader], [to_dict(r) for r in records])
+                    self.assertEqual(reader.get(17).name, "Instrument 17")
+                    self.assertEqual([r.name for r in reader.iter_parallel(workers=2)], [r.name for r in records])
+
+    def test_string_dictionary_shrinks_blocks(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'dump.pida')
+            with ArchiveWriter(path, block_size=100, level=0) as writer:
+                writer.write_many(build_instrument(f"10.1000/{i}") for i in range(100))
+            with ArchiveReader(path) as reader:
+                offset, length, count = reader.blocks[0]
+                plain = sum(len(json.dumps(doc)) for doc in reader.read_block(0))
+            self.assertLess(length * 2, plain)
+
+    def test_corrupt_block(self):
+        for codec in ('zlib', 'lzma'):
+            with tempfile.TemporaryDirectory() as tmp:
+                path = os.path.join(tmp, 'dump.pida')
+                write_archive(path, [build_instrument()], codec=codec)
+                with ArchiveReader(path) as reader:
+                    offset, length, _ = reader.blocks[0]
+                with open(path, 'r+b') as fh:
+                    fh.seek(offset + length // 2)
+                    fh.write(b'\xff' * 8)
+                with ArchiveReader(path) as reader:
+                    with self.assertRaises(ArchiveError):
+                        reader.read_block(0)
+
+    def test_integer_values_rejected(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            with ArchiveWriter(os.path.join(tmp, 'dump.pida'), block_size=1) as writer:
+                with self.assertRaises(TypeError):
+                    writer.write_document({'name': 'Instrument', 'count': 3})
+
+    def test_not_an_archive(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'dump.pida')
+            with open(path, 'wb') as fh:
+                fh.write(b'{}')
+            with self.assertRaises(ArchiveError):
+                ArchiveReader(path)
+
+    def test_header_only_archive(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'dump.pida')
+            with open(path, 'wb') as fh:
+                fh.write(b'PIDINSTA1\nzlib\n')
+            with warnings.catch_warnings(record=True) as caught:
+                warnings.simplefilter('always')
+                with self.assertRaises(ArchiveError):
+                    ArchiveReader(path)
+                gc.collect()
+            self.assertEqual([w for w in caught if issubclass(w.category, ResourceWarning)], [])
+
+
+class TestIncrementalIndexer(unittest.TestCase):
+
+    def write(self, root, name, record):
+        with open(os.path.join(root, name), 'w') as fh:
+            json.dump(to_dict(record), fh)
+
+    def test_incremental_runs(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            root = os.path.join(tmp, 'records')
+            os.makedirs(os.path.join(root, 'sub'))
+            manifest_path = os.path.join(tmp, 'manifest.json')
+            self.write(root, 'a.json', build_instrument("10.1000/a"))
+            self.write(root, os.path.join('sub', 'b.json'), build_instrument("10.1000/b"))
+            catalog = ConcurrentCatalog(index_paths=['name'])
+            stats = CatalogStats()
+            catalog.add_listener(stats.on_change)
+
+            changes = IncrementalIndexer(root, catalog, manifest_path).run()
+            self.assertEqual(len(changes.added), 2)
+            self.assertEqual(len(catalog), 2)
+
+            indexer = IncrementalIndexer(root, catalog, manifest_path)
+            generation = catalog.snapshot().generation
+            changes = indexer.run()
+            self.assertFalse(changes)
+            self.assertEqual(changes.unchanged, 2)
+            self.assertEqual(catalog.snapshot().generation, generation)
+
+            self.write(root, 'a.json', build_instrument("10.1000/a", name="Renamed"))
+            os.remove(os.path.join(root, 'sub', 'b.json'))
+            with open(os.path.join(root, 'broken.json'), 'w') as fh:
+                fh.write('{')
+            changes = indexer.run()
+            self.assertEqual((len(changes.changed), changes.removed, list(changes.errors)), (1, [os.path.join('sub', 'b.json')], ['broken.json']))
+            self.assertEqual(catalog.get("10.1000/a").name, "Renamed")
+            self.assertNotIn("10.1000/b", catalog)
+            self.assertEqual(catalog.query(Field('name') == "Renamed")[0].identifier.identifier_value, "10.1000/a")
+            self.assertEqual(stats.total, 1)
+            self.assertNotIn('broken.json', BuildManifest(manifest_path))
+
+    def test_key_moved_to_another_file(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            self.write(tmp, 'a.json', build_instrument("10.1000/k1"))
+            catalog = ConcurrentCatalog()
+            indexer = IncrementalIndexer(tmp, catalog)
+            indexer.run()
+            self.write(tmp, 'a.json', build_instrument("10.1000/k2"))
+            self.write(tmp, 'b.json', build_instrument("10.1000/k1", name="Moved"))
+            indexer.run()
+            self.assertEqual(sorted(r.identifier.identifier_value for r in catalog.snapshot()), ["10.1000/k1", "10.1000/k2"])
+            self.assertEqual(catalog.get("10.1000/k1").name, "Moved")
+            os.remove(os.path.join(tmp, 'a.json'))
+            self.write(tmp, 'c.json', build_instrument("10.1000/k1", name="Duplicate"))
+            indexer.run()
+            os.remove(os.path.join(tmp, 'b.json'))
+            indexer.run()
+            self.assertEqual([r.name for r in catalog.snapshot()], ["Duplicate"])
+
+    def test_touched_file_is_not_reparsed(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            self.write(tmp, 'a.json', build_instrument("10.1000/a"))
+            loaded = []
+            def loader(path):
+                loaded.append(path)
+                with open(path) as fh:
+                    return from_dict(json.load(fh))
+            indexer = IncrementalIndexer(tmp, ConcurrentCatalog(), loader=loader)
+            indexer.run()
+            stat = os.stat(os.path.join(tmp, 'a.json'))
+            os.utime(os.path.join(tmp, 'a.json'), ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+            changes = indexer.run()
+            self.assertEqual((len(changes.touched), len(loaded)), (1, 1))
+
+
+class TestBloomFilter(unittest.TestCase):
+
+    def test_normalize_identifier(self):
+        self.assertEqual(normalize_identifier(" https://doi.org/10.1000/ABC "), "10.1000/abc")
+        self.assertEqual(normalize_identifier("doi:10.1000/abc"), "10.1000/abc")
+        self.assertEqual(normalize_identifier("https://orcid.org/0000-0002-1825-009X"), "0000-0002-1825-009x")
+
+    def test_membership_and_error_rate(self):
+        bloom = BloomFilter(capacity=2000, error_rate=0.01)
+        bloom.add_many(f"10.1000/{i}" for i in range(2000))
+        self.assertTrue(all(bloom.contains_many(f"https://doi.org/10.1000/{i}" for i in range(2000))))
+        false_positives = sum(bloom.contains_many(f"10.9999/{i}" for i in range(10000)))
+        self.assertLess(false_positives, 300)
+
+    def test_add_records(self):
+        bloom = BloomFilter(capacity=100)
+        self.assertEqual(bloom.add_records([build_instrument()]), 3)
+        self.assertIn("10.1000/RETWEBWB", bloom)
+        self.assertIn("0000-ABCD-1234-WXYZ", bloom)
+        self.assertNotIn("10.1000/other", bloom)
+
+    def test_save_and_mmap(self):
+        bloom = BloomFilter(capacity=100)
+        bloom.add("10.1000/a")
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'ids.bloom')
+            bloom.save(path)
+            with BloomFilter.load(path) as mapped:
+                self.assertIn("10.1000/a", mapped)
+                self.assertEqual((mapped.num_bits, len(mapped)), (bloom.num_bits, 1))
+                with self.assertRaises(TypeError):
+                    mapped.add("10.1000/b")
+            with BloomFilter.load(path, writable=True) as mapped:
+                mapped.add("10.1000/b")
+            loaded = BloomFilter.load(path, use_mmap=False)
+            self.assertIn("10.1000/b", loaded)
+            self.assertEqual(len(loaded), 2)
+
+
+class TestSiteGenerator(unittest.TestCase):
+
+    def test_render_page(self):
+        instrument = build_instrument()
+        instrument.description = '<script>alert(1)</script>'
+        page = render_page(to_dict(instrument), 'https://www.landingpage.com')
+        self.assertIn('<h1>Instrument XYZ</h1>', page)
+        self.assertIn('&lt;script&gt;alert(1)&lt;/script&gt;', page)
+        self.assertIn('<a href="https://doi.org/10.1000/retwebwb">10.1000/retwebwb</a>', page)
+        self.assertIn('<a href="https://www.acme.com">Acme Inc</a>', page)
+        self.assertIn('IsDescribedBy: <a href="https://www.pathtopaper.edu.au">Documentation Paper</a>', page)
+        jsonld = page.split('<script type="application/ld+json">')[1].split('</script>')[0]
+        self.assertEqual(json.loads(jsonld)['@type'], 'Product')
+
+    def test_incremental_build(self):
+        records = [build_instrument(f"10.1000/{i}", f"Instrument {i}") for i in range(5)]
+        records[0].landing_page = 'https://instruments.example.org/acme/zero'
+        with tempfile.TemporaryDirectory() as tmp:
+            site = SiteGenerator(tmp, 'https://instruments.example.org', sitemap_limit=2)
+            report = site.build(records)
+            self.assertEqual((report.rendered, report.unchanged), (5, 0))
+            self.assertTrue(os.path.exists(os.path.join(tmp, 'acme', 'zero', 'index.html')))
+            self.assertTrue(os.path.exists(os.path.join(tmp, 'instrument', '10.1000', '3', 'index.html')))
+            self.assertEqual(report.sitemaps, ['sitemap-1.xml', 'sitemap-2.xml', 'sitemap-3.xml'])
+            with open(os.path.join(tmp, 'sitemap-1.xml'), encoding='utf-8') as fh:
+                self.assertIn('<loc>https://instruments.example.org/instrument/10.1000/1/</loc>', fh.read())
+            with open(os.path.join(tmp, 'instrument', '10.1000', '1', 'index.html'), encoding='utf-8') as fh:
+                self.assertIn('<link rel="canonical" href="https://instruments.example.org/instrument/10.1000/1/">', fh.read())
+
+            records[1].name = 'Renamed'
+            report = site.build(records[:4])
+            self.assertEqual((report.rendered, report.unchanged, report.removed), (1, 3, 1))
+            self.assertEqual(len(report.sitemaps), 2)
+            self.assertFalse(os.path.exists(os.path.join(tmp, 'sitemap-3.xml')))
+            with open(os.path.join(tmp, 'sitemap.xml'), encoding='utf-8') as fh:
+                self.assertIn('https://instruments.example.org/sitemap-2.xml', fh.read())
+
+    def test_pages_stay_inside_output_dir(self):
+        site = SiteGenerator('site', 'https://instruments.example.org')
+        instrument = build_instrument("10.1000/a")
+        for landing_page in ('https://instruments.example.org/../../escaped/page.html', 'https://instruments.example.org//etc/page.html'):
+            instrument.landing_page = None
+            instrument.landing_page = landing_page
+            self.assertEqual(site.page_location(to_dict(instrument)), ('instrument/10.1000/a/index.html', 'https://instruments.example.org/instrument/10.1000/a/'))
+        for identifier in ("..", "10.1000/../a", "10.1000//a", "10.1000/./a"):
+            self.assertIsNone(site.page_location(to_dict(build_instrument(identifier))))
+        self.assertEqual(site.page_location(to_dict(build_instrument("10.1000/a b?"))), ('instrument/10.1000/a%20b%3F/index.html', 'https://instruments.example.org/instrument/10.1000/a%20b%3F/'))
+        with tempfile.TemporaryDirectory() as tmp:
+            outside = os.path.join(tmp, 'outside.html')
+            with open(outside, 'w', encoding='utf-8') as fh:
+                fh.write('keep')
+            output_dir = os.path.join(tmp, 'site')
+            os.makedirs(output_dir)
+            with open(os.path.join(output_dir, '.pidinst-site.json'), 'w', encoding='utf-8') as fh:
+                json.dump({'../outside.html': 'stale'}, fh)
+            report = SiteGenerator(output_dir, 'https://instruments.example.org').build([instrument])
+            self.assertEqual((report.rendered, report.removed), (1, 0))
+            self.assertTrue(os.path.exists(outside))
+            self.assertEqual(sorted(os.listdir(tmp)), ['outside.html', 'site'])
+            self.assertTrue(os.path.exists(os.path.join(output_dir, 'instrument', '10.1000', 'a', 'index.html')))
+
+    def test_parallel_build(self):
+        records = [build_instrument(f"10.1000/{i}") for i in range(20)]
+        with tempfile.TemporaryDirectory() as tmp:
+            report = SiteGenerator(tmp, 'https://instruments.example.org', workers=2, chunk_size=3).build(records)
+            self.assertEqual(report.rendered, 20)
+            self.assertEqual(len(os.listdir(os.path.join(tmp, 'instrument', '10.1000'))), 20)
+
+
+class TestSchema(unittest.TestCase):
+
+    def test_schema_follows_setters(self):
+        schema = json_schema()
+        self.assertEqual(schema['required'], ['name'])
+        self.assertEqual(schema['properties']['name'], {'type': 'string', 'minLength': 1, 'maxLength': 199})
+        self.assertEqual(schema['properties']['landing_page'], {'type': ['string', 'null'], 'pattern': '^http'})
+        identifier = schema['properties']['identifier']['properties']
+        self.assertEqual(identifier['identifier_type']['enum'], INSTRUMENT_IDENTIFIER_TYPES)
+        related = schema['properties']['related_identifiers']['items']['properties']
+        self.assertEqual(related['related_identifier_relation_type']['enum'], RELATED_IDENTIFIER_RELATION_TYPES)
+
+    def test_validator_agrees_with_from_dict(self):
+        validator = SchemaValidator()
+        doc = to_dict(build_instrument())
+        variants = [doc, 5, dict(doc, name='x' * 199), dict(doc, name='x' * 200), dict(doc, name=None), dict(doc, extra=1),
+                    dict(doc, landing_page='ftp://host'), dict(doc, description=3), dict(doc, owners=None), dict(doc, owners={}),
+                    dict(doc, identifier={'identifier_value': '10.1/x', 'identifier_type': 'ISBN'}),
+                    dict(doc, model={'model_name': 'M', 'model_identifier': {'model_identifier_value': 'v'}}),
+                    dict(doc, manufacturers=[{'manufacturer_name': ''}]),
+                    dict(doc, related_identifiers=[dict(doc['related_identifiers'][0], related_identifier_name='')])]
+        for variant in variants:
+            try:
+                from_dict(variant)
+                constructed = True
+            except (TypeError, ValueError):
+                constructed = False
+            self.assertEqual(validator.is_valid(variant), constructed, variant)
+
+    def test_batch_errors(self):
+        doc = to_dict(build_instrument())
+        bad = dict(doc, name='', owners=[{'owner_name': 'A', 'owner_identifier': {'owner_identifier_value': 'x', 'owner_identifier_type': 'DUMMY'}}])
+        valid, errors = validate_documents([doc, bad, doc, {'name': 'B', 'colour': 'red'}])
+        self.assertEqual(len(valid), 2)
+        self.assertEqual(errors, [
+            ValidationError(1, '/name', 'cannot be an empty string'),
+            ValidationError(1, '/owners/0/owner_identifier/owner_identifier_type', "'DUMMY' is not a recognised value"),
+            ValidationError(3, '/colour', 'is not a recognised field'),
+        ])
+
+
+class TestRDF(unittest.TestCase):
+
+    def test_relation_predicates(self):
+        self.assertEqual(set(RELATION_PREDICATES), set(RELATED_IDENTIFIER_RELATION_TYPES))
+        self.assertEqual(RELATION_PREDICATES['HasComponent'], 'http://purl.org/dc/terms/hasPart')
+        self.assertEqual(RELATION_PREDICATES['WasUsedIn'], 'https://w3id.org/pidinst/terms#wasUsedIn')
+
+    def test_ntriples(self):
+        instrument = build_instrument()
+        instrument.description = 'Line one\nsays "hi"'
+        fh = io.StringIO()
+        count = write_ntriples([instrument, build_instrument("10.1000/other")], fh)
+        lines = fh.getvalue().splitlines()
+        self.assertEqual(len(lines), count)
+        self.assertIn('<https://doi.org/10.1000/retwebwb> <http://purl.org/dc/terms/description> "Line one\\nsays \\"hi\\"" .', lines)
+        self.assertIn('<https://doi.org/10.1000/retwebwb> <https://w3id.org/pidinst/terms#owner> <https://orcid.org/0000-ABCD-1234-WXYZ> .', lines)
+        self.assertIn('<https://doi.org/10.1000/retwebwb> <https://w3id.org/pidinst/terms#isDescribedBy> <https://www.pathtopaper.edu.au> .', lines)
+        # Blank nodes of different records never collide
+        self.assertIn('<https://doi.org/10.1000/retwebwb> <https://w3id.org/pidinst/terms#model> _:r0nmodel .', lines)
+        self.assertIn('<https://doi.org/10.1000/other> <https://w3id.org/pidinst/terms#model> _:r1nmodel .', lines)
+
+    def test_triples_are_lazy(self):
+        def records():
+            yield build_instrument()
+            raise AssertionError("second record requested too early")
+        subject, predicate, obj = next(iter_triples(records()))
+        self.assertEqual((subject, obj), ("https://doi.org/10.1000/retwebwb", "https://w3id.org/pidinst/terms#Instrument"))
+        self.assertIsInstance(next(t for t in iter_triples([build_instrument()]) if t[1].endswith('title'))[2], Literal)
+
+    def test_jsonld_chunks(self):
+        records = [build_instrument(f"10.1000/{i}") for i in range(5)]
+        chunks = list(iter_jsonld_chunks(records, chunk_size=2))
+        self.assertEqual(len(chunks), 3)
+        graph = {node['@id']: node for node in chunks[0]['@graph']}
+        self.assertEqual(graph['https://doi.org/10.1000/0']['@type'], ['pidinst:Instrument'])
+        self.assertEqual(graph['https://doi.org/10.1000/1']['dcterms:title'], ['Instrument XYZ'])
+        # The manufacturer shared by both records is described once per chunk
+        self.assertEqual(graph['https://www.acme.com']['pidinst:manufacturerName'], ['Acme Inc'])
+        self.assertEqual(chunks[0]['@context']['dcterms'], 'http://purl.org/dc/terms/')
+
+
+class TestLazyImport(unittest.TestCase):
+
+    @staticmethod
+    def imported_modules(statement):
+        ''' Returns the modules a statement imports in a fresh interpreter, from -X importtime '''
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c', statement], capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        return {line.rsplit('|', 1)[1].strip() for line in result.stderr.splitlines() if line.startswith('import time:')}
+
+    def test_package_import_loads_no_submodules(self):
+        modules = self.imported_modules('import pypidinst')
+        self.assertIn('pypidinst', modules)
+        self.assertEqual([name for name in modules if name.startswith('pypidinst.')], [])
+        for heavy in ('multiprocessing', 'lzma', 'concurrent.futures', 'json', 'threading'):
+            self.assertNotIn(heavy, modules)
+
+    def test_names_load_only_their_subsystem(self):
+        modules = self.imported_modules('from pypidinst import PIDInst, from_dict, ArchiveReader')
+        self.assertIn('pypidinst.archive', modules)
+        for heavy in ('multiprocessing', 'lzma', 'concurrent.futures', 'pypidinst.sharding', 'pypidinst.catalog'):
+            self.assertNotIn(heavy, modules)
+
+    def test_public_api(self):
+        import pypidinst
+        self.assertIs(pypidinst.PIDInst, PIDInst)
+        self.assertIs(pypidinst.SchemaValidator, SchemaValidator)
+        self.assertIn('ShardedCatalog', dir(pypidinst))
+        with self.assertRaises(AttributeError):
+            pypidinst.not_a_name
+
+    def test_every_submodule_resolves(self):
+        package = os.path.dirname(os.path.abspath(__file__))
+        names = sorted(os.path.splitext(filename)[0] for filename in os.listdir(package)
+                       if filename.endswith('.py') and filename not in ('__init__.py', '__main__.py', 'tests.py'))
+        statement = f'import pypidinst\nfor name in {names!r}: getattr(pypidinst, name)'
+        self.assertTrue({f'pypidinst.{name}' for name in names} <= self.imported_modules(statement))
+
+
+class TestEvents(unittest.TestCase):
+
+    def test_setters_and_appends_emit_events(self):
+        bus = EventBus()
+        batches = []
+        bus.subscribe(batches.append)
+        instrument = bus.watch(build_instrument())
+        instrument.name = "Renamed"
+        owner = Owner(owner_name="John Doe")
+        instrument.append_owner(owner)
+        related = instrument.related_identifiers[0]
+        instrument.remove_related_identifier(related)
+        self.assertEqual([[type(event) for event in batch] for batch in batches], [[FieldChanged], [OwnerAppended], [RelatedIdentifierRemoved]])
+        changed = batches[0][0]
+        self.assertEqual((changed.key, changed.field, changed.old, changed.new), ("10.1000/retwebwb", 'name', "Instrument XYZ", "Renamed"))
+        self.assertEqual(batches[1][0].new, freeze(owner))
+        self.assertEqual([event.sequence for batch in batches for event in batch], [1, 2, 3])
+        with self.assertRaises(ValueError):
+            instrument.remove_related_identifier(related)
+        bus.unwatch(instrument)
+        instrument.name = "Unwatched"
+        self.assertEqual(len(batches), 3)
+
+    def test_batches_are_coalesced(self):
+        bus = EventBus()
+        batches = []
+        bus.subscribe(batches.append)
+        instrument = bus.watch(build_instrument())
+        with bus.batch():
+            instrument.name = "First"
+            instrument.description = "Changed"
+            instrument.name = "Second"
+            related = RelatedIdentifier(related_identifier_value="https://example.org", related_identifier_type="URL", related_identifier_relation_type="IsDescribedBy")
+            instrument.append_related_identifier(related)
+            instrument.remove_related_identifier(related)
+            instrument.description = 'A description of this instrument'
+        self.assertEqual(len(batches), 1)
+        self.assertEqual([(event.field, event.old, event.new) for event in batches[0]], [('name', "Instrument XYZ", "Second")])
+
+    def test_scratch_records_need_no_bus(self):
+        scratch = object.__new__(PIDInst)
+        scratch.name = "Scratch"
+        self.assertEqual(freeze(build_instrument()).evolve(name="Evolved").name, "Evolved")
+        instrument = EventBus().watch(build_instrument())
+        self.assertEqual(pickle.loads(pickle.dumps(instrument)).name, "Instrument XYZ")
+        self.assertIsNone(copy.deepcopy(instrument)._bus)
+
+    def test_catalog_commits_publish_one_batch(self):
+        bus = EventBus()
+        batches = []
+        bus.subscribe(batches.append, kinds=[RecordAdded, RecordReplaced, RecordRemoved])
+        catalog = ConcurrentCatalog([build_instrument("10.1000/a"), build_instrument("10.1000/b")], bus=bus)
+        with catalog.batch() as batch:
+            batch.put(build_instrument("10.1000/a", name="Renamed"))
+            batch.delete("10.1000/b")
+        catalog.put(build_instrument("10.1000/a", name="Renamed"))
+        self.assertEqual([[type(event) for event in batch] for batch in batches], [[RecordAdded, RecordAdded], [RecordReplaced, RecordRemoved]])
+        replaced = batches[1][0]
+        self.assertEqual((replaced.old.name, replaced.new.name), ("Instrument XYZ", "Renamed"))
+
+    def test_failing_subscriber_does_not_skip_listeners(self):
+        bus = EventBus()
+        def fail(events):
+            raise RuntimeError("subscriber failed")
+        bus.subscribe(fail)
+        catalog = ConcurrentCatalog(bus=bus)
+        stats = CatalogStats()
+        catalog.add_listener(stats.on_change)
+        with self.assertRaises(RuntimeError):
+            catalog.put(build_instrument("10.1000/a"))
+        self.assertEqual(len(catalog), 1)
+        self.assertEqual(stats.total, 1)
+
+    def test_event_log_replay(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'events.jsonl')
+            with EventLog(path, fsync=False) as log:
+                bus = EventBus(log)
+                catalog = ConcurrentCatalog(bus=bus)
+                instrument = bus.watch(build_instrument())
+                catalog.put(instrument)
+                instrument.model = Model(model_name="Model B")
+                instrument.append_related_identifier(RelatedIdentifier(related_identifier_value="https://example.org", related_identifier_type="URL", related_identifier_relation_type="References"))
+                catalog.put(instrument)
+            with open(path, 'a', encoding='utf-8') as fh:
+                fh.write('{"sequence": 5, "kind"')
+            with EventLog(path) as log:
+                self.assertEqual(log.last_sequence, 4)
+                batches = []
+                self.assertEqual(log.replay(batches.append, after=1, batch_size=2), 4)
+                self.assertEqual([[type(event) for event in batch] for batch in batches], [[FieldChanged, RelatedIdentifierAppended], [RecordReplaced]])
+                self.assertEqual(batches[0][0].new, FrozenModel(model_name="Model B"))
+                self.assertEqual(batches[1][0].new, freeze(instrument))
+                self.assertEqual(EventBus(log).sequence, 4)
+
+    def test_async_subscription(self):
+        bus = EventBus()
+        instrument = bus.watch(build_instrument())
+
+        async def consume():
+            subscription = bus.subscribe_async()
+            writer = threading.Thread(target=lambda: setattr(instrument, 'name', "Renamed"))
+            writer.start()
+            writer.join()
+            events = await subscription.get()
+            subscription.close()
+            remaining = [batch async for batch in subscription]
+            return events, remaining
+
+        events, remaining = asyncio.run(consume())
+        self.assertEqual([event.new for event in events], ["Renamed"])
+        self.assertEqual(remaining, [])
+
+
+class TestAllocations(unittest.TestCase):
+
+    def test_record_lists_exist_from_construction(self):
+        record = PIDInst(name='Instrument 1')
+        owners = record.owners
+        self.assertEqual(owners, [])
+        threads = [threading.Thread(target=record.append_owner, args=(Owner(owner_name=f'Owner {i}'),)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertIs(record.owners, owners)
+        self.assertEqual(len(record.owners), 8)
+        self.assertEqual(from_dict(to_dict(record)).related_identifiers, [])
+
+    def test_records_have_no_instance_dict(self):
+        record = PIDInst(name='Instrument 1')
+        with self.assertRaises(AttributeError):
+            record.colour = 'red'
+        self.assertFalse(hasattr(Owner(owner_name='Owner 1'), '__dict__'))
+        for entry in (record, Owner(owner_name='Owner 1'), Model(model_name='Model 1')):
+            self.assertIs(weakref.ref(entry)(), entry)
+        self.assertIsNot(copy.deepcopy(record), record)
+
+    def test_operations_within_budgets(self):
+        reports = run_budgets(1000)
+        self.assertEqual([report.operation for report in reports], list(OPERATIONS))
+        for report in reports:
+            self.assertGreater(report.peak, 0)
+            self.assertGreaterEqual(report.peak, report.retained)
+
+    def test_exceeded_budget_fails(self):
+        report = measure('construct_minimal', 500)
+        check_budgets([report], {'construct_minimal': {'retained': report.retained_per_record + 1}})
+        with self.assertRaises(AllocationBudgetError) as context:
+            check_budgets([report], {'construct_minimal': {'retained': 10}})
+        self.assertIn('construct_minimal', context.exception.failures[0])
+
+
+class TestCommandLine(unittest.TestCase):
+
+    def run_cli(self, *argv):
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            status = cli.main(list(argv))
+        return status, out.getvalue()
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.path = lambda name: os.path.join(self.tmp.name, name)
+        with open(self.path('a.jsonl'), 'w') as fh:
+            dump_records([build_instrument(f"10.1000/{i}") for i in range(30)], fh)
+        with open(self.path('b.jsonl'), 'w') as fh:
+            doc = to_dict(build_instrument("10.1000/bad"))
+            doc['name'] = ''
+            fh.write('{not json\n' + json.dumps(doc) + '\n')
+
+    def errors(self):
+        with open(self.path('errors.jsonl')) as fh:
+            return [json.loads(line) for line in fh]
+
+    def test_validate(self):
+        status, out = self.run_cli('validate', self.path('*.jsonl'), '--errors', self.path('errors.jsonl'))
+        self.assertEqual(status, 1)
+        self.assertEqual(json.loads(out), {'checked': 32, 'valid': 30, 'errors': 2})
+        errors = self.errors()
+        self.assertEqual([(e['line'], e['error']) for e in errors], [(1, 'JSONDecodeError'), (2, 'ValidationError')])
+        self.assertEqual(errors[1]['path'], '/name')
+        self.assertEqual(self.run_cli('validate', self.path('a.jsonl'), '--strict')[0], 0)
+
+    def test_convert_and_stats_with_jobs(self):
+        archive = self.path('out.pida')
+        status, _ = self.run_cli('convert', '--to', 'archive', '-o', archive, '--jobs', '2', '--chunk-size', '7',
+                                 self.path('a.jsonl'), self.path('b.jsonl'), '--errors', self.path('errors.jsonl'))
+        self.assertEqual(status, 1)
+        self.assertEqual(len(self.errors()), 2)
+        with ArchiveReader(archive) as reader:
+            self.assertEqual([r.identifier.identifier_value for r in reader], [f"10.1000/{i}" for i in range(30)])
+
+        status, out = self.run_cli('stats', '--jobs', '2', archive)
+        self.assertEqual(status, 0)
+        stats = json.loads(out)
+        self.assertEqual((stats['total'], stats['valid']), (30, 30))
+        self.assertEqual(stats['histograms']['identifier_type'], {'DOI': 30})
+
+    def test_convert_csv_and_index(self):
+        with open(self.path('in.csv'), 'w') as fh:
+            fh.write(TestImporter.CSV)
+        status, out = self.run_cli('convert', '--to', 'jsonl', self.path('in.csv'), '--errors', self.path('errors.jsonl'))
+        self.assertEqual(status, 1)
+        self.assertEqual([from_dict(json.loads(line)).name for line in out.splitlines()], ['Instrument A', 'Instrument C'])
+        self.assertEqual([(e['line'], e['error']) for e in self.errors()], [(3, 'RowError')])
+
+        status, out = self.run_cli('index', '-o', self.path('ids.bloom'), '--capacity', '1000', self.path('a.jsonl'))
+        self.assertEqual((status, json.loads(out)['identifiers']), (0, 90))
+        self.assertIn("https://doi.org/10.1000/7", BloomFilter.load(self.path('ids.bloom'), use_mmap=False))
+
+    def test_unreadable_inputs_are_reported(self):
+        with open(self.path('big.csv'), 'w') as fh:
+            fh.write(TestImporter.CSV.splitlines()[0] + '\n"' + 'x' * (csv.field_size_limit() + 1) + '"\n')
+        archive = self.path('corrupt.pida')
+        write_archive(archive, [build_instrument()])
+        with ArchiveReader(archive) as reader:
+            offset, length, _ = reader.blocks[0]
+        with open(archive, 'r+b') as fh:
+            fh.seek(offset + length // 2)
+            fh.write(b'\xff' * 8)
+        status, out = self.run_cli('validate', self.path('big.csv'), archive, self.path('a.jsonl'), '--errors', self.path('errors.jsonl'))
+        self.assertEqual(status, 1)
+        self.assertEqual(json.loads(out)['valid'], 30)
+        self.assertEqual([(e['source'], e['error']) for e in self.errors()], [(self.path('big.csv'), 'CSVError'), (archive, 'ArchiveError')])
+
+
 if __name__ == '__main__':
     unittest.main()
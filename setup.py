@@ -4,5 +4,8 @@ setup(
     name='PyPIDInst',
     version='1.0',
     packages=find_packages(),
-    install_requires = []
+    install_requires = [],
+    entry_points = {
+        'console_scripts': ['pypidinst=pypidinst.cli:main'],
+    },
 )
\ No newline at end of file